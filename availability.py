@@ -0,0 +1,194 @@
+"""Расчёт свободных слотов для записи.
+
+Модуль не зависит от aiogram и БД: на вход подаются рабочие часы и занятые
+интервалы в минутах от начала дня, на выходе — список стартовых минут.
+Занятые интервалы сортируются и сливаются один раз, после чего кандидаты
+проверяются одним проходом (O(слоты + записи) вместо O(слоты × записи)).
+"""
+from datetime import date as _date, datetime
+
+from config import SLOT_STEP_MINUTES, BOOKING_BUFFER_MINUTES, CLOSED_WEEKDAYS
+
+DAY_MINUTES = 24 * 60
+_EPOCH_ORDINAL = _date(1970, 1, 1).toordinal()
+
+
+def to_minutes(hhmm: str) -> int:
+    """'HH:MM' -> минуты от начала дня"""
+    hours, minutes = hhmm.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def format_minutes(minutes: int) -> str:
+    """минуты от начала дня -> 'HH:MM'"""
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+# Эпоха-минуты: минуты от 1970-01-01 00:00 по местному (наивному) времени салона.
+# В БД так хранятся начало и конец записи (bookings.start_min / end_min), чтобы
+# пересечения и диапазоны считались целочисленными сравнениями по индексу.
+
+def day_epoch_minutes(day: str) -> int:
+    """'YYYY-MM-DD' -> эпоха-минута начала дня"""
+    return (_date.fromisoformat(day).toordinal() - _EPOCH_ORDINAL) * DAY_MINUTES
+
+
+def epoch_minutes(day: str, hhmm: str) -> int:
+    """Дата и 'HH:MM' -> эпоха-минута"""
+    return day_epoch_minutes(day) + to_minutes(hhmm)
+
+
+def datetime_epoch_minutes(moment: datetime) -> int:
+    """datetime -> эпоха-минута (секунды отбрасываются)"""
+    return (moment.toordinal() - _EPOCH_ORDINAL) * DAY_MINUTES + moment.hour * 60 + moment.minute
+
+
+def is_closed(day: str) -> bool:
+    """Выходной ли день ('YYYY-MM-DD') по CLOSED_WEEKDAYS"""
+    return _date.fromisoformat(day).weekday() in CLOSED_WEEKDAYS
+
+
+def merge_intervals(intervals, buffer: int = 0) -> list:
+    """Отсортировать и слить пересекающиеся интервалы [start, end),
+    расширив каждый на buffer минут с обеих сторон"""
+    merged = []
+    for start, end in sorted((s - buffer, e + buffer) for s, e in intervals):
+        if merged and start < merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def free_slots(day_start: int, day_end: int, busy, duration: int,
+               step: int = SLOT_STEP_MINUTES, buffer: int = BOOKING_BUFFER_MINUTES) -> list:
+    """Свободные стартовые минуты шагом step, в которые помещается услуга длительностью duration.
+
+    busy — итерируемое (start, end) в минутах; между записями выдерживается buffer минут."""
+    duration = max(duration or 0, 0)
+    step = max(step, 1)
+    merged = merge_intervals(busy, buffer)
+    slots = []
+    i = 0
+    current = day_start
+    while current + duration <= day_end:
+        # интервалы, закончившиеся до текущего кандидата, больше не нужны
+        while i < len(merged) and merged[i][1] <= current:
+            i += 1
+        if i < len(merged) and merged[i][0] < current + duration:
+            # пересечение: сразу перескакиваем к первому шагу после конца интервала
+            end = merged[i][1]
+            current += max(1, -(-(end - current) // step)) * step
+            continue
+        slots.append(current)
+        current += step
+    return slots
+
+
+class AvailabilityIndex:
+    """Материализованная занятость по мастерам и дням для скользящего окна записи.
+
+    Индекс разбит на разделы (master_id, date): для каждого загруженного дня
+    мастера хранятся интервалы его активных записей по id и уже посчитанные
+    списки слотов. Поиск слотов одного
+    мастера не зависит от числа мастеров в салоне. Функции записи в database.py
+    патчат индекс точечно, поэтому показ слотов сводится к поиску в памяти.
+    Разделы, которых нет в индексе, считаются промахом и догружаются из БД
+    вызывающим кодом."""
+
+    def __init__(self):
+        self._days = {}    # (master_id, date) -> {booking_id: (start, end)}
+        self._slots = {}   # (master_id, date) -> {(day_start, day_end, duration, step, buffer): [минуты]}
+        self._where = {}   # booking_id -> (master_id, date)
+        self.hits = 0
+        self.misses = 0
+        # счётчик изменений: позволяет отбросить загрузку дня, обогнанную параллельной записью
+        self.version = 0
+
+    def has_day(self, master_id: int, date: str) -> bool:
+        return (master_id, date) in self._days
+
+    def load_day(self, master_id: int, date: str, rows):
+        """Заполнить день мастера строками (booking_id, start, end), заменив прежнее содержимое"""
+        key = (master_id, date)
+        self._drop(key)
+        self._days[key] = {}
+        for booking_id, start, end in rows:
+            self._put(key, booking_id, start, end)
+
+    def _drop(self, key):
+        for booking_id in self._days.pop(key, {}):
+            self._where.pop(booking_id, None)
+        self._slots.pop(key, None)
+
+    def clear(self):
+        """Забыть все дни (данные изменил другой процесс) — догрузятся по промаху"""
+        self.version += 1
+        self._days.clear()
+        self._slots.clear()
+        self._where.clear()
+
+    def evict_before(self, date: str):
+        """Забыть прошедшие дни всех мастеров (ISO-даты сравниваются как строки)"""
+        for key in [k for k in self._days if k[1] < date]:
+            self._drop(key)
+
+    def add(self, master_id: int, date: str, booking_id: int, start: int, end: int):
+        """Учесть новую активную запись; незагруженные дни не трогаем — подгрузятся при промахе"""
+        self.version += 1
+        key = (master_id, date)
+        if key in self._days:
+            self._put(key, booking_id, start, end)
+
+    def remove(self, booking_id: int):
+        """Убрать запись (удалена или перестала быть активной)"""
+        self.version += 1
+        key = self._where.pop(booking_id, None)
+        if key is None:
+            return
+        self._days[key].pop(booking_id, None)
+        self._slots.pop(key, None)
+
+    def busy(self, master_id: int, date: str) -> list:
+        """Занятые интервалы дня мастера или None, если день не загружен"""
+        day = self._days.get((master_id, date))
+        if day is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return list(day.values())
+
+    def slots(self, master_id: int, date: str, day_start: int, day_end: int, duration: int,
+              step: int = SLOT_STEP_MINUTES, buffer: int = BOOKING_BUFFER_MINUTES) -> list:
+        """Свободные слоты загруженного дня мастера (None при промахе), кэшируются до изменения дня"""
+        key = (day_start, day_end, duration, step, buffer)
+        cached = self._slots.get((master_id, date), {}).get(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        busy = self.busy(master_id, date)
+        if busy is None:
+            return None
+        result = free_slots(day_start, day_end, busy, duration, step, buffer)
+        self._slots.setdefault((master_id, date), {})[key] = result
+        return result
+
+    def snapshot(self, master_id: int, date: str) -> list:
+        """Отсортированные интервалы дня мастера без учёта в счётчиках (для сверки с БД)"""
+        return sorted(self._days.get((master_id, date), {}).values())
+
+    def loaded_days(self) -> list:
+        """Загруженные разделы (master_id, date)"""
+        return sorted(self._days)
+
+    def stats(self) -> dict:
+        return {
+            "days": len(self._days), "masters": len({master for master, _ in self._days}),
+            "bookings": len(self._where), "hits": self.hits, "misses": self.misses,
+        }
+
+    def _put(self, key, booking_id, start, end):
+        self._days[key][booking_id] = (start, end)
+        self._where[booking_id] = key
+        self._slots.pop(key, None)
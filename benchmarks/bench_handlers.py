@@ -0,0 +1,312 @@
+"""Нагрузочный замер обработчиков: настоящий dp, синтетические апдейты, Bot без сети.
+
+N пользователей одновременно проходят сценарий записи
+book -> услуга -> дата -> время -> подтверждение, параллельно админы листают
+список записей. Запросы к Telegram перехватывает StubSession (можно добавить
+искусственную задержку API). Отчёт: p50/p95/p99 по обработчикам, запросы к БД
+на апдейт (отдельный последовательный прогон) и пропускная способность.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_handlers --users 200 --label my-change
+    python -m benchmarks.bench_handlers --compare benchmarks/results/old.json
+
+Результат сохраняется в benchmarks/results/<label>.json. Работает на временной
+БД и не трогает nails.db.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ["DB_NAME"] = os.path.join(tempfile.mkdtemp(prefix="bench_handlers_"), "bench.db")
+os.environ.setdefault("BOT_TOKEN", "123456:bench-token")
+os.environ["ADMIN_ID"] = "1"
+os.environ["METRICS_PORT"] = "0"
+os.environ["METRICS_LOG_INTERVAL"] = "0"
+# синтетические клиенты жмут кнопки без пауз — ограничение частоты нажатий по умолчанию выключено
+os.environ.setdefault("THROTTLE_RATE", "0")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.methods import SendMessage, SendDocument  # noqa: E402
+from aiogram.types import Chat, Message, Update  # noqa: E402
+
+import database  # noqa: E402
+import metrics  # noqa: E402
+from config import BOOKING_WINDOW_DAYS  # noqa: E402
+import main as app  # noqa: E402  (подключает роутеры к dp)
+from bot import bot, dp  # noqa: E402
+
+ADMIN_ID = 1
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+PERCENTILES = (50, 95, 99)
+
+
+class StubSession(BaseSession):
+    """Сессия Bot API без сети: запоминает последнюю клавиатуру в чате и отвечает заглушками"""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.markups = {}
+        self.calls = 0
+        self._ids = itertools.count(1000)
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        chat_id = getattr(method, "chat_id", None)
+        markup = getattr(method, "reply_markup", None)
+        if chat_id is not None and markup is not None:
+            self.markups[chat_id] = markup
+        if isinstance(method, (SendMessage, SendDocument)):
+            return Message(
+                message_id=next(self._ids), date=datetime.now(),
+                chat=Chat(id=chat_id, type="private"), text=getattr(method, "text", None),
+            )
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+    def buttons(self, chat_id: int, prefix: str) -> list:
+        markup = self.markups.get(chat_id)
+        if markup is None:
+            return []
+        return [b.callback_data for row in markup.inline_keyboard for b in row
+                if b.callback_data and b.callback_data.startswith(prefix)]
+
+
+_update_ids = itertools.count(1)
+
+
+def callback_update(user_id: int, data: str, message_id: int = 1) -> Update:
+    chat = {"id": user_id, "type": "private"}
+    user = {"id": user_id, "is_bot": False, "first_name": f"u{user_id}", "username": f"user{user_id}"}
+    return Update.model_validate({
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_update_ids)), "from": user, "chat_instance": str(user_id), "data": data,
+            "message": {"message_id": message_id, "date": int(time.time()), "chat": chat,
+                        "from": {"id": bot.id, "is_bot": True, "first_name": "bot"}, "text": "..."},
+        },
+    }, context={"bot": bot})
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+
+    async def feed(self, handler: str, update: Update):
+        started = time.perf_counter()
+        await dp.feed_update(bot, update)
+        self.latencies.setdefault(handler, []).append(time.perf_counter() - started)
+
+
+async def customer_flow(recorder: Recorder, session: StubSession, user_id: int):
+    """book -> услуга -> (мастер) -> дата -> время -> подтверждение"""
+    await recorder.feed("choose_service", callback_update(user_id, "book"))
+    services = session.buttons(user_id, "svc:")
+    if not services:
+        return
+    await recorder.feed("choose_master", callback_update(user_id, random.choice(services)))
+    masters = session.buttons(user_id, "mst:")
+    if masters:
+        # «любой свободный» и конкретные мастера
+        await recorder.feed("choose_date", callback_update(user_id, random.choice(masters)))
+    dates = session.buttons(user_id, "date:")
+    random.shuffle(dates)
+    times = []
+    for day in dates[:3]:  # на занятый день пользователь выбирает другой
+        await recorder.feed("choose_time", callback_update(user_id, day))
+        times = session.buttons(user_id, "time:")
+        if times:
+            break
+    if not times:
+        return
+    await recorder.feed("confirm", callback_update(user_id, random.choice(times)))
+    await recorder.feed("finish", callback_update(user_id, "finish"))
+
+
+async def admin_flow(recorder: Recorder, session: StubSession, pages: int, message_id: int = 1):
+    # у каждого админского сценария своё сообщение: нажатия одного пользователя на одном
+    # сообщении middleware обрабатывает по одному
+    await recorder.feed("view_all_bookings", callback_update(ADMIN_ID, "view_all_bookings", message_id))
+    for _ in range(pages):
+        nxt = session.buttons(ADMIN_ID, "bk:")
+        nxt = [b for b in nxt if ":n:" in b]
+        if not nxt:
+            break
+        await recorder.feed("bookings_page", callback_update(ADMIN_ID, nxt[0], message_id))
+
+
+async def count_statements(coro_factory) -> dict:
+    """Выполнить сценарий последовательно и посчитать SQL-запросы на каждый обработчик"""
+    per_handler = {}
+    original = Recorder.feed
+
+    async def feed(self, handler, update):
+        # FSM пишется отложенно — сбрасываем, чтобы запись состояния попала в свой апдейт
+        await dp.storage.flush()
+        before = database.pool_stats()["statements"]
+        await original(self, handler, update)
+        await dp.storage.flush()
+        per_handler.setdefault(handler, []).append(database.pool_stats()["statements"] - before)
+
+    Recorder.feed = feed
+    try:
+        await coro_factory(Recorder())
+    finally:
+        Recorder.feed = original
+    return {h: round(statistics.mean(v), 2) for h, v in per_handler.items()}
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies: dict) -> dict:
+    return {
+        handler: {
+            "count": len(values),
+            "mean_ms": round(statistics.mean(values) * 1000, 3),
+            **{f"p{p}_ms": round(percentile(values, p) * 1000, 3) for p in PERCENTILES},
+        }
+        for handler, values in sorted(latencies.items())
+    }
+
+
+async def seed(services: int, bookings: int, masters: int):
+    for i in range(1, masters):
+        await database.add_master(f"Мастер {i}")
+    for i in range(services):
+        await database.add_service(f"Услуга {i}", str(1000 + i * 100), random.choice([30, 60, 90, 120]))
+    today = datetime.now().date()
+    for i in range(bookings):
+        # в основном история; в окне записи — не больше пары записей на день, чтобы слоты оставались
+        future = i < BOOKING_WINDOW_DAYS * 2
+        day = today + timedelta(days=i % BOOKING_WINDOW_DAYS if future else -random.randint(1, 60))
+        await database.add_booking(10_000 + i, f"seed{i}", "Услуга 0", day.isoformat(),
+                                   f"{random.randint(10, 19):02d}:{random.choice(['00', '30'])}", 30)
+
+
+def query_stats(before: dict, after: dict) -> dict:
+    """Число вызовов и среднее время функций database.py за нагрузочную фазу"""
+    result = {}
+    for name, series in sorted(after.items()):
+        old = before.get(name, [0] * len(series))
+        count = sum(series[:-1]) - sum(old[:-1])
+        if count:
+            result[name] = {"count": count, "mean_ms": round((series[-1] - old[-1]) / count * 1000, 3)}
+    return result
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def run(args) -> dict:
+    logging.getLogger().setLevel(logging.WARNING)
+    session = StubSession(args.api_latency_ms / 1000)
+    bot.session = session
+    random.seed(args.seed)
+    await app.startup(primary=False)
+    try:
+        await seed(args.services, args.seed_bookings, args.masters)
+        await database.warm_availability()
+
+        db_per_update = await count_statements(
+            lambda rec: customer_flow(rec, session, 500_000)
+        )
+        db_per_update.update(await count_statements(lambda rec: admin_flow(rec, session, 2)))
+
+        recorder = Recorder()
+        queries_before = metrics.db_query_seconds.snapshot()
+        started = time.perf_counter()
+        tasks = [customer_flow(recorder, session, 1_000_000 + i) for i in range(args.users)]
+        tasks += [admin_flow(recorder, session, args.admin_pages, i + 1) for i in range(args.admins)]
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+        queries = query_stats(queries_before, metrics.db_query_seconds.snapshot())
+    finally:
+        await app.shutdown()
+
+    updates = sum(len(v) for v in recorder.latencies.values())
+    return {
+        "label": args.label,
+        "revision": git_revision(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "params": {k: v for k, v in vars(args).items() if k not in ("compare", "label")},
+        "throughput_updates_per_s": round(updates / elapsed, 1),
+        "updates": updates,
+        "elapsed_s": round(elapsed, 3),
+        "handlers": summarize(recorder.latencies),
+        "db_statements_per_update": db_per_update,
+        "db_queries": queries,
+        "api_calls": session.calls,
+    }
+
+
+def print_report(result: dict, baseline: dict = None):
+    print(f"[{result['label']} @ {result['revision']}] {result['updates']} апдейтов за {result['elapsed_s']} с "
+          f"— {result['throughput_updates_per_s']} апдейтов/с")
+    print(f"{'обработчик':<20}{'n':>6}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}{'SQL/апдейт':>12}")
+    for handler, stats in result["handlers"].items():
+        line = (f"{handler:<20}{stats['count']:>6}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}"
+                f"{result['db_statements_per_update'].get(handler, '-'):>12}")
+        old = (baseline or {}).get("handlers", {}).get(handler)
+        if old:
+            line += f"   p95 {stats['p95_ms'] - old['p95_ms']:+.3f} мс к {baseline['revision']}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100, help="одновременных клиентов")
+    parser.add_argument("--admins", type=int, default=2, help="одновременных админов")
+    parser.add_argument("--admin-pages", type=int, default=5)
+    parser.add_argument("--services", type=int, default=8)
+    parser.add_argument("--masters", type=int, default=1, help="мастеров (первый создаётся миграцией)")
+    parser.add_argument("--seed-bookings", type=int, default=2000, help="записей в БД перед замером")
+    parser.add_argument("--api-latency-ms", type=float, default=0.0, help="искусственная задержка Bot API")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--label", default=None, help="имя файла результата (по умолчанию ревизия git)")
+    parser.add_argument("--compare", default=None, help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+    args.label = args.label or git_revision()
+
+    result = asyncio.run(run(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{args.label}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"Результат сохранён: {path}")
+
+
+if __name__ == "__main__":
+    main()
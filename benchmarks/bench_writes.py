@@ -0,0 +1,56 @@
+"""Сравнение пропускной способности записи: отдельный коммит на вызов и групповые коммиты.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_writes --writes 2000 --concurrency 100
+
+Работает на временной копии схемы и не трогает nails.db.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+os.environ["DB_NAME"] = os.path.join(tempfile.mkdtemp(prefix="bench_writes_"), "bench.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+
+
+async def _run(writes: int, concurrency: int, grouped: bool) -> float:
+    if grouped:
+        await database.start_writer()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            await database.add_booking(i, f"user{i}", "bench", f"2030-01-{i % 28 + 1:02d}", "10:00", 30)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(writes)))
+    elapsed = time.perf_counter() - started
+    if grouped:
+        await database.stop_writer()
+    return elapsed
+
+
+async def main(writes: int, concurrency: int):
+    await database.init_db()
+    await database.open_pool()
+    try:
+        for grouped in (False, True):
+            elapsed = await _run(writes, concurrency, grouped)
+            label = "групповые коммиты" if grouped else "коммит на вызов "
+            print(f"{label}: {writes} записей за {elapsed:.2f} с — {writes / elapsed:,.0f} записей/с")
+        print("писатель:", database.writer_stats())
+    finally:
+        await database.close_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writes", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(main(args.writes, args.concurrency))
@@ -1,9 +1,14 @@
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.strategy import FSMStrategy
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 from config import BOT_TOKEN
+from notifier import Notifier
+from storage import SQLiteStorage
 
 bot = Bot(BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+# состояние привязано к пользователю, а не к чату: админ может начать диалог
+# в одном чате и ответить в личке без дублирования состояния вручную
+dp = Dispatcher(storage=SQLiteStorage(), fsm_strategy=FSMStrategy.GLOBAL_USER)
 scheduler = AsyncIOScheduler()
+notifier = Notifier(bot)
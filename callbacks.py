@@ -0,0 +1,87 @@
+"""Типизированные callback_data.
+
+Кнопки несут короткий префикс и целые id вместо названий: payload укладывается
+в лимит Telegram в 64 байта при любых названиях услуг, разбирает его aiogram
+(фильтр ServiceCb.filter() и готовый объект в обработчике), а услуги и записи
+ищутся по первичному ключу.
+"""
+from aiogram.filters.callback_data import CallbackData
+
+
+class ServiceCb(CallbackData, prefix="svc"):
+    """Выбор услуги"""
+    id: int
+
+
+class MasterCb(CallbackData, prefix="mst"):
+    """Выбор мастера клиентом (0 — любой свободный)"""
+    id: int
+
+
+class DateCb(CallbackData, prefix="date"):
+    """Выбор даты (YYYY-MM-DD)"""
+    day: str
+
+
+class CalendarCb(CallbackData, prefix="cal"):
+    """Страница календаря выбора даты: месяц YYYY-MM"""
+    month: str
+
+
+class TimeCb(CallbackData, prefix="time"):
+    """Выбор времени: минуты от начала дня"""
+    minute: int
+
+
+class CancelBookingCb(CallbackData, prefix="del"):
+    """Отмена своей записи клиентом"""
+    id: int
+
+
+class BookingsViewCb(CallbackData, prefix="bk"):
+    """Страница списка записей в админке.
+
+    flt — '<статус><период>', dir — n/p/a (после закладки / перед ней / с неё),
+    anchor — id записи-закладки (0 — первая страница)"""
+    flt: str = "aa"
+    dir: str = "a"
+    anchor: int = 0
+    page: int = 0
+
+
+class SearchCb(CallbackData, prefix="sr"):
+    """Страница результатов поиска записей: dir и anchor как в BookingsViewCb.
+    Сам текст поиска длиннее лимита callback_data и хранится в данных FSM (ключ search)"""
+    dir: str = "a"
+    anchor: int = 0
+    page: int = 0
+
+
+class BookingActionCb(CallbackData, prefix="bka"):
+    """Смена статуса записи из списка (action: done/cancel) с возвратом на ту же страницу;
+    flt='s' — возврат на страницу результатов поиска"""
+    action: str
+    id: int
+    flt: str = "aa"
+    anchor: int = 0
+    page: int = 0
+
+
+class ExportCb(CallbackData, prefix="exp"):
+    """Выгрузка записей за период (даты YYYY-MM-DD включительно) в формате fmt"""
+    fmt: str
+    date_from: str
+    date_to: str
+
+
+class StatsCb(CallbackData, prefix="st"):
+    """Экран статистики: period w (неделя) / m (месяц), shift — на сколько периодов назад"""
+    period: str = "w"
+    shift: int = 0
+
+
+class MasterAdminCb(CallbackData, prefix="mad"):
+    """Карточка мастера в админке: action view/hours/active/svc (svc — переключить услугу service)"""
+    action: str
+    id: int
+    service: int = 0
@@ -2,12 +2,19 @@ import os
 import logging
 from dotenv import load_dotenv
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
+from log_setup import setup_logging
 
 # Загрузка переменных окружения
 load_dotenv()
 
+# Логирование: уровень, формат (text или json) и доля сохраняемых DEBUG/поапдейтных записей (0..1)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").strip().lower()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1"))
+
+# Настройка логирования: запись в очередь, вывод в отдельном потоке (см. log_setup.py)
+setup_logging(LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE_RATE)
+
 # ВАЖНО: приводим к списку int сразу при загрузке
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 try:
@@ -18,6 +25,84 @@ try:
         logging.error("ОШИБКА: ADMIN_ID не найден или пустой в .env!")
 except (TypeError, ValueError) as e:
     ADMIN_ID = []
-    logging.error(f"ОШИБКА: ADMIN_ID имеет неверный формат в .env! {e}")
+    logging.error("ОШИБКА: ADMIN_ID имеет неверный формат в .env! %s", e)
+
+DB_NAME = os.getenv("DB_NAME", "nails.db")
+
+# Пул соединений с БД: число долгоживущих соединений и размер кэша подготовленных запросов
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+DB_STATEMENT_CACHE = int(os.getenv("DB_STATEMENT_CACHE", "128"))
+
+# Слоты записи: шаг сетки и обязательный перерыв между записями (в минутах)
+SLOT_STEP_MINUTES = int(os.getenv("SLOT_STEP_MINUTES", "30"))
+BOOKING_BUFFER_MINUTES = int(os.getenv("BOOKING_BUFFER_MINUTES", "0"))
+
+# Скользящее окно записи: на сколько дней вперёд доступна запись (индекс занятости прогревается на это окно)
+BOOKING_WINDOW_DAYS = int(os.getenv("BOOKING_WINDOW_DAYS", "7"))
+# Выходные дни недели через запятую (0 — понедельник … 6 — воскресенье): в календаре закрыты, запись не принимается
+CLOSED_WEEKDAYS = frozenset(int(day) for day in os.getenv("CLOSED_WEEKDAYS", "").split(",") if day.strip())
+
+# Кэш каталога услуг и часов работы: страховочный TTL в секундах (сбрасывается и явно при изменениях из админки)
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "300"))
+
+# Групповые коммиты: окно накопления пачки записи (мс) и её максимальный размер
+WRITE_BATCH_WINDOW_MS = float(os.getenv("WRITE_BATCH_WINDOW_MS", "5"))
+WRITE_BATCH_MAX = int(os.getenv("WRITE_BATCH_MAX", "200"))
+
+# Исходящие уведомления: интервал между сообщениями в один чат (с), общий лимит (сообщений/с),
+# окно сбора дайджеста (с, 0 — без задержки), параллельные отправки и число повторов при сетевых ошибках
+NOTIFY_PER_CHAT_INTERVAL = float(os.getenv("NOTIFY_PER_CHAT_INTERVAL", "1"))
+NOTIFY_GLOBAL_RATE = float(os.getenv("NOTIFY_GLOBAL_RATE", "25"))
+NOTIFY_DIGEST_WINDOW = float(os.getenv("NOTIFY_DIGEST_WINDOW", "0"))
+NOTIFY_CONCURRENCY = int(os.getenv("NOTIFY_CONCURRENCY", "4"))
+NOTIFY_MAX_RETRIES = int(os.getenv("NOTIFY_MAX_RETRIES", "5"))
+
+# FSM-хранилище: период сброса в БД (с), срок жизни брошенного диалога (с),
+# через сколько секунд простоя запись вытесняется из кэша, отложенная запись вкл/выкл
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "1"))
+FSM_STATE_TTL = float(os.getenv("FSM_STATE_TTL", str(24 * 3600)))
+FSM_CACHE_IDLE = float(os.getenv("FSM_CACHE_IDLE", "600"))
+FSM_WRITE_BEHIND = os.getenv("FSM_WRITE_BEHIND", "1") not in ("0", "false", "False")
+
+# Режим работы: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling").strip().lower()
+# Webhook: публичный адрес (https://example.com), путь, локальный адрес сервера,
+# секрет для заголовка X-Telegram-Bot-Api-Secret-Token, число воркер-процессов
+# и сколько секунд ждать завершения обрабатываемых запросов при остановке
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "1"))
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30"))
+
+# Несколько процессов работают с одной БД: FSM пишется сразу, кэши сверяются раз в CACHE_SYNC_INTERVAL секунд
+SHARED_STATE = BOT_MODE == "webhook" and WEBHOOK_WORKERS > 1
+CACHE_SYNC_INTERVAL = float(os.getenv("CACHE_SYNC_INTERVAL", "2"))
+
+# Напоминания клиентам: период проверки ближайших записей (секунды)
+REMINDER_CHECK_INTERVAL = int(os.getenv("REMINDER_CHECK_INTERVAL", "60"))
+
+# Метрики: локальный HTTP-эндпоинт /metrics в формате Prometheus (порт 0 — выключен;
+# у webhook-воркера N порт METRICS_PORT + N) и период сводки в лог (секунды, 0 — без сводки)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9101"))
+METRICS_LOG_INTERVAL = int(os.getenv("METRICS_LOG_INTERVAL", "300"))
+
+# Архив и обслуживание БД (на основном процессе): завершённые и отменённые записи старше
+# ARCHIVE_AFTER_DAYS дней переносятся в bookings_archive (0 — не переносить); ежедневно в
+# MAINTENANCE_HOUR — перенос и ANALYZE, в день недели VACUUM_WEEKDAY (0 — пн … 6 — вс, -1 — никогда) ещё и VACUUM
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+MAINTENANCE_HOUR = int(os.getenv("MAINTENANCE_HOUR", "4"))
+VACUUM_WEEKDAY = int(os.getenv("VACUUM_WEEKDAY", "6"))
+
+# Выгрузка записей для админки: сколько строк читать из БД за один fetchmany
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "1000"))
 
-DB_NAME = "nails.db"
+# Защита от повторных нажатий: сколько нажатий в секунду и подряд (всплеск) разрешено одному пользователю;
+# сколько секунд помнить выполненное действие (подтверждение записи, отмена, смена статуса),
+# чтобы повторное нажатие той же кнопки не выполняло его снова
+THROTTLE_RATE = float(os.getenv("THROTTLE_RATE", "2"))
+THROTTLE_BURST = int(os.getenv("THROTTLE_BURST", "5"))
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "300"))
@@ -1,143 +1,1066 @@
+import asyncio
+import time as _time
 import aiosqlite
 import logging
-from config import DB_NAME
+import re
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
 
+from config import (
+    DB_NAME, DB_POOL_SIZE, DB_STATEMENT_CACHE, BOOKING_WINDOW_DAYS, CATALOG_CACHE_TTL, BOOKING_BUFFER_MINUTES,
+    SHARED_STATE,
+)
+from migrations import migrate, BOOKING_COLUMNS
+from availability import (
+    AvailabilityIndex, free_slots, to_minutes, format_minutes, epoch_minutes, day_epoch_minutes,
+    datetime_epoch_minutes, DAY_MINUTES,
+)
+from write_queue import WriteQueue
+import rollups
+from metrics import timed, db_query_seconds
 
-async def init_db():
-    """Инициализация базы данных, создаёт таблицы и добавляет новые колонки при необходимости"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS services(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT,
-            price TEXT,
-            duration INTEGER    -- примерное время выполнения в минутах
-        )""")
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS bookings(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            username TEXT,
-            service TEXT,
-            date TEXT,
-            time TEXT,
-            duration INTEGER,
-            status TEXT DEFAULT 'active'  -- active, done, canceled
-        )""")
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS reviews(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            text TEXT
-        )""")
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS settings(
-            key TEXT PRIMARY KEY,
-            value TEXT
-        )""")
-        # Исправления структуры для старых баз
-        try:
-            await db.execute("ALTER TABLE services ADD COLUMN price TEXT")
-        except:
-            pass
-        try:
-            await db.execute("ALTER TABLE services ADD COLUMN duration INTEGER")
-        except:
-            pass
+
+# PRAGMA, применяемые к каждому соединению пула
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",
+    "PRAGMA mmap_size=67108864",
+)
+
+
+class ConnectionPool:
+    """Пул долгоживущих соединений aiosqlite.
+
+    Соединения открываются один раз при старте, работают в режиме WAL
+    (читатели не блокируют писателя) и держат кэш подготовленных запросов,
+    поэтому повторные SELECT не компилируются заново."""
+
+    def __init__(self, path: str, size: int = DB_POOL_SIZE):
+        self.path = path
+        self.size = max(1, size)
+        self._conns = []
+        self._idle = asyncio.Queue()
+        self._acquired = 0
+        self._waits = 0
+        self._peak = 0
+        # выполненные SQL-выражения по соединениям: у каждого соединения свой поток,
+        # и он увеличивает только свою ячейку — обходимся без блокировок
+        self._statements = [0] * self.size
+
+    async def open(self):
+        for i in range(self.size):
+            conn = await aiosqlite.connect(self.path, cached_statements=DB_STATEMENT_CACHE)
+            for pragma in _PRAGMAS:
+                await conn.execute(pragma)
+            await conn.set_trace_callback(lambda _sql, i=i: self._count_statement(i))
+            self._conns.append(conn)
+            self._idle.put_nowait(conn)
+        logging.info("Пул БД открыт: %s соединений (%s)", self.size, self.path)
+
+    async def close(self):
+        for conn in self._conns:
+            await conn.close()
+        self._conns.clear()
+        self._idle = asyncio.Queue()
+        logging.info("Пул БД закрыт")
+
+    def _count_statement(self, i: int):
+        self._statements[i] += 1
+
+    @asynccontextmanager
+    async def acquire(self):
+        """Взять соединение из пула на время блока"""
+        if self._idle.empty():
+            self._waits += 1
+        conn = await self._idle.get()
+        self._acquired += 1
+        self._peak = max(self._peak, self.size - self._idle.qsize())
         try:
-            await db.execute("ALTER TABLE bookings ADD COLUMN duration INTEGER")
-        except:
-            pass
+            yield conn
+        finally:
+            # незавершённая транзакция не должна утечь к следующему пользователю
+            if conn.in_transaction:
+                await conn.rollback()
+            self._idle.put_nowait(conn)
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "idle": self._idle.qsize(),
+            "in_use": self.size - self._idle.qsize() if self._conns else 0,
+            "peak_in_use": self._peak,
+            "acquired": self._acquired,
+            "waits": self._waits,
+            "statements": sum(self._statements),
+        }
+
+
+# время каждой функции запросов (bot_db_query_seconds в metrics.py)
+_timed = timed(db_query_seconds)
+
+_pool = None
+
+
+async def open_pool(size: int = DB_POOL_SIZE):
+    """Открыть общий пул соединений (вызывается один раз в main)"""
+    global _pool
+    if _pool is None:
+        _pool = ConnectionPool(DB_NAME, size)
+        await _pool.open()
+    return _pool
+
+
+async def close_pool():
+    """Закрыть пул при остановке бота"""
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def pool_stats() -> dict:
+    """Статистика пула (пустой словарь, если пул не открыт)"""
+    return _pool.stats() if _pool is not None else {}
+
+
+@asynccontextmanager
+async def connect():
+    """Соединение из пула, а если пул не открыт (скрипты, init_db) — разовое"""
+    if _pool is not None:
+        async with _pool.acquire() as db:
+            yield db
+    else:
+        async with aiosqlite.connect(DB_NAME) as db:
+            yield db
+
+
+class ReadCache:
+    """Кэш редко меняющихся данных (каталог услуг, часы работы).
+
+    Сбрасывается явно при записи из админки; TTL — страховка на случай
+    изменений в обход этих функций (другой процесс, ручная правка БД)."""
+
+    def __init__(self, ttl: float = CATALOG_CACHE_TTL):
+        self.ttl = ttl
+        self._data = {}  # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None or entry[0] < _time.monotonic():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value):
+        self._data[key] = (_time.monotonic() + self.ttl, value)
+        return value
+
+    def invalidate(self, *keys):
+        """Сбросить указанные ключи (без аргументов — всё)"""
+        if not keys:
+            self._data.clear()
+        for key in keys:
+            self._data.pop(key, None)
+
+    def stats(self) -> dict:
+        return {"keys": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+_cache = ReadCache()
+
+
+def cache_stats() -> dict:
+    """Счётчики кэша каталога и настроек"""
+    return _cache.stats()
+
+
+_writer = WriteQueue(lambda: connect())
+
+
+async def start_writer():
+    """Запустить фоновый писатель с групповыми коммитами (после open_pool)"""
+    await _writer.start()
+
+
+async def stop_writer():
+    """Дописать очередь и остановить писатель (до close_pool)"""
+    await _writer.stop()
+
+
+def writer_stats() -> dict:
+    """Сколько пачек и операций записал фоновый писатель"""
+    return _writer.stats()
+
+
+async def _write(op):
+    """Выполнить операцию записи op(db): через очередь писателя, а если он не запущен —
+    сразу в отдельной транзакции. Результат возвращается после коммита"""
+    if _writer.running:
+        return await _writer.submit(op)
+    async with connect() as db:
+        await db.execute("BEGIN IMMEDIATE")
         try:
-            await db.execute("ALTER TABLE bookings ADD COLUMN status TEXT DEFAULT 'active'")
-        except:
-            pass
-        await db.commit()
+            result = await op(db)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+    return result
 
 
-async def get_services():
-    """Получить все услуги (name, price, duration)"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT name, price, duration FROM services") as cursor:
-            return await cursor.fetchall()
+# ======== Поколения кэшей для нескольких процессов ========
+# Каждая запись увеличивает счётчик своей области в settings (gen:catalog, gen:bookings)
+# в той же транзакции; процессы периодически сверяют счётчики и сбрасывают свои кэши.
 
+_generations = {}
 
-async def add_service(name: str, price: str, duration: int):
-    """Добавить услугу вместе с примерным временем выполнения (в минутах)"""
-    logging.info(f"Добавляем услугу: {name} - {price}, duration={duration}min")
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("INSERT INTO services (name, price, duration) VALUES (?,?,?)", (name, price, duration))
-        await db.commit()
-    logging.info(f"✅ Услуга '{name}' успешно добавлена в БД")
 
+async def _bump_generation(db, domain: str):
+    if SHARED_STATE:
+        await db.execute(
+            "INSERT INTO settings (key, value) VALUES (?, 1) ON CONFLICT(key) DO UPDATE SET value = value + 1",
+            (f"gen:{domain}",)
+        )
 
-async def add_booking(user_id: int, username: str, service: str, date: str, time: str, duration: int):
-    """Добавить запись с продолжительностью"""
-    async with aiosqlite.connect(DB_NAME) as db:
+
+@_timed
+async def sync_shared_caches():
+    """Сбросить локальные кэши, если данные изменил другой процесс"""
+    async with connect() as db:
+        async with db.execute("SELECT key, value FROM settings WHERE key IN ('gen:catalog', 'gen:bookings')") as cursor:
+            rows = await cursor.fetchall()
+    for key, value in rows:
+        previous = _generations.get(key)
+        _generations[key] = value
+        if previous is None or previous == value:
+            continue
+        if key == "gen:catalog":
+            _cache.invalidate()
+        else:
+            _availability.clear()
+
+
+async def init_db():
+    """Инициализация базы данных: применяет недостающие миграции схемы (см. migrations.py)"""
+    async with connect() as db:
+        version = await migrate(db)
+    logging.info("Схема БД: версия %s", version)
+
+
+@_timed
+async def get_services():
+    """Получить все услуги (id, name, price, duration), из кэша если он актуален"""
+    services = _cache.get("services")
+    if services is None:
+        async with connect() as db:
+            async with db.execute("SELECT id, name, price, duration FROM services ORDER BY id") as cursor:
+                services = _cache.set("services", await cursor.fetchall())
+        _cache.set("services_by_name", {name: (price, duration) for _, name, price, duration in services})
+        _cache.set("services_by_id", {sid: (name, price, duration) for sid, name, price, duration in services})
+    return services
+
+
+@_timed
+async def add_service(name: str, price: str, duration: int) -> bool:
+    """Добавить услугу вместе с примерным временем выполнения (в минутах).
+    Возвращает False, если услуга с таким названием уже есть"""
+    logging.debug("Добавляем услугу: %s - %s, duration=%smin", name, price, duration)
+    async def op(db):
+        cursor = await db.execute("INSERT INTO services (name, price, duration) VALUES (?,?,?)", (name, price, duration))
+        # новую услугу сразу выполняют все активные мастера, список правится в карточке мастера
         await db.execute(
-            "INSERT INTO bookings (user_id, username, service, date, time, duration) VALUES (?,?,?,?,?,?)",
-            (user_id, username, service, date, time, duration)
+            "INSERT INTO master_services (master_id, service_id) SELECT id, ? FROM masters WHERE active=1",
+            (cursor.lastrowid,)
+        )
+        await _bump_generation(db, "catalog")
+
+    try:
+        await _write(op)
+    except aiosqlite.IntegrityError:
+        logging.warning("Услуга '%s' уже существует", name)
+        return False
+    _cache.invalidate("services", "services_by_name", "services_by_id", *_MASTER_KEYS)
+    logging.info("✅ Услуга '%s' успешно добавлена в БД", name)
+    return True
+
+
+# ======== Мастера: часы работы и услуги у каждого свои ========
+
+_MASTER_KEYS = ("masters", "masters_by_id", "master_services")
+
+
+async def _load_masters():
+    async with connect() as db:
+        async with db.execute(
+            "SELECT id, name, chat_id, work_start, work_end, active FROM masters ORDER BY id"
+        ) as cursor:
+            masters = await cursor.fetchall()
+        async with db.execute("SELECT master_id, service_id FROM master_services") as cursor:
+            links = await cursor.fetchall()
+    by_master = {}
+    for master_id, service_id in links:
+        by_master.setdefault(master_id, set()).add(service_id)
+    _cache.set("masters_by_id", {row[0]: row for row in masters})
+    _cache.set("master_services", by_master)
+    return _cache.set("masters", masters)
+
+
+async def _masters_cached(key: str):
+    value = _cache.get(key)
+    if value is None:
+        await _load_masters()
+        value = _cache.get(key)
+    return value
+
+
+@_timed
+async def get_masters():
+    """Все мастера (id, name, chat_id, work_start, work_end, active), из кэша если он актуален"""
+    masters = _cache.get("masters")
+    if masters is None:
+        masters = await _load_masters()
+    return masters
+
+
+@_timed
+async def get_master(master_id: int):
+    """Мастер по id (id, name, chat_id, work_start, work_end, active) из кэша или None"""
+    return (await _masters_cached("masters_by_id")).get(master_id)
+
+
+@_timed
+async def get_master_services(master_id: int) -> set:
+    """id услуг, которые выполняет мастер"""
+    return (await _masters_cached("master_services")).get(master_id, set())
+
+
+@_timed
+async def get_service_masters(service_id: int = None) -> list:
+    """Активные мастера, выполняющие услугу (без service_id — все активные)"""
+    masters = await get_masters()
+    links = await _masters_cached("master_services")
+    return [m for m in masters if m[5] and (service_id is None or service_id in links.get(m[0], ()))]
+
+
+@_timed
+async def add_master(name: str, chat_id: int = None):
+    """Добавить мастера с часами по умолчанию и всеми услугами каталога.
+    Возвращает id или None, если мастер с таким именем уже есть"""
+    start, end = await get_work_hours()
+
+    async def op(db):
+        cursor = await db.execute(
+            "INSERT INTO masters (name, chat_id, work_start, work_end) VALUES (?,?,?,?)", (name, chat_id, start, end)
         )
-        await db.commit()
+        await db.execute("INSERT INTO master_services (master_id, service_id) SELECT ?, id FROM services", (cursor.lastrowid,))
+        await _bump_generation(db, "catalog")
+        return cursor.lastrowid
+
+    try:
+        master_id = await _write(op)
+    except aiosqlite.IntegrityError:
+        logging.warning("Мастер '%s' уже существует", name)
+        return None
+    _cache.invalidate(*_MASTER_KEYS)
+    logging.info("Добавлен мастер '%s' (#%s)", name, master_id)
+    return master_id
+
+
+@_timed
+async def set_master_hours(master_id: int, start: str, end: str):
+    """Сохранить часы работы мастера (HH:MM)"""
+    async def op(db):
+        await db.execute("UPDATE masters SET work_start=?, work_end=? WHERE id=?", (start, end, master_id))
+        await _bump_generation(db, "catalog")
+
+    await _write(op)
+    _cache.invalidate(*_MASTER_KEYS)
+
+
+@_timed
+async def set_master_active(master_id: int, active: bool):
+    """Скрыть мастера из записи или вернуть (его записи и история не меняются)"""
+    async def op(db):
+        await db.execute("UPDATE masters SET active=? WHERE id=?", (int(active), master_id))
+        await _bump_generation(db, "catalog")
+
+    await _write(op)
+    _cache.invalidate(*_MASTER_KEYS)
+
+
+@_timed
+async def toggle_master_service(master_id: int, service_id: int) -> bool:
+    """Добавить услугу мастеру или убрать её; вернуть True, если теперь выполняет"""
+    async def op(db):
+        cursor = await db.execute(
+            "DELETE FROM master_services WHERE master_id=? AND service_id=?", (master_id, service_id)
+        )
+        assigned = cursor.rowcount == 0
+        if assigned:
+            await db.execute(
+                "INSERT INTO master_services (master_id, service_id) VALUES (?,?)", (master_id, service_id)
+            )
+        await _bump_generation(db, "catalog")
+        return assigned
+
+    assigned = await _write(op)
+    _cache.invalidate(*_MASTER_KEYS)
+    return assigned
+
+
+# ======== Запись bookings вместе с дневными сводками (см. rollups.py) ========
+# Все изменения записей и их статусов идут через эти помощники: сводка меняется
+# в той же транзакции, что и сама запись.
+
+_ROLLUP_ROW = "id, date, service, status, duration, price"
+
+
+async def _service_price(service: str) -> int:
+    """Цена услуги целым числом из закэшированного каталога (фиксируется в записи)"""
+    info = await get_service(service)
+    return rollups.parse_price(info[0]) if info else 0
+
+
+async def _insert_booking(db, values) -> int:
+    """values: (user_id, username, service, date, time, duration, start_min, end_min, price, master_id)"""
+    cursor = await db.execute(
+        "INSERT INTO bookings (user_id, username, service, date, time, duration, start_min, end_min, price, master_id) "
+        "VALUES (?,?,?,?,?,?,?,?,?,?)",
+        values
+    )
+    _, _, service, date, _, duration, _, _, price, _ = values
+    await rollups.bump(db, date, service or "", "active", 1, duration or 0, price or 0)
+    await _bump_generation(db, "bookings")
+    return cursor.lastrowid
+
+
+async def _set_status(db, status: str, where: str, params) -> list:
+    """Сменить статус записям под условием where; вернуть их строки (id, date, service, старый статус, ...)"""
+    async with db.execute(f"SELECT {_ROLLUP_ROW} FROM bookings WHERE {where}", params) as cursor:
+        rows = [row for row in await cursor.fetchall() if row[3] != status]
+    if not rows:
+        return rows
+    await db.executemany("UPDATE bookings SET status=? WHERE id=?", [(status, row[0]) for row in rows])
+    moves = {}
+    for _, date, service, old_status, duration, price in rows:
+        for key, sign in (((date, service or "", old_status or "active"), -1), ((date, service or "", status), 1)):
+            count, minutes, revenue = moves.get(key, (0, 0, 0))
+            moves[key] = (count + sign, minutes + sign * (duration or 0), revenue + sign * (price or 0))
+    for (date, service, key_status), (count, minutes, revenue) in moves.items():
+        await rollups.bump(db, date, service, key_status, count, minutes, revenue)
+    await _bump_generation(db, "bookings")
+    return rows
+
+
+@_timed
+async def add_booking(user_id: int, username: str, service: str, date: str, time: str, duration: int,
+                      master_id: int = None):
+    """Добавить запись с продолжительностью, вернуть её id.
+    Без master_id запись достаётся первому активному мастеру"""
+    start_min = epoch_minutes(date, time)
+    end_min = start_min + (duration or 0)
+
+    price = await _service_price(service)
+    if master_id is None:
+        masters = await get_service_masters()
+        master_id = masters[0][0] if masters else None
+
+    async def op(db):
+        return await _insert_booking(
+            db, (user_id, username, service, date, time, duration, start_min, end_min, price, master_id)
+        )
+
+    booking_id = await _write(op)
+    start = to_minutes(time)
+    _availability.add(master_id, date, booking_id, start, start + (duration or 0))
+    return booking_id
+
+
+@_timed
+async def reserve_booking(user_id: int, username: str, service: str, date: str, time: str, duration: int,
+                          master_ids):
+    """Атомарно занять слот у первого свободного из мастеров master_ids: проверка пересечений
+    и вставка в одной транзакции BEGIN IMMEDIATE.
 
+    Возвращает (id записи, id мастера) или None, если у всех мастеров слот уже занят
+    (с учётом перерыва между записями)"""
+    start = to_minutes(time)
+    end = start + (duration or 0)
+    start_min = epoch_minutes(date, time)
+    end_min = start_min + (duration or 0)
+    price = await _service_price(service)
+    # пробуем только активных мастеров, у которых время целиком в часах работы
+    candidates = []
+    for master_id in master_ids:
+        master = await get_master(master_id)
+        if master and master[5] and to_minutes(master[3]) <= start and end <= to_minutes(master[4]):
+            candidates.append(master_id)
 
+    # _write держит блокировку записи (BEGIN IMMEDIATE) на всю операцию:
+    # между проверкой и вставкой никто не вклинится
+    async def op(db):
+        for master_id in candidates:
+            # пересечение с учётом перерыва — диапазонный запрос по индексу (master_id, status, start_min, end_min)
+            if await _overlaps(db, master_id, start_min - BOOKING_BUFFER_MINUTES, end_min + BOOKING_BUFFER_MINUTES):
+                continue
+            booking_id = await _insert_booking(
+                db, (user_id, username, service, date, time, duration, start_min, end_min, price, master_id)
+            )
+            return booking_id, master_id
+        return None
+
+    reserved = await _write(op)
+    if reserved is not None:
+        _availability.add(reserved[1], date, reserved[0], start, end)
+    return reserved
+
+
+@_timed
 async def get_user_bookings(user_id: int, current_date: str):
-    """Получить записи пользователя, включая длительность и статус"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    """Получить записи пользователя: (id, service, date, time, duration, status, имя мастера)"""
+    async with connect() as db:
         async with db.execute(
-            "SELECT id, service, date, time, duration, status FROM bookings WHERE user_id=? AND date >= ? ORDER BY date ASC",
+            "SELECT b.id, b.service, b.date, b.time, b.duration, b.status, m.name FROM bookings b "
+            "LEFT JOIN masters m ON m.id = b.master_id WHERE b.user_id=? AND b.date >= ? ORDER BY b.date ASC",
             (user_id, current_date)
         ) as cursor:
             return await cursor.fetchall()
 
 
-async def get_all_bookings():
-    """Получить все записи с информацией о длительности и статусе"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT id, username, service, date, time, duration, status FROM bookings ORDER BY date ASC") as cursor:
-            return await cursor.fetchall()
+def _bookings_where(status: str = None, date_from: str = None, date_to: str = None):
+    """WHERE-условие и параметры для фильтров списка записей"""
+    clauses, params = [], []
+    if status:
+        clauses.append("status=?")
+        params.append(status)
+    if date_from:
+        clauses.append("date>=?")
+        params.append(date_from)
+    if date_to:
+        clauses.append("date<=?")
+        params.append(date_to)
+    return clauses, params
 
 
-async def get_busy_times(date: str):
-    """Получить занятые времена и длительности для даты"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT time, duration FROM bookings WHERE date=?", (date,)) as cursor:
-            return await cursor.fetchall()  # list of tuples (time, duration)
+@_timed
+async def get_bookings_page(limit: int, anchor_id: int = None, direction: str = "next",
+                            status: str = None, date_from: str = None, date_to: str = None):
+    """Страница записей в порядке (date, time, id) с keyset-пагинацией.
+
+    anchor_id — id записи-закладки: direction="next" — строки после неё,
+    "prev" — строки перед ней, "at" — начиная с неё самой. Без закладки — первая страница.
+    Возвращает limit + 1 строк, если дальше есть ещё (признак кнопки «Далее»): общее число
+    записей не считается, поэтому страница стоит одинаково при любом размере таблицы.
+    Строки: (id, username, service, date, time, duration, status)"""
+    clauses, params = _bookings_where(status, date_from, date_to)
+    order = "ASC"
+    if anchor_id is not None:
+        op = {"next": ">", "prev": "<", "at": ">="}[direction]
+        clauses.append(f"(date, time, id) {op} (SELECT date, time, id FROM bookings WHERE id=?)")
+        params.append(anchor_id)
+        if direction == "prev":
+            order = "DESC"
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+    async with connect() as db:
+        async with db.execute(
+            f"SELECT id, username, service, date, time, duration, status FROM bookings{where} "
+            f"ORDER BY date {order}, time {order}, id {order} LIMIT ?",
+            (*params, limit + 1)
+        ) as cursor:
+            rows = await cursor.fetchall()
+    if order == "DESC":
+        rows = rows[:limit]
+        rows.reverse()
+    return rows
+
+
+_SEARCH_DATE = re.compile(r"(\d{1,2})\.(\d{1,2})(?:\.(\d{4}))?")
+
+
+def search_match(text: str):
+    """Текст поиска -> выражение MATCH для bookings_fts или None, если искать нечего.
 
+    Слова ищутся как фрагменты (все сразу), '@' у username отбрасывается, дата ДД.ММ[.ГГГГ]
+    переводится в формат хранения ('19.10' -> '10-19'). Слова короче трёх символов
+    токенизатор trigram не находит — они пропускаются"""
+    terms = []
+    for word in (text or "").split():
+        date_match = _SEARCH_DATE.fullmatch(word)
+        if date_match:
+            day, month, year = date_match.groups()
+            word = f"{month.zfill(2)}-{day.zfill(2)}"
+            if year:
+                word = f"{year}-{word}"
+        word = word.strip("@#,;")
+        if len(word) >= 3:
+            terms.append('"' + word.replace('"', '""') + '"')
+    return " AND ".join(terms) or None
 
+
+_MATCH_TERM = re.compile(r'"((?:[^"]|"")*)"')
+
+
+async def _has_fts(db) -> bool:
+    """Есть ли индекс bookings_fts (миграция 11 пропускает его на SQLite старше FTS_MIN_SQLITE)"""
+    has_fts = _cache.get("bookings_fts")
+    if has_fts is None:
+        async with db.execute("SELECT 1 FROM sqlite_master WHERE name='bookings_fts'") as cursor:
+            has_fts = _cache.set("bookings_fts", await cursor.fetchone() is not None)
+    return has_fts
+
+
+def _like_search(match: str):
+    """Выражение search_match() -> условие LIKE по тем же колонкам: каждый фрагмент
+    в username, услуге или дате. Без индекса — просмотр bookings по id от закладки"""
+    clauses, params = [], []
+    for term in _MATCH_TERM.findall(match):
+        pattern = "%" + re.sub(r"([\\%_])", r"\\\1", term.replace('""', '"')) + "%"
+        clauses.append("(b.username LIKE ? ESCAPE '\\' OR b.service LIKE ? ESCAPE '\\' OR b.date LIKE ? ESCAPE '\\')")
+        params += [pattern] * 3
+    return " AND ".join(clauses), params
+
+
+@_timed
+async def search_bookings(match: str, limit: int, anchor_id: int = None, direction: str = "at"):
+    """Страница результатов поиска по bookings_fts, новые записи (больший id) первыми.
+
+    match — выражение из search_match(); закладка anchor_id как в get_bookings_page.
+    Порядок и закладка — по rowid индекса, поэтому FTS5 отдаёт строки в нужном порядке
+    сам и останавливается на limit: без сортировки всех совпадений и без подсчёта.
+    Без индекса (SQLite старше FTS_MIN_SQLITE) — те же страницы через LIKE, регистр
+    не учитывается только для латиницы.
+    Возвращает limit + 1 строк, если дальше есть ещё (признак кнопки «Далее»).
+    Строки: (id, username, service, date, time, duration, status)"""
+    async with connect() as db:
+        if await _has_fts(db):
+            key = "bookings_fts.rowid"
+            source = "bookings_fts JOIN bookings b ON b.id = bookings_fts.rowid"
+            where, params = "bookings_fts MATCH ?", [match]
+        else:
+            key, source = "b.id", "bookings b"
+            where, params = _like_search(match)
+        order = "DESC"
+        if anchor_id is not None:
+            op = {"next": "<", "prev": ">", "at": "<="}[direction]
+            where += f" AND {key} {op} ?"
+            params.append(anchor_id)
+            if direction == "prev":
+                order = "ASC"
+        async with db.execute(
+            f"SELECT b.id, b.username, b.service, b.date, b.time, b.duration, b.status FROM {source} "
+            f"WHERE {where} ORDER BY {key} {order} LIMIT ?",
+            (*params, limit + 1)
+        ) as cursor:
+            rows = await cursor.fetchall()
+    if order == "ASC":
+        rows = rows[:limit]
+        rows.reverse()
+    return rows
+
+
+@_timed
 async def get_service(name: str):
-    """Получить информацию об услуге по названию (price, duration)"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT price, duration FROM services WHERE name=?", (name,)) as cursor:
-            return await cursor.fetchone()  # (price, duration) or None
+    """Получить информацию об услуге по названию (price, duration) из закэшированного каталога"""
+    by_name = _cache.get("services_by_name")
+    if by_name is None:
+        await get_services()
+        by_name = _cache.get("services_by_name") or {}
+    return by_name.get(name)  # (price, duration) or None
 
 
-async def delete_booking(booking_id: int):
-    """Удалить запись"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("DELETE FROM bookings WHERE id=?", (booking_id,))
-        await db.commit()
+@_timed
+async def get_service_by_id(service_id: int):
+    """Услуга по первичному ключу (name, price, duration) из закэшированного каталога"""
+    by_id = _cache.get("services_by_id")
+    if by_id is None:
+        await get_services()
+        by_id = _cache.get("services_by_id") or {}
+    return by_id.get(service_id)  # (name, price, duration) or None
 
 
+@_timed
 async def update_booking_status(booking_id: int, status: str):
     """Обновить статус записи (active, done, canceled)"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("UPDATE bookings SET status=? WHERE id=?", (status, booking_id))
-        await db.commit()
+    async def op(db):
+        await _set_status(db, status, "id=?", (booking_id,))
+        async with db.execute(
+            "SELECT master_id, date, start_min, end_min FROM bookings WHERE id=?", (booking_id,)
+        ) as cursor:
+            return await cursor.fetchone()
+
+    row = await _write(op)
+    if status != 'active':
+        _availability.remove(booking_id)
+    elif row and row[2] is not None:
+        master_id, date, start_min, end_min = row
+        day_start = day_epoch_minutes(date)
+        _availability.add(master_id, date, booking_id, start_min - day_start, end_min - day_start)
 
 
+@_timed
 async def get_work_hours():
-    """Возвращает кортеж строк (start,end) часов работы. По умолчанию 10:00-21:00"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    """Часы работы по умолчанию (start, end) для новых мастеров. По умолчанию 10:00-21:00;
+    у каждого мастера свои часы (masters.work_start / work_end)"""
+    hours = _cache.get("work_hours")
+    if hours is not None:
+        return hours
+    async with connect() as db:
         async with db.execute("SELECT value FROM settings WHERE key='work_hours'") as cursor:
             row = await cursor.fetchone()
     if row and '-' in row[0]:
-        return tuple(row[0].split('-'))
-    return ("10:00", "21:00")
+        return _cache.set("work_hours", tuple(row[0].split('-')))
+    return _cache.set("work_hours", ("10:00", "21:00"))
+
+
+# ======== Напоминания и автозавершение (см. reminders.py) ========
+
+REMINDER_COLUMNS = {"24h": "reminded_24h", "2h": "reminded_2h"}
+
+
+@_timed
+async def get_reminder_candidates(start_from: int, start_to: int):
+    """Активные записи, начинающиеся в [start_from, start_to) (эпоха-минуты), по которым ещё
+    не отправлены оба напоминания. Читается диапазон индекса (status, start_min, end_min).
+    Строки: (id, user_id, service, date, time, start_min, reminded_24h, reminded_2h)"""
+    async with connect() as db:
+        async with db.execute(
+            "SELECT id, user_id, service, date, time, start_min, reminded_24h, reminded_2h FROM bookings "
+            "WHERE status='active' AND start_min >= ? AND start_min < ? AND (reminded_24h=0 OR reminded_2h=0)",
+            (start_from, start_to)
+        ) as cursor:
+            return await cursor.fetchall()
+
+
+@_timed
+async def mark_reminders_sent(booking_ids, kind: str):
+    """Отметить напоминание kind ('24h' или '2h') отправленным; '2h' закрывает и '24h'"""
+    if not booking_ids:
+        return
+    columns = "reminded_24h=1, reminded_2h=1" if kind == "2h" else f"{REMINDER_COLUMNS[kind]}=1"
+
+    async def op(db):
+        await db.executemany(f"UPDATE bookings SET {columns} WHERE id=?", [(bid,) for bid in booking_ids])
+
+    await _write(op)
+
+
+@_timed
+async def complete_past_bookings(now: datetime) -> list:
+    """Перевести в done активные записи, которые уже закончились; вернуть их id"""
+    now_min = datetime_epoch_minutes(now)
+
+    async def op(db):
+        rows = await _set_status(db, "done", "status='active' AND start_min <= ? AND end_min <= ?", (now_min, now_min))
+        return [row[0] for row in rows]
+
+    ids = await _write(op)
+    for bid in ids:
+        _availability.remove(bid)
+    return ids
+
+
+@_timed
+async def cancel_user_booking(booking_id: int, user_id: int) -> bool:
+    """Отмена записи клиентом: статус canceled, строка остаётся для отчётов и позже уходит в архив.
+    False — запись не принадлежит пользователю или уже не активна"""
+    async def op(db):
+        rows = await _set_status(db, "canceled", "id=? AND user_id=? AND status='active'", (booking_id, user_id))
+        return bool(rows)
+
+    canceled = await _write(op)
+    if canceled:
+        _availability.remove(booking_id)
+    return canceled
+
+
+@_timed
+async def get_rollup(date_from: str, date_to: str):
+    """Сводка за период из daily_rollup (без чтения bookings): (service, status, записей, минут, выручка)"""
+    async with connect() as db:
+        async with db.execute(
+            "SELECT service, status, SUM(bookings), SUM(minutes), SUM(revenue) FROM daily_rollup "
+            "WHERE date BETWEEN ? AND ? GROUP BY service, status HAVING SUM(bookings) != 0",
+            (date_from, date_to)
+        ) as cursor:
+            return await cursor.fetchall()
+
+
+@_timed
+async def rebuild_rollups() -> int:
+    """Пересчитать дневные сводки по всей истории; вернуть число расходившихся ключей"""
+    async def op(db):
+        mismatched = await rollups.diff(db)
+        await rollups.rebuild(db)
+        return len(mismatched)
+
+    return await _write(op)
+
+
+# ======== Архив и обслуживание БД (см. maintenance.py) ========
+
+ARCHIVE_BATCH = 1000
 
 
-async def set_work_hours(start: str, end: str):
-    """Сохранить часы работы в формате HH:MM-HH:MM"""
+@_timed
+async def archive_bookings(before_min: int, batch: int = ARCHIVE_BATCH) -> int:
+    """Перенести в bookings_archive завершённые и отменённые записи, закончившиеся раньше before_min
+    (эпоха-минуты); вернуть число перенесённых. Каждая пачка из batch строк — отдельная операция
+    писателя, поэтому блокировка записи не держится на весь перенос"""
+    columns = ", ".join(BOOKING_COLUMNS)
+    total = 0
+    while True:
+        async def op(db):
+            async with db.execute(
+                "SELECT id FROM bookings WHERE status IN ('done', 'canceled') AND start_min < ? AND end_min < ? LIMIT ?",
+                (before_min, before_min, batch)
+            ) as cursor:
+                ids = [row[0] for row in await cursor.fetchall()]
+            if ids:
+                placeholders = ",".join("?" * len(ids))
+                await db.execute(
+                    f"INSERT OR REPLACE INTO bookings_archive ({columns}, archived_at) "
+                    f"SELECT {columns}, ? FROM bookings WHERE id IN ({placeholders})",
+                    (int(_time.time()), *ids)
+                )
+                await db.execute(f"DELETE FROM bookings WHERE id IN ({placeholders})", ids)
+            return len(ids)
+
+        moved = await _write(op)
+        total += moved
+        if moved < batch:
+            return total
+
+
+@_timed
+async def optimize_db(vacuum: bool = False):
+    """Обновить статистику планировщика (ANALYZE), при vacuum=True — пересобрать файл и усечь WAL.
+    Отдельное соединение: VACUUM выполняется вне транзакции и ждёт, пока освободятся остальные"""
     async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("INSERT OR REPLACE INTO settings (key,value) VALUES ('work_hours',?)", (f"{start}-{end}",))
-        await db.commit()
+        await db.execute("PRAGMA busy_timeout=60000")
+        await db.execute("ANALYZE")
+        if vacuum:
+            if await _has_fts(db):
+                # слить сегменты полнотекстового индекса в один — поиск читает меньше страниц
+                await db.execute("INSERT INTO bookings_fts (bookings_fts) VALUES ('optimize')")
+                await db.commit()
+            await db.execute("VACUUM")
+            await db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+# ======== Индекс занятости (см. availability.AvailabilityIndex) ========
+
+_availability = AvailabilityIndex()
+
+
+MAX_BOOKING_MINUTES = DAY_MINUTES  # запись не длиннее суток: нижняя граница диапазона по start_min
+
+
+async def _overlaps(db, master_id: int, a: int, b: int) -> bool:
+    """Есть ли у мастера активная запись, пересекающая [a, b)"""
+    async with db.execute(
+        "SELECT 1 FROM bookings WHERE master_id=? AND status='active' AND start_min >= ? AND start_min < ? "
+        "AND end_min > ? LIMIT 1",
+        (master_id, a - MAX_BOOKING_MINUTES, b, a)
+    ) as cursor:
+        return await cursor.fetchone() is not None
+
+
+@_timed
+async def get_bookings_overlapping(a: int, b: int, status: str = "active", master_id: int = None):
+    """Записи со статусом status, пересекающие [a, b) в эпоха-минутах (с master_id — только этого мастера).
+    Диапазонный запрос по индексу (status, start_min, end_min) или (master_id, status, start_min, end_min).
+    Строки: (id, master_id, date, start_min, end_min)"""
+    query = (
+        "SELECT id, master_id, date, start_min, end_min FROM bookings "
+        "WHERE status=? AND start_min >= ? AND start_min < ? AND end_min > ?"
+    )
+    params = (status, a - MAX_BOOKING_MINUTES, b, a)
+    if master_id is not None:
+        query += " AND master_id=?"
+        params += (master_id,)
+    async with connect() as db:
+        async with db.execute(f"{query} ORDER BY start_min", params) as cursor:
+            return await cursor.fetchall()
+
+
+async def _day_intervals(master_id: int, date: str):
+    """Активные записи мастера, начинающиеся в этот день: (id, start, end) в минутах от начала дня"""
+    day_start = day_epoch_minutes(date)
+    rows = await get_bookings_overlapping(day_start, day_start + DAY_MINUTES, master_id=master_id)
+    return [(bid, s - day_start, e - day_start) for bid, _, _, s, e in rows if s >= day_start]
+
+
+async def _load_days(master_ids, dates) -> bool:
+    """Загрузить в индекс дни dates (подряд идущие ISO-даты) мастеров master_ids одним
+    диапазонным запросом. False — во время чтения прошла запись, дни догрузятся по промаху"""
+    version = _availability.version
+    window_start = day_epoch_minutes(dates[0])
+    rows = await get_bookings_overlapping(window_start, day_epoch_minutes(dates[-1]) + DAY_MINUTES)
+    if _availability.version != version:
+        return False
+    by_day = {(m, d): [] for m in master_ids for d in dates}
+    for bid, master_id, date, start_min, end_min in rows:
+        if start_min >= window_start and (master_id, date) in by_day:
+            day_start = day_epoch_minutes(date)
+            by_day[(master_id, date)].append((bid, start_min - day_start, end_min - day_start))
+    for (master_id, date), intervals in by_day.items():
+        _availability.load_day(master_id, date, intervals)
+    return True
+
+
+@_timed
+async def warm_availability(days: int = BOOKING_WINDOW_DAYS):
+    """Загрузить занятость активных мастеров на окно записи одним запросом (при старте и раз в сутки)"""
+    today = datetime.now().date()
+    dates = [(today + timedelta(days=i)).isoformat() for i in range(days + 1)]
+    _availability.evict_before(dates[0])
+    if await _load_days([m[0] for m in await get_service_masters()], dates):
+        logging.info("Индекс занятости прогрет: %s", _availability.stats())
+
+
+async def _ensure_day(master_id: int, date: str):
+    """Догрузить день мастера в индекс при промахе"""
+    while not _availability.has_day(master_id, date):
+        version = _availability.version
+        intervals = await _day_intervals(master_id, date)
+        if _availability.version == version:
+            _availability.load_day(master_id, date, intervals)
+
+
+@_timed
+async def get_free_slots(date: str, duration: int, master_ids) -> list:
+    """Свободные слоты ('HH:MM') на дату для услуги заданной длительности: у одного мастера
+    или, если передано несколько, время, свободное хотя бы у одного из них («любой мастер»)"""
+    slots = set()
+    for master_id in master_ids:
+        master = await get_master(master_id)
+        if master is None:
+            continue
+        day_start, day_end = to_minutes(master[3]), to_minutes(master[4])
+        found = _availability.slots(master_id, date, day_start, day_end, duration)
+        if found is None:
+            await _ensure_day(master_id, date)
+            found = _availability.slots(master_id, date, day_start, day_end, duration)
+        slots.update(found)
+    return [format_minutes(m) for m in sorted(slots)]
+
+
+@_timed
+async def get_days_occupancy(dates, duration: int, master_ids) -> dict:
+    """Заполненность дней для календаря: {date: (свободных слотов, слотов в пустой день)}
+    по объединению мастеров master_ids. Недостающие в индексе дни догружаются одним
+    диапазонным запросом на весь показываемый период, а не по запросу на день"""
+    masters = [m for m in [await get_master(master_id) for master_id in master_ids] if m]
+    if not dates or not masters:
+        return {date: (0, 0) for date in dates}
+    if any(not _availability.has_day(m[0], d) for m in masters for d in dates):
+        await _load_days([m[0] for m in masters], dates)
+    hours = [(m[0], to_minutes(m[3]), to_minutes(m[4])) for m in masters]
+    # часы работы одинаковы для всех дней, поэтому слоты пустого дня считаются один раз
+    total = len({slot for _, day_start, day_end in hours for slot in free_slots(day_start, day_end, (), duration)})
+    result = {}
+    for date in dates:
+        free = set()
+        for master_id, day_start, day_end in hours:
+            found = _availability.slots(master_id, date, day_start, day_end, duration)
+            if found is None:
+                # день обогнала параллельная запись — догружаем его отдельно
+                await _ensure_day(master_id, date)
+                found = _availability.slots(master_id, date, day_start, day_end, duration)
+            free.update(found)
+        result[date] = (len(free), total)
+    return result
+
+
+@_timed
+async def check_availability_index() -> list:
+    """Сверить загруженные дни индекса с БД, вернуть разделы (master_id, date) с расхождениями"""
+    mismatched = []
+    for master_id, date in _availability.loaded_days():
+        expected = sorted((s, e) for _, s, e in await _day_intervals(master_id, date))
+        if _availability.snapshot(master_id, date) != expected:
+            mismatched.append((master_id, date))
+    return mismatched
+
+
+def availability_stats() -> dict:
+    """Счётчики попаданий/промахов индекса занятости"""
+    return _availability.stats()
+
+
+# ======== Хранилище FSM (см. storage.SQLiteStorage) ========
+
+@_timed
+async def fsm_load(key: str):
+    """(state, data_json) для ключа FSM или None"""
+    async with connect() as db:
+        async with db.execute("SELECT state, data FROM fsm_storage WHERE key=?", (key,)) as cursor:
+            return await cursor.fetchone()
+
+
+@_timed
+async def fsm_save(rows):
+    """Сохранить пачку (key, state, data_json, updated_at) одной операцией; пустые записи удаляются"""
+    async def op(db):
+        upserts = [row for row in rows if row[1] is not None or row[2] != "{}"]
+        deletes = [(row[0],) for row in rows if row[1] is None and row[2] == "{}"]
+        if upserts:
+            await db.executemany(
+                "INSERT OR REPLACE INTO fsm_storage (key, state, data, updated_at) VALUES (?,?,?,?)", upserts
+            )
+        if deletes:
+            await db.executemany("DELETE FROM fsm_storage WHERE key=?", deletes)
+
+    await _write(op)
+
+
+@_timed
+async def fsm_delete_expired(before: int) -> int:
+    """Удалить брошенные диалоги, не менявшиеся с момента before (unix time)"""
+    async def op(db):
+        cursor = await db.execute("DELETE FROM fsm_storage WHERE updated_at < ?", (before,))
+        return cursor.rowcount
+
+    return await _write(op)
+
+
+# ======== Ключи идемпотентности (см. middlewares.IdempotencyMiddleware) ========
+
+@_timed
+async def claim_idempotency_key(key: str, now: int, ttl: int) -> bool:
+    """Занять ключ нажатия; False — нажатие с этим ключом уже выполнено (или выполняется)
+    не раньше now - ttl. Общая БД делает проверку единой для всех процессов"""
+    async def op(db):
+        cursor = await db.execute(
+            "INSERT INTO idempotency_keys (key, created_at) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET created_at = excluded.created_at WHERE created_at < ?",
+            (key, now, now - ttl)
+        )
+        return cursor.rowcount == 1
+
+    return await _write(op)
+
+
+@_timed
+async def release_idempotency_key(key: str):
+    """Освободить ключ (действие завершилось ошибкой — его можно повторить)"""
+    async def op(db):
+        await db.execute("DELETE FROM idempotency_keys WHERE key=?", (key,))
+
+    await _write(op)
+
+
+@_timed
+async def delete_expired_idempotency_keys(before: int) -> int:
+    """Удалить ключи, занятые раньше before (unix time)"""
+    async def op(db):
+        cursor = await db.execute("DELETE FROM idempotency_keys WHERE created_at < ?", (before,))
+        return cursor.rowcount
+
+    return await _write(op)
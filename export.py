@@ -0,0 +1,123 @@
+"""Выгрузка записей в CSV/XLSX для админки.
+
+Строки читаются отдельным соединением (не из пула, чтобы долгое чтение не
+занимало соединение обработчиков) порциями по EXPORT_CHUNK_ROWS через
+fetchmany и сразу дописываются во временный файл; запись на диск идёт в
+потоке (asyncio.to_thread). Архив и горячая таблица читаются двумя
+диапазонными запросами по своим индексам start_min, уже упорядоченными,
+и сливаются на лету — общий ORDER BY по bookings_all заставил бы SQLite
+просканировать и отсортировать весь период до первой порции. Память не
+зависит от числа строк. XLSX доступен,
+если установлен openpyxl (режим write_only тоже пишет потоково).
+"""
+import asyncio
+import csv
+import os
+import tempfile
+
+import aiosqlite
+
+from availability import day_epoch_minutes, DAY_MINUTES
+from config import DB_NAME, EXPORT_CHUNK_ROWS
+
+try:
+    import openpyxl
+except ImportError:  # XLSX необязателен
+    openpyxl = None
+
+FORMATS = ("csv", "xlsx") if openpyxl is not None else ("csv",)
+HEADER = ("id", "дата", "время", "длительность, мин", "услуга", "мастер", "username", "user_id", "статус")
+
+# архив тоже выгружается: по запросу на таблицу, диапазон по индексу start_min
+# (idx_bookings_archive_start / idx_bookings_start) в порядке (start_min, id);
+# последняя колонка start_min нужна только для слияния и в файл не пишется;
+# имя мастера — подзапросом по первичному ключу (JOIN по крошечной masters планировщик сканирует)
+_QUERY = (
+    "SELECT b.id, b.date, b.time, b.duration, b.service, (SELECT name FROM masters WHERE id = b.master_id), "
+    "b.username, b.user_id, b.status, b.start_min FROM {table} b "
+    "WHERE b.start_min >= ? AND b.start_min < ? ORDER BY b.start_min, b.id"
+)
+QUERIES = tuple(_QUERY.format(table=table) for table in ("bookings_archive", "bookings"))
+
+
+async def _stream(cursor):
+    while True:
+        chunk = await cursor.fetchmany(EXPORT_CHUNK_ROWS)
+        if not chunk:
+            return
+        for row in chunk:
+            yield row
+
+
+async def _rows(date_from: str, date_to: str):
+    """Порции строк за период [date_from, date_to] включительно в порядке (start_min, id)"""
+    start = day_epoch_minutes(date_from)
+    end = day_epoch_minutes(date_to) + DAY_MINUTES
+    async with aiosqlite.connect(DB_NAME) as db:
+        await db.execute("PRAGMA busy_timeout=5000")
+        async with db.execute(QUERIES[0], (start, end)) as archive, db.execute(QUERIES[1], (start, end)) as hot:
+            # слияние двух упорядоченных потоков: держим по одной текущей строке из каждого
+            heads = []
+            for stream in (_stream(archive), _stream(hot)):
+                row = await anext(stream, None)
+                if row is not None:
+                    heads.append([(row[-1], row[0]), row, stream])
+            chunk = []
+            while heads:
+                head = min(heads, key=lambda item: item[0])
+                chunk.append(head[1][:-1])
+                row = await anext(head[2], None)
+                if row is None:
+                    heads.remove(head)
+                else:
+                    head[0], head[1] = (row[-1], row[0]), row
+                if len(chunk) >= EXPORT_CHUNK_ROWS:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+
+
+async def _write_csv(path: str, date_from: str, date_to: str) -> int:
+    count = 0
+    # utf-8-sig: Excel правильно открывает кириллицу
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(HEADER)
+        async for chunk in _rows(date_from, date_to):
+            await asyncio.to_thread(writer.writerows, chunk)
+            count += len(chunk)
+    return count
+
+
+async def _write_xlsx(path: str, date_from: str, date_to: str) -> int:
+    count = 0
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("Записи")
+    sheet.append(HEADER)
+
+    def append(chunk):
+        for row in chunk:
+            sheet.append(row)
+
+    async for chunk in _rows(date_from, date_to):
+        await asyncio.to_thread(append, chunk)
+        count += len(chunk)
+    await asyncio.to_thread(workbook.save, path)
+    return count
+
+
+async def export_bookings(date_from: str, date_to: str, fmt: str = "csv"):
+    """Записать записи за период во временный файл, вернуть (путь, число строк).
+    Файл удаляет вызывающий"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Формат {fmt} недоступен")
+    fd, path = tempfile.mkstemp(prefix=f"bookings_{date_from}_{date_to}_", suffix=f".{fmt}")
+    os.close(fd)
+    try:
+        writer = _write_xlsx if fmt == "xlsx" else _write_csv
+        count = await writer(path, date_from, date_to)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, count
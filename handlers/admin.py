@@ -1,16 +1,25 @@
+import asyncio
 import logging
+import os
+from datetime import datetime, date, timedelta
 
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery
+from aiogram.types import Message, CallbackQuery, FSInputFile
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from states import AdminState
 from config import ADMIN_ID
-from database import add_service, get_all_bookings, update_booking_status, set_work_hours, get_work_hours
+from database import (
+    add_service, get_bookings_page, update_booking_status, get_services,
+    get_rollup, rebuild_rollups, get_masters, get_master, get_master_services, get_service_masters,
+    add_master, set_master_hours, set_master_active, toggle_master_service, search_match, search_bookings,
+)
+from availability import to_minutes, is_closed
 from keyboards import main_menu_kb, admin_panel_kb, back_to_admin_kb
-from bot import dp, bot
-from aiogram.fsm.storage.base import StorageKey
+from callbacks import BookingsViewCb, BookingActionCb, SearchCb, ExportCb, StatsCb, MasterAdminCb
+from export import export_bookings, FORMATS as EXPORT_FORMATS
 
 router = Router()
 
@@ -27,40 +36,94 @@ async def admin_panel(callback: CallbackQuery):
 
 
 
+PER_PAGE = 5
+
+# фильтры списка записей: код в BookingsViewCb.flt -> (подпись, значение)
+STATUS_FILTERS = {"a": ("все", None), "c": ("активные", "active"), "d": ("завершённые", "done"), "x": ("отменённые", "canceled")}
+SCOPE_FILTERS = {"a": ("всё время", None), "t": ("сегодня", None), "u": ("предстоящие", None)}
+
+
+def _next_code(codes: dict, current: str) -> str:
+    keys = list(codes)
+    return keys[(keys.index(current) + 1) % len(keys)]
+
+
+def _filter_args(flt: str) -> dict:
+    """'<статус><период>' -> аргументы для get_bookings_page"""
+    status_code, scope_code = flt[0], flt[1]
+    today = datetime.now().strftime("%Y-%m-%d")
+    args = {"status": STATUS_FILTERS[status_code][1], "date_from": None, "date_to": None}
+    if scope_code == "t":
+        args["date_from"] = args["date_to"] = today
+    elif scope_code == "u":
+        args["date_from"] = today
+    return args
+
+
+def _parse_view(flt: str, direction: str, anchor: int, page: int):
+    """Поля BookingsViewCb/BookingActionCb -> (flt, direction, anchor_id, page) с проверкой фильтра"""
+    if len(flt) != 2 or flt[0] not in STATUS_FILTERS or flt[1] not in SCOPE_FILTERS:
+        flt = "aa"
+    direction = {"n": "next", "p": "prev", "a": "at"}.get(direction, "at")
+    return flt, direction, anchor or None, max(page, 0)
+
+
+def _booking_lines(kb: InlineKeyboardBuilder, page_items, flt: str, anchor: int, page: int) -> str:
+    """Строки записей страницы и кнопки ✅/❌ к каждой (возврат на ту же страницу по flt/anchor/page)"""
+    text = ""
+    for bid, username, service, date, time, duration, status in page_items:
+        text += f"#{bid} @{username} | 📅 {date} {time} | 💅 {service} | ⏱ {duration} мин | статус: {status}\n"
+        label = f"@{username} — {service}"
+        kb.button(text=f"✅ {label}", callback_data=BookingActionCb(action="done", id=bid, flt=flt, anchor=anchor, page=page))
+        kb.button(text=f"❌ {label}", callback_data=BookingActionCb(action="cancel", id=bid, flt=flt, anchor=anchor, page=page))
+    return text
+
+
 # helper to render a page of bookings
-async def render_booking_page(callback: CallbackQuery, page: int):
-    all_bookings = await get_all_bookings()
-    per_page = 5
-    total = len(all_bookings)
-    pages = (total + per_page - 1) // per_page
-    if page < 0:
+async def render_booking_page(callback: CallbackQuery, flt: str = "aa", direction: str = "at",
+                              anchor_id: int = None, page: int = 0):
+    """Страница записей: выборка на стороне БД, закладка (keyset) передаётся в кнопках.
+    Общее число записей не считается — о следующей странице говорит лишняя строка выборки"""
+    args = _filter_args(flt)
+    page_items = await get_bookings_page(PER_PAGE, anchor_id, direction, **args)
+    if not page_items and anchor_id is not None:
+        # закладка исчезла (запись удалена) — начинаем сначала
+        page, anchor_id, direction = 0, None, "at"
+        page_items = await get_bookings_page(PER_PAGE, **args)
+    if anchor_id is None:
         page = 0
-    if page >= pages:
-        page = pages - 1 if pages > 0 else 0
-
-    start = page * per_page
-    page_items = all_bookings[start:start+per_page]
+    # после «Назад» следующая страница есть всегда
+    has_next = direction == "prev" or len(page_items) > PER_PAGE
+    page_items = page_items[:PER_PAGE]
 
-    if not page_items:
+    if not page_items and flt == "aa":
         await callback.answer("Записей в базе пока нет.", show_alert=True)
         return
 
-    text = f"📋 Все записи клиентов (страница {page+1}/{pages}):\n\n"
+    status_label, scope_label = STATUS_FILTERS[flt[0]][0], SCOPE_FILTERS[flt[1]][0]
+    text = f"📋 Все записи клиентов (страница {page+1}, {status_label}, {scope_label}):\n\n"
+    if not page_items:
+        text += "Нет записей под выбранный фильтр.\n"
+    first_id = page_items[0][0] if page_items else 0
     kb = InlineKeyboardBuilder()
-    for bid, username, service, date, time, duration, status in page_items:
-        text += f"#{bid} @{username} | 📅 {date} {time} | 💅 {service} | ⏱ {duration} мин | статус: {status}\n"
-        label = f"@{username} — {service}"
-        kb.button(text=f"✅ {label}", callback_data=f"done_{bid}:{page}")
-        kb.button(text=f"❌ {label}", callback_data=f"cancel_{bid}:{page}")
-        kb.adjust(2)
+    text += _booking_lines(kb, page_items, flt, first_id, page)
+    rows = [2] * len(page_items)
     # navigation buttons are added directly to kb so no markup-nesting errors
-    if page > 0:
-        kb.button(text="◀️ Назад", callback_data=f"bookings_page_{page-1}")
-    if page < pages-1:
-        kb.button(text="▶️ Далее", callback_data=f"bookings_page_{page+1}")
-    kb.adjust(2)
+    nav = 0
+    if page_items and page > 0:
+        kb.button(text="◀️ Назад", callback_data=BookingsViewCb(flt=flt, dir="p", anchor=first_id, page=page-1))
+        nav += 1
+    if page_items and has_next:
+        kb.button(text="▶️ Далее", callback_data=BookingsViewCb(flt=flt, dir="n", anchor=page_items[-1][0], page=page+1))
+        nav += 1
+    if nav:
+        rows.append(nav)
+    kb.button(text=f"Статус: {status_label}", callback_data=BookingsViewCb(flt=f"{_next_code(STATUS_FILTERS, flt[0])}{flt[1]}"))
+    kb.button(text=f"Период: {scope_label}", callback_data=BookingsViewCb(flt=f"{flt[0]}{_next_code(SCOPE_FILTERS, flt[1])}"))
+    rows.append(2)
     kb.button(text="⬅️ Главное", callback_data="admin_panel")
-    kb.adjust(1)
+    rows.append(1)
+    kb.adjust(*rows)
 
     await callback.message.edit_text(text, reply_markup=kb.as_markup())
 
@@ -70,68 +133,140 @@ async def view_all_bookings(callback: CallbackQuery):
     """Начало просмотра всех записей"""
     if callback.from_user.id not in ADMIN_ID:
         return
-    await render_booking_page(callback, page=0)
+    await render_booking_page(callback)
 
 
 
-@router.callback_query(F.data.startswith("bookings_page_"))
-async def bookings_page(callback: CallbackQuery):
-    """Переключение страниц общего списка записей"""
+@router.callback_query(BookingsViewCb.filter())
+async def bookings_page(callback: CallbackQuery, callback_data: BookingsViewCb):
+    """Переключение страниц и фильтров общего списка записей"""
     if callback.from_user.id not in ADMIN_ID:
         return
-    page = int(callback.data.replace("bookings_page_", ""))
-    await render_booking_page(callback, page)
+    view = _parse_view(callback_data.flt, callback_data.dir, callback_data.anchor, callback_data.page)
+    await render_booking_page(callback, *view)
 
 
-@router.callback_query(F.data == "add_svc")
-async def add_svc_name(callback: CallbackQuery, state: FSMContext):
-    """Начало добавления услуги. Устанавливаем state и для приватного чата"""
-    if int(callback.from_user.id) != ADMIN_ID:
+# ======== Поиск записей ========
+
+async def render_search(message: Message, query: str, direction: str = "at", anchor_id: int = None,
+                        page: int = 0, edit: bool = True):
+    """Страница результатов поиска (новые записи первыми), закладка — id записи, как в общем списке"""
+    match = search_match(query)
+    page_items = await search_bookings(match, PER_PAGE, anchor_id, direction)
+    if not page_items and anchor_id is not None:
+        page, anchor_id, direction = 0, None, "at"
+        page_items = await search_bookings(match, PER_PAGE)
+    if anchor_id is None:
+        page = 0
+    # после «Назад» следующая страница есть всегда; иначе о ней говорит лишняя строка выборки
+    has_next = direction == "prev" or len(page_items) > PER_PAGE
+    page_items = page_items[:PER_PAGE]
+
+    text = f"🔎 Поиск «{query}» (страница {page+1}):\n\n"
+    if not page_items:
+        text += "Ничего не найдено.\n"
+    first_id = page_items[0][0] if page_items else 0
+    kb = InlineKeyboardBuilder()
+    text += _booking_lines(kb, page_items, "s", first_id, page)
+    rows = [2] * len(page_items)
+    nav = 0
+    if page_items and page > 0:
+        kb.button(text="◀️ Назад", callback_data=SearchCb(dir="p", anchor=first_id, page=page-1))
+        nav += 1
+    if page_items and has_next:
+        kb.button(text="▶️ Далее", callback_data=SearchCb(dir="n", anchor=page_items[-1][0], page=page+1))
+        nav += 1
+    if nav:
+        rows.append(nav)
+    kb.button(text="🔎 Новый поиск", callback_data="search")
+    kb.button(text="⬅️ Главное", callback_data="admin_panel")
+    rows.append(2)
+    kb.adjust(*rows)
+
+    if edit:
+        await message.edit_text(text, reply_markup=kb.as_markup())
+    else:
+        await message.answer(text, reply_markup=kb.as_markup())
+
+
+async def _start_search(message: Message, state: FSMContext, query: str):
+    """Проверить текст поиска, запомнить его для кнопок страниц и показать первую страницу"""
+    if search_match(query) is None:
+        await message.answer("Введите username, услугу или дату (ДД.ММ или YYYY-MM-DD), не короче 3 символов:")
+        await state.set_state(AdminState.searching)
         return
-    logging.info("admin: start adding service")
-    await callback.message.edit_text("Название услуги (например: Маникюр + гель-лак):")
-    # set state in current chat
-    await state.set_state(AdminState.adding_service_name)
-    # also set in private chat so admin can ответить туда
-    key = StorageKey(bot_id=bot.id, chat_id=callback.from_user.id, user_id=callback.from_user.id)
-    try:
-        await dp.storage.set_state(key=key, state=AdminState.adding_service_name)
-        logging.info(f"admin: set private storage state for key={key}")
-    except Exception:
-        logging.exception("admin: failed to set private storage state")
+    await state.set_state(None)
+    await state.update_data(search=query)
+    await render_search(message, query, edit=False)
 
 
-@router.callback_query(F.data == "set_hours")
-async def set_hours_start(callback: CallbackQuery, state: FSMContext):
-    """Запрос часов работы. дублируем состояние в приватный чат"""
+@router.callback_query(F.data == "search")
+async def search_start(callback: CallbackQuery, state: FSMContext):
+    """Запрос текста поиска"""
     if callback.from_user.id not in ADMIN_ID:
         return
-    
-    hrs = await get_work_hours()
-    await callback.message.edit_text(f"Текущие часы работы: {hrs[0]}-{hrs[1]}.\nВведите новые в формате HH:MM-HH:MM:")
-    await state.set_state(AdminState.setting_hours)
-    key = StorageKey(bot_id=bot.id, chat_id=callback.from_user.id, user_id=callback.from_user.id)
-    try:
-        await dp.storage.set_state(key=key, state=AdminState.setting_hours)
-        logging.info(f"admin: set private storage state for setting_hours key={key}")
-    except Exception:
-        logging.exception("admin: failed to set private storage state for setting_hours")
+    await callback.message.edit_text(
+        "🔎 Введите username, услугу или дату (ДД.ММ или YYYY-MM-DD); слова ищутся как фрагменты:",
+        reply_markup=back_to_admin_kb()
+    )
+    await state.set_state(AdminState.searching)
+
+
+@router.message(AdminState.searching)
+async def search_input(message: Message, state: FSMContext):
+    """Текст поиска из панели"""
+    await _start_search(message, state, (message.text or "").strip())
+
+
+@router.message(Command("search"))
+async def search_command(message: Message, command: CommandObject, state: FSMContext):
+    """/search <текст> — поиск без захода в панель"""
+    if message.from_user.id not in ADMIN_ID:
+        return
+    await _start_search(message, state, (command.args or "").strip())
+
+
+@router.callback_query(SearchCb.filter())
+async def search_page(callback: CallbackQuery, callback_data: SearchCb, state: FSMContext):
+    """Переключение страниц результатов поиска"""
+    if callback.from_user.id not in ADMIN_ID:
+        return
+    await _render_saved_search(callback, state, callback_data.dir, callback_data.anchor, callback_data.page)
+
+
+async def _render_saved_search(callback: CallbackQuery, state: FSMContext, direction: str, anchor: int, page: int):
+    query = (await state.get_data()).get("search")
+    if not query:
+        await callback.answer("Поиск устарел, повторите его.", show_alert=True)
+        return
+    direction = {"n": "next", "p": "prev", "a": "at"}.get(direction, "at")
+    await render_search(callback.message, query, direction, anchor or None, max(page, 0))
+
+
+async def _rerender_after_action(callback: CallbackQuery, callback_data: BookingActionCb, state: FSMContext):
+    """Перерисовать страницу, с которой изменили запись, от её первой записи"""
+    if callback_data.flt == "s":
+        await _render_saved_search(callback, state, "a", callback_data.anchor, callback_data.page)
+    else:
+        await render_booking_page(callback, *_parse_view(callback_data.flt, "a", callback_data.anchor, callback_data.page))
+
+
+@router.callback_query(F.data == "add_svc")
+async def add_svc_name(callback: CallbackQuery, state: FSMContext):
+    """Начало добавления услуги. Состояние привязано к пользователю (FSMStrategy.GLOBAL_USER),
+    поэтому ответить можно и в личном чате"""
+    if callback.from_user.id not in ADMIN_ID:
+        return
+    logging.debug("admin: start adding service")
+    await callback.message.edit_text("Название услуги (например: Маникюр + гель-лак):")
+    await state.set_state(AdminState.adding_service_name)
 
 
 @router.message(AdminState.adding_service_name)
 async def add_svc_price(message: Message, state: FSMContext):
     """Ввод цены услуги"""
-    logging.info(f"admin: received service name '{message.text}' chat_id={message.chat.id}")
+    logging.debug("admin: received service name %r chat_id=%s", message.text, message.chat.id)
     await state.update_data(name=message.text)
-    # also update private context if different
-    key = StorageKey(bot_id=bot.id, chat_id=message.from_user.id, user_id=message.from_user.id)
-    try:
-        await dp.storage.update_data(key=key, data={"name": message.text})
-        await dp.storage.set_state(key=key, state=AdminState.adding_service_price)
-        cur = await dp.storage.get_state(key=key)
-        logging.info(f"admin: private storage updated, state={cur} for key={key}")
-    except Exception:
-        logging.exception("admin: failed to update private storage with name")
     await message.answer("✏️ Введите цену (только цифры):")
     await state.set_state(AdminState.adding_service_price)
 
@@ -139,16 +274,8 @@ async def add_svc_price(message: Message, state: FSMContext):
 @router.message(AdminState.adding_service_price)
 async def ask_duration(message: Message, state: FSMContext):
     """После цены спрашиваем длительность"""
-    logging.info(f"admin: received price '{message.text}' chat_id={message.chat.id}")
+    logging.debug("admin: received price %r chat_id=%s", message.text, message.chat.id)
     await state.update_data(price=message.text)
-    key = StorageKey(bot_id=bot.id, chat_id=message.from_user.id, user_id=message.from_user.id)
-    try:
-        await dp.storage.update_data(key=key, data={"price": message.text})
-        await dp.storage.set_state(key=key, state=AdminState.adding_service_duration)
-        cur = await dp.storage.get_state(key=key)
-        logging.info(f"admin: private storage price set, state={cur} for key={key}")
-    except Exception:
-        logging.exception("admin: failed to update private storage with price")
     await message.answer("✏️ Введите примерное время выполнения услуги в минутах (например: 60):")
     await state.set_state(AdminState.adding_service_duration)
 
@@ -157,15 +284,18 @@ async def ask_duration(message: Message, state: FSMContext):
 async def add_svc_final(message: Message, state: FSMContext):
     """Завершение добавления услуги"""
     data = await state.get_data()
-    logging.info(f"admin: received duration '{message.text}' with previous data {data}")
+    logging.debug("admin: received duration %r for service %r", message.text, data.get("name"))
     try:
         duration = int(message.text)
     except ValueError:
         await message.answer("Неверный формат, укажите число минут.")
         return
     
-    await add_service(data['name'], data['price'], duration)
-    
+    if not await add_service(data['name'], data['price'], duration):
+        await message.answer(f"Услуга '{data['name']}' уже существует, введите другое название:")
+        await state.set_state(AdminState.adding_service_name)
+        return
+
     await message.answer(
         f"✅ Услуга '{data['name']}' добавлена!",
         reply_markup=main_menu_kb(message.from_user.id)
@@ -175,52 +305,314 @@ async def add_svc_final(message: Message, state: FSMContext):
 
 # ======== Остальные админские хендлеры ========
 
-@router.callback_query(F.data.startswith("done_"))
-async def mark_done(callback: CallbackQuery):
+@router.callback_query(BookingActionCb.filter(F.action == "done"), flags={"idempotent": True})
+async def mark_done(callback: CallbackQuery, callback_data: BookingActionCb, state: FSMContext):
     if callback.from_user.id not in ADMIN_ID:
         return
-    payload = callback.data.replace("done_", "")
-    if ":" in payload:
-        bid_str, page_str = payload.split(":", 1)
-        page = int(page_str)
-    else:
-        bid_str, page = payload, 0
-    bid = int(bid_str)
-    await update_booking_status(bid, "done")
+    await update_booking_status(callback_data.id, "done")
     await callback.answer("Отмечено как завершено")
-    await render_booking_page(callback, page)
+    # перерисовываем ту же страницу от её первой записи, без полной перезагрузки списка
+    await _rerender_after_action(callback, callback_data, state)
 
 
-@router.callback_query(F.data.startswith("cancel_"))
-async def mark_canceled(callback: CallbackQuery):
+@router.callback_query(BookingActionCb.filter(F.action == "cancel"), flags={"idempotent": True})
+async def mark_canceled(callback: CallbackQuery, callback_data: BookingActionCb, state: FSMContext):
     if callback.from_user.id not in ADMIN_ID:
         return
-    payload = callback.data.replace("cancel_", "")
-    if ":" in payload:
-        bid_str, page_str = payload.split(":", 1)
-        page = int(page_str)
-    else:
-        bid_str, page = payload, 0
-    bid = int(bid_str)
-    await update_booking_status(bid, "canceled")
+    await update_booking_status(callback_data.id, "canceled")
     await callback.answer("Отменено")
-    await render_booking_page(callback, page)
+    await _rerender_after_action(callback, callback_data, state)
+
+
+# ======== Мастера: часы работы, услуги, уведомления ========
+
+@router.callback_query(F.data == "masters")
+async def masters_list(callback: CallbackQuery, state: FSMContext):
+    """Список мастеров"""
+    if callback.from_user.id not in ADMIN_ID:
+        return
+    await state.clear()
+    kb = InlineKeyboardBuilder()
+    for master_id, name, _, work_start, work_end, active in await get_masters():
+        mark = "" if active else "🚫 "
+        kb.button(text=f"{mark}{name} ({work_start}-{work_end})", callback_data=MasterAdminCb(action="view", id=master_id))
+    kb.button(text="➕ Добавить мастера", callback_data="add_master")
+    kb.button(text="⬅️ Главное", callback_data="admin_panel")
+    kb.adjust(1)
+    await callback.message.edit_text("👩‍🎨 Мастера:", reply_markup=kb.as_markup())
+
+
+async def render_master(callback: CallbackQuery, master_id: int):
+    """Карточка мастера: часы, чат для уведомлений и переключатели услуг"""
+    master = await get_master(master_id)
+    if master is None:
+        await callback.answer("Мастер не найден.", show_alert=True)
+        return
+    _, name, chat_id, work_start, work_end, active = master
+    assigned = await get_master_services(master_id)
+    text = (f"👩‍🎨 {name}{'' if active else ' (скрыт из записи)'}\n"
+            f"Часы работы: {work_start}-{work_end}\n"
+            f"Уведомления: {chat_id or 'администраторам'}\n\nУслуги (нажмите, чтобы включить/выключить):")
+    kb = InlineKeyboardBuilder()
+    services = await get_services()
+    for service_id, service, *_ in services:
+        mark = "✅" if service_id in assigned else "▫️"
+        kb.button(text=f"{mark} {service}", callback_data=MasterAdminCb(action="svc", id=master_id, service=service_id))
+    kb.button(text="⏰ Часы работы", callback_data=MasterAdminCb(action="hours", id=master_id))
+    kb.button(text="🚫 Скрыть" if active else "✅ Вернуть", callback_data=MasterAdminCb(action="active", id=master_id))
+    kb.button(text="⬅️ Мастера", callback_data="masters")
+    kb.adjust(*([1] * len(services)), 2, 1)
+    await callback.message.edit_text(text, reply_markup=kb.as_markup())
+
+
+@router.callback_query(MasterAdminCb.filter(F.action == "view"))
+async def master_card(callback: CallbackQuery, callback_data: MasterAdminCb):
+    if callback.from_user.id not in ADMIN_ID:
+        return
+    await render_master(callback, callback_data.id)
+
+
+@router.callback_query(MasterAdminCb.filter(F.action == "svc"))
+async def master_toggle_service(callback: CallbackQuery, callback_data: MasterAdminCb):
+    if callback.from_user.id not in ADMIN_ID:
+        return
+    assigned = await toggle_master_service(callback_data.id, callback_data.service)
+    await callback.answer("Услуга добавлена" if assigned else "Услуга убрана")
+    await render_master(callback, callback_data.id)
+
+
+@router.callback_query(MasterAdminCb.filter(F.action == "active"))
+async def master_toggle_active(callback: CallbackQuery, callback_data: MasterAdminCb):
+    if callback.from_user.id not in ADMIN_ID:
+        return
+    master = await get_master(callback_data.id)
+    if master is None:
+        await callback.answer("Мастер не найден.", show_alert=True)
+        return
+    await set_master_active(callback_data.id, not master[5])
+    await render_master(callback, callback_data.id)
+
+
+@router.callback_query(MasterAdminCb.filter(F.action == "hours"))
+async def set_hours_start(callback: CallbackQuery, callback_data: MasterAdminCb, state: FSMContext):
+    """Запрос часов работы мастера"""
+    if callback.from_user.id not in ADMIN_ID:
+        return
+    master = await get_master(callback_data.id)
+    if master is None:
+        await callback.answer("Мастер не найден.", show_alert=True)
+        return
+    await callback.message.edit_text(
+        f"{master[1]}: текущие часы работы {master[3]}-{master[4]}.\nВведите новые в формате HH:MM-HH:MM:"
+    )
+    await state.set_state(AdminState.setting_hours)
+    await state.update_data(master_id=callback_data.id)
 
 
 @router.message(AdminState.setting_hours)
 async def save_hours(message: Message, state: FSMContext):
-    """Сохранить часы работы"""
-    parts = message.text.split("-")
-    if len(parts) != 2:
+    """Сохранить часы работы мастера"""
+    data = await state.get_data()
+    parts = [part.strip() for part in (message.text or "").split("-")]
+    try:
+        start, end = parts
+        if to_minutes(start) >= to_minutes(end):
+            raise ValueError
+    except ValueError:
         await message.answer("Неверный формат, используйте HH:MM-HH:MM")
         return
-    start, end = parts
-    await set_work_hours(start.strip(), end.strip())
-    await message.answer(f"Часы работы сохранены: {start}-{end}")
-    # clear both contexts
-    key = StorageKey(bot_id=bot.id, chat_id=message.from_user.id, user_id=message.from_user.id)
-    await dp.storage.set_state(key=key, state=None)
-    await dp.storage.set_data(key=key, data={})
+    if not data.get('master_id'):
+        await message.answer("Выберите мастера в разделе «Мастера».", reply_markup=back_to_admin_kb())
+        await state.clear()
+        return
+    await set_master_hours(data['master_id'], start, end)
+    await message.answer(f"Часы работы сохранены: {start}-{end}", reply_markup=back_to_admin_kb())
     await state.clear()
 
 
+@router.callback_query(F.data == "add_master")
+async def add_master_name(callback: CallbackQuery, state: FSMContext):
+    """Начало добавления мастера"""
+    if callback.from_user.id not in ADMIN_ID:
+        return
+    await callback.message.edit_text("Имя мастера:")
+    await state.set_state(AdminState.adding_master_name)
+
+
+@router.message(AdminState.adding_master_name)
+async def add_master_chat(message: Message, state: FSMContext):
+    """Ввод чата для уведомлений мастера"""
+    await state.update_data(name=(message.text or "").strip())
+    await message.answer("Telegram ID мастера для уведомлений о записях (или «-», чтобы уведомлять администраторов):")
+    await state.set_state(AdminState.adding_master_chat)
+
+
+@router.message(AdminState.adding_master_chat)
+async def add_master_final(message: Message, state: FSMContext):
+    """Завершение добавления мастера: часы по умолчанию и все услуги, правятся в карточке"""
+    data = await state.get_data()
+    text = (message.text or "").strip()
+    if text == "-":
+        chat_id = None
+    else:
+        try:
+            chat_id = int(text)
+        except ValueError:
+            await message.answer("Укажите числовой Telegram ID или «-».")
+            return
+    if not data.get('name'):
+        await message.answer("Имя мастера не может быть пустым, введите имя:")
+        await state.set_state(AdminState.adding_master_name)
+        return
+    if await add_master(data['name'], chat_id) is None:
+        await message.answer(f"Мастер '{data['name']}' уже есть, введите другое имя:")
+        await state.set_state(AdminState.adding_master_name)
+        return
+    kb = InlineKeyboardBuilder()
+    kb.button(text="👩‍🎨 К мастерам", callback_data="masters")
+    await message.answer(f"✅ Мастер '{data['name']}' добавлен!", reply_markup=kb.as_markup())
+    await state.clear()
+
+
+# ======== Выгрузка записей (см. export.py) ========
+
+_export_lock = asyncio.Lock()  # одна выгрузка за раз, чтобы не нагружать диск и БД
+_export_tasks = set()
+
+
+@router.callback_query(F.data == "export")
+async def export_start(callback: CallbackQuery, state: FSMContext):
+    """Запрос периода выгрузки"""
+    if callback.from_user.id not in ADMIN_ID:
+        return
+    await callback.message.edit_text(
+        "Введите период выгрузки в формате YYYY-MM-DD YYYY-MM-DD (или одну дату):",
+        reply_markup=back_to_admin_kb()
+    )
+    await state.set_state(AdminState.export_range)
+
+
+@router.message(AdminState.export_range)
+async def export_range(message: Message, state: FSMContext):
+    """Проверить период и предложить формат файла"""
+    parts = (message.text or "").split()
+    try:
+        days = [date.fromisoformat(part) for part in parts]
+    except ValueError:
+        days = []
+    if len(days) not in (1, 2) or days[0] > days[-1]:
+        await message.answer("Неверный период, используйте YYYY-MM-DD YYYY-MM-DD")
+        return
+    date_from, date_to = days[0].isoformat(), days[-1].isoformat()
+
+    kb = InlineKeyboardBuilder()
+    for fmt in EXPORT_FORMATS:
+        kb.button(text=fmt.upper(), callback_data=ExportCb(fmt=fmt, date_from=date_from, date_to=date_to))
+    kb.button(text="⬅️ Назад", callback_data="admin_panel")
+    kb.adjust(len(EXPORT_FORMATS), 1)
+    await message.answer(f"Выгрузка за {date_from} — {date_to}. Формат файла:", reply_markup=kb.as_markup())
+    await state.clear()
+
+
+@router.callback_query(ExportCb.filter())
+async def export_run(callback: CallbackQuery, callback_data: ExportCb):
+    """Запустить выгрузку в фоне: обработчик сразу возвращается, файл придёт отдельным сообщением"""
+    if callback.from_user.id not in ADMIN_ID:
+        return
+    if _export_lock.locked():
+        await callback.answer("Выгрузка уже идёт, попробуйте через минуту.", show_alert=True)
+        return
+    await callback.answer("Готовлю файл…")
+    task = asyncio.create_task(_send_export(callback.bot, callback.message.chat.id, callback_data))
+    _export_tasks.add(task)
+    task.add_done_callback(_export_tasks.discard)
+
+
+async def _send_export(bot, chat_id: int, request: ExportCb):
+    async with _export_lock:
+        try:
+            path, count = await export_bookings(request.date_from, request.date_to, request.fmt)
+        except Exception:
+            logging.exception("Выгрузка %s—%s не удалась", request.date_from, request.date_to)
+            await bot.send_message(chat_id, "❌ Не удалось подготовить выгрузку.")
+            return
+        try:
+            filename = f"bookings_{request.date_from}_{request.date_to}.{request.fmt}"
+            await bot.send_document(chat_id, FSInputFile(path, filename=filename), caption=f"📤 Записей: {count}")
+        except Exception:
+            logging.exception("Не удалось отправить выгрузку в %s", chat_id)
+        finally:
+            os.remove(path)
+
+
+# ======== Статистика (дневные сводки, см. rollups.py) ========
+
+STATUS_LABELS = {"active": "активных", "done": "завершено", "canceled": "отменено"}
+
+
+def _stats_period(period: str, shift: int):
+    """Границы недели (пн–вс) или календарного месяца, сдвинутых на shift периодов назад"""
+    today = datetime.now().date()
+    if period == "m":
+        month = today.year * 12 + today.month - 1 - shift
+        first = date(month // 12, month % 12 + 1, 1)
+        following = date((month + 1) // 12, (month + 1) % 12 + 1, 1)
+        return first, following - timedelta(days=1)
+    first = today - timedelta(days=today.weekday() + 7 * shift)
+    return first, first + timedelta(days=6)
+
+
+@router.callback_query(StatsCb.filter())
+async def stats_view(callback: CallbackQuery, callback_data: StatsCb):
+    """Статистика за неделю/месяц: читаются только дневные сводки"""
+    if callback.from_user.id not in ADMIN_ID:
+        return
+    period = "m" if callback_data.period == "m" else "w"
+    shift = max(callback_data.shift, 0)
+    first, last = _stats_period(period, shift)
+    rows = await get_rollup(first.isoformat(), last.isoformat())
+
+    by_status, by_service = {}, {}
+    booked_minutes = 0
+    for service, status, count, minutes, revenue in rows:
+        by_status[status] = by_status.get(status, 0) + count
+        if status != "canceled":
+            booked_minutes += minutes
+        if status == "done":
+            done_count, done_revenue = by_service.get(service, (0, 0))
+            by_service[service] = (done_count + count, done_revenue + revenue)
+    # доступное время — по текущим часам работы активных мастеров на каждый рабочий день периода
+    daily = sum(max(to_minutes(m[4]) - to_minutes(m[3]), 0) for m in await get_service_masters())
+    open_days = sum(
+        1 for i in range((last - first).days + 1) if not is_closed((first + timedelta(days=i)).isoformat())
+    )
+    available = daily * open_days
+    load = f" ({booked_minutes * 100 // available}%)" if available else ""
+
+    title = "неделю" if period == "w" else "месяц"
+    text = f"📊 Статистика за {title} {first.strftime('%d.%m')}–{last.strftime('%d.%m.%Y')}\n\n"
+    text += "Записей: " + ", ".join(f"{label} {by_status.get(status, 0)}" for status, label in STATUS_LABELS.items()) + "\n"
+    text += f"Занято: {booked_minutes / 60:.1f} ч из {available / 60:.0f} ч{load}\n"
+    text += f"Выручка (завершённые): {sum(r for _, r in by_service.values())} ₽\n"
+    if by_service:
+        text += "\nПо услугам:\n"
+        for service, (count, revenue) in sorted(by_service.items(), key=lambda item: -item[1][1]):
+            text += f"• {service} — {count} шт., {revenue} ₽\n"
+
+    kb = InlineKeyboardBuilder()
+    kb.button(text="◀️", callback_data=StatsCb(period=period, shift=shift + 1))
+    kb.button(text="Месяц" if period == "w" else "Неделя", callback_data=StatsCb(period="m" if period == "w" else "w"))
+    if shift:
+        kb.button(text="▶️", callback_data=StatsCb(period=period, shift=shift - 1))
+    kb.button(text="⬅️ Главное", callback_data="admin_panel")
+    kb.adjust(3 if shift else 2, 1)
+    await callback.message.edit_text(text, reply_markup=kb.as_markup())
+
+
+@router.message(Command("rebuild_stats"))
+async def rebuild_stats(message: Message):
+    """Пересчитать сводки по всей истории (проверка): сообщает, сколько ключей расходилось"""
+    if message.from_user.id not in ADMIN_ID:
+        return
+    mismatched = await rebuild_rollups()
+    await message.answer(f"📊 Сводки пересчитаны. Расхождений до пересчёта: {mismatched}")
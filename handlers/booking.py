@@ -1,5 +1,6 @@
 import logging
-from datetime import datetime, timedelta
+import secrets
+from datetime import datetime, date, timedelta
 
 from aiogram import Router, F
 from aiogram.types import CallbackQuery
@@ -7,9 +8,14 @@ from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from states import BookingState
-from database import get_services, add_booking, get_busy_times, get_user_bookings, delete_booking, get_service, get_work_hours
-from keyboards import main_menu_kb
-from config import ADMIN_ID
+from database import (
+    get_services, reserve_booking, get_free_slots, get_user_bookings, cancel_user_booking, get_service_by_id,
+    get_service_masters, get_master, get_days_occupancy,
+)
+from keyboards import main_menu_kb, services_kb, masters_kb, calendar_kb, CALENDAR_LEGEND
+from callbacks import ServiceCb, MasterCb, DateCb, CalendarCb, TimeCb, CancelBookingCb
+from availability import to_minutes, format_minutes, is_closed
+from config import ADMIN_ID, BOOKING_WINDOW_DAYS
 
 router = Router()
 
@@ -19,106 +25,161 @@ async def choose_service(callback: CallbackQuery, state: FSMContext):
     """Выбор услуги: показываем название, цену и примерную длительность"""
     await state.clear()
     services = await get_services()
-    
-    logging.info(f"Загруженные услуги: {services}")
-    
+
     if not services:
         await callback.answer("Услуг пока нет. Добавьте их через админку.", show_alert=True)
         return
     
-    kb = InlineKeyboardBuilder()
-    for name, price, duration in services:
-        dur = duration if duration else 0
-        kb.button(text=f"{name} — от {price}₽ — {dur} мин", callback_data=f"svc_{name}")
-    kb.adjust(1)
-    kb.button(text="⬅️ Назад", callback_data="to_main")
-    
-    await callback.message.edit_text("Выберите услугу:", reply_markup=kb.as_markup())
+    await callback.message.edit_text("Выберите услугу:", reply_markup=services_kb(services))
     await state.set_state(BookingState.choosing_service)
 
 
-@router.callback_query(F.data.startswith("svc_"))
-async def choose_date(callback: CallbackQuery, state: FSMContext):
+@router.callback_query(ServiceCb.filter())
+async def choose_master(callback: CallbackQuery, callback_data: ServiceCb, state: FSMContext):
+    """Выбор мастера (шаг пропускается, если услугу выполняет один мастер)"""
+    # достаём название, цену и длительность по id, чтобы сохранить в состоянии
+    info = await get_service_by_id(callback_data.id)
+    if info is None:
+        await callback.answer("Услуга больше недоступна, выберите другую.", show_alert=True)
+        return
+    masters = await get_service_masters(callback_data.id)
+    if not masters:
+        await callback.answer("Эту услугу сейчас некому выполнить, выберите другую.", show_alert=True)
+        return
+    service, price, duration = info
+    data = await state.update_data(
+        service_id=callback_data.id, service=service, price=price, duration=duration or 0, master_id=0
+    )
+    if len(masters) == 1:
+        await show_dates(callback, state, await state.update_data(master_id=masters[0][0]))
+        return
+
+    await callback.message.edit_text(
+        f"Услуга: {service} — от {price}₽ — {data['duration']} мин\nВыберите мастера:",
+        reply_markup=masters_kb(masters)
+    )
+    await state.set_state(BookingState.choosing_master)
+
+
+@router.callback_query(MasterCb.filter())
+async def choose_date(callback: CallbackQuery, callback_data: MasterCb, state: FSMContext):
     """Выбор даты"""
-    service = callback.data.replace("svc_", "")
-    # достаём цену и длительность чтобы сохранять в состоянии
-    info = await get_service(service)
-    if info:
-        price, duration = info
-        duration = duration or 0
-    else:
-        price, duration = "", 0
-    await state.update_data(service=service, price=price, duration=duration)
-    
-    kb = InlineKeyboardBuilder()
-    today = datetime.now()
-    for i in range(1, 8):
-        day = today + timedelta(days=i)
-        kb.button(text=day.strftime("%d.%m"), callback_data=f"date_{day.strftime('%Y-%m-%d')}")
-    kb.adjust(3)
-    kb.button(text="⬅️ Назад", callback_data="book")
-    
+    data = await state.update_data(master_id=callback_data.id)
+    await show_dates(callback, state, data)
+
+
+async def show_dates(callback: CallbackQuery, state: FSMContext, data: dict, month: str = None):
+    """Календарь месяца с заполненностью дней окна записи для услуги и мастера из состояния"""
+    today = datetime.now().date()
+    first, last = today + timedelta(days=1), today + timedelta(days=BOOKING_WINDOW_DAYS)
+    try:
+        shown = date.fromisoformat(f"{month}-01") if month else first.replace(day=1)
+    except ValueError:
+        shown = first.replace(day=1)
+    shown = min(max(shown, first.replace(day=1)), last.replace(day=1))
+    following = (shown + timedelta(days=31)).replace(day=1)
+
+    # дни окна в показанном месяце: заполненность всех — одной выборкой (см. get_days_occupancy)
+    dates = []
+    day = max(first, shown)
+    while day <= last and day < following:
+        dates.append(day.isoformat())
+        day += timedelta(days=1)
+    open_dates = [d for d in dates if not is_closed(d)]
+    occupancy = await get_days_occupancy(open_dates, data.get('duration', 0), await candidate_masters(data))
+    days = {}
+    for d in dates:
+        free, total = occupancy.get(d, (0, 0))
+        if not total:
+            days[d] = "closed"
+        elif not free:
+            days[d] = "full"
+        else:
+            days[d] = "partial" if free < total else "free"
+
+    previous = (shown - timedelta(days=1)).replace(day=1)
+    master = await get_master(data['master_id']) if data.get('master_id') else None
+    who = f"Мастер: {master[1]}\n" if master else ""
     await callback.message.edit_text(
-        f"Услуга: {service} — от {price}₽ — {duration} мин\nВыберите дату:",
-        reply_markup=kb.as_markup()
+        f"Услуга: {data['service']} — от {data['price']}₽ — {data['duration']} мин\n{who}"
+        f"Выберите дату:\n{CALENDAR_LEGEND}",
+        reply_markup=calendar_kb(
+            shown, days,
+            prev_month=previous.strftime("%Y-%m") if shown > first.replace(day=1) else None,
+            next_month=following.strftime("%Y-%m") if following <= last else None,
+        )
     )
     await state.set_state(BookingState.choosing_date)
 
 
-@router.callback_query(F.data.startswith("date_"))
-async def choose_time(callback: CallbackQuery, state: FSMContext):
-    """Выбор времени с учётом длительности и рабочих часов"""
-    date = callback.data.replace("date_", "")
-    await state.update_data(date=date)
-    
+@router.callback_query(CalendarCb.filter())
+async def calendar_page(callback: CallbackQuery, callback_data: CalendarCb, state: FSMContext):
+    """Листание календаря по месяцам"""
     data = await state.get_data()
-    duration = data.get('duration', 0)
-
-    # часы работы
-    start_str, end_str = await get_work_hours()
-    day_start = datetime.fromisoformat(f"{date}T{start_str}")
-    day_end = datetime.fromisoformat(f"{date}T{end_str}")
-
-    # загружаем занятые интервалы
-    busy = await get_busy_times(date)  # list of (time, dur)
-    busy_intervals = []
-    for t, d in busy:
-        st = datetime.fromisoformat(f"{date}T{t}")
-        busy_intervals.append((st, st + timedelta(minutes=d)))
-
-    slots = []
-    step = timedelta(minutes=30)  # шаг можно изменять
-    current = day_start
-    dur_delta = timedelta(minutes=duration)
-    while current + dur_delta <= day_end:
-        overlap = False
-        for st, ed in busy_intervals:
-            if not (current + dur_delta <= st or current >= ed):
-                overlap = True
-                break
-        if not overlap:
-            slots.append(current.strftime("%H:%M"))
-        current += step
+    if 'service' not in data:
+        await callback.answer("Начните запись заново.", show_alert=True)
+        return
+    await show_dates(callback, state, data, callback_data.month)
+
+
+# подсказки для дней календаря, которые нельзя выбрать
+DAY_HINTS = {
+    "day_full": "На этот день свободного времени нет, выберите другой.",
+    "day_closed": "В этот день салон не работает.",
+    "day_none": "Запись на этот день недоступна.",
+}
+
+
+@router.callback_query(F.data.in_(DAY_HINTS.keys() | {"noop"}))
+async def calendar_hint(callback: CallbackQuery):
+    await callback.answer(DAY_HINTS.get(callback.data, ""))
+
+
+async def candidate_masters(data: dict) -> list:
+    """Мастера, среди которых ищется время: выбранный или все, кто выполняет услугу («любой»)"""
+    if data.get('master_id'):
+        return [data['master_id']]
+    return [m[0] for m in await get_service_masters(data.get('service_id'))]
+
+
+@router.callback_query(DateCb.filter())
+async def choose_time(callback: CallbackQuery, callback_data: DateCb, state: FSMContext):
+    """Выбор времени с учётом длительности и рабочих часов"""
+    if is_closed(callback_data.day):
+        await callback.answer(DAY_HINTS["day_closed"], show_alert=True)
+        return
+    data = await state.update_data(date=callback_data.day)
+    await show_slots(callback, state, data)
+
+
+async def show_slots(callback: CallbackQuery, state: FSMContext, data: dict, header: str = ""):
+    """Показать свободные слоты на выбранную в состоянии дату"""
+    date = data['date']
+    # свободные слоты берутся из индекса занятости мастеров в памяти (см. database.get_free_slots)
+    slots = await get_free_slots(date, data.get('duration', 0), await candidate_masters(data))
 
     kb = InlineKeyboardBuilder()
     for t in slots:
-        kb.button(text=t, callback_data=f"time_{t}")
+        kb.button(text=t, callback_data=TimeCb(minute=to_minutes(t)))
     kb.adjust(2)
 
-    kb.button(text="⬅️ Назад", callback_data=f"svc_{data['service']}")
+    # назад — к календарю того же месяца; диалоги, начатые до перехода на id услуг, — к списку услуг
+    back = CalendarCb(month=date[:7]) if 'service_id' in data else "book"
+    kb.button(text="⬅️ Назад", callback_data=back)
 
     await callback.message.edit_text(
-        f"Дата: {date}\nСвободное время:",
+        f"{header}Дата: {date}\nСвободное время:",
         reply_markup=kb.as_markup()
     )
     await state.set_state(BookingState.choosing_time)
 
 
-@router.callback_query(F.data.startswith("time_"))
-async def confirm(callback: CallbackQuery, state: FSMContext):
+@router.callback_query(TimeCb.filter())
+async def confirm(callback: CallbackQuery, callback_data: TimeCb, state: FSMContext):
     """Подтверждение записи"""
-    time = callback.data.replace("time_", "")
-    data = await state.update_data(time=time)
+    # confirm_id отличает этот диалог от следующего на тот же слот (см. finish_key)
+    data = await state.update_data(time=format_minutes(callback_data.minute), confirm_id=secrets.token_hex(4))
+    master = await get_master(data['master_id']) if data.get('master_id') else None
     
     kb = InlineKeyboardBuilder()
     kb.button(text="✅ Подтвердить", callback_data="finish")
@@ -126,44 +187,70 @@ async def confirm(callback: CallbackQuery, state: FSMContext):
     kb.adjust(1)
     
     await callback.message.edit_text(
-        f"Подтвердите запись:\n💅 {data['service']} - от {data.get('price','')}₽ - {data.get('duration',0)}мин\n📅 {data['date']}\n⏰ {data['time']}",
+        f"Подтвердите запись:\n💅 {data['service']} - от {data.get('price','')}₽ - {data.get('duration',0)}мин\n"
+        f"👩‍🎨 {master[1] if master else 'любой свободный мастер'}\n📅 {data['date']}\n⏰ {data['time']}",
         reply_markup=kb.as_markup()
     )
     await state.set_state(BookingState.confirming)
 
 
-@router.callback_query(F.data == "finish")
+async def finish_key(callback: CallbackQuery, data: dict):
+    """Ключ идемпотентности подтверждения — сам диалог, а не нажатие: двойной тап даёт два
+    разных callback, и в разных воркерах оба прошли бы проверку по id нажатия.
+    None — диалог уже завершён, тогда ключом остаётся id нажатия"""
+    dialog = await data["state"].get_data()
+    if 'time' not in dialog or 'service' not in dialog:
+        return None
+    return (f"book:{callback.from_user.id}:{dialog.get('service_id')}:{dialog['date']}:{dialog['time']}:"
+            f"{dialog.get('confirm_id')}")
+
+
+@router.callback_query(F.data == "finish", flags={"idempotent": finish_key})
 async def finish(callback: CallbackQuery, state: FSMContext):
-    """Завершение записи"""
-    from bot import bot
+    """Завершение записи (повторное нажатие не создаёт вторую запись, см. finish_key и middlewares.py)"""
+    from bot import notifier
     
     data = await state.get_data()
+    if 'time' not in data or 'service' not in data:
+        # диалог уже завершён (запись оформлена) или устарел
+        await callback.answer("Запись уже оформлена или устарела.", show_alert=True)
+        await callback.message.edit_text("Главное меню:", reply_markup=main_menu_kb(callback.from_user.id))
+        return
     
-    await add_booking(
+    reserved = await reserve_booking(
         user_id=callback.from_user.id,
         username=callback.from_user.username,
         service=data['service'],
         date=data['date'],
         time=data['time'],
-        duration=data.get('duration',0)
+        duration=data.get('duration',0),
+        master_ids=await candidate_masters(data)
     )
+    if reserved is None:
+        # слот успели занять, пока пользователь подтверждал — показываем обновлённый список
+        await callback.answer("Это время уже занято, выберите другое.", show_alert=True)
+        await show_slots(callback, state, data, header="⚠️ Выбранное время уже занято.\n")
+        return
     
+    _, master_id = reserved
+    master = await get_master(master_id)
+    master_name = master[1] if master else "—"
     await callback.message.edit_text(
-        "🎉 Вы успешно записаны!",
+        f"🎉 Вы успешно записаны! Мастер: {master_name}",
         reply_markup=main_menu_kb(callback.from_user.id)
     )
     
-    # Уведомление мастеру
-    note_text = f"🔔 Новая запись: @{callback.from_user.username}\n{data['service']} - {data['date']} {data['time']}"
-    logging.info(f"admin notification: {note_text}")
-    if ADMIN_ID:
-        for admin_id in ADMIN_ID:
-            try:
-                await bot.send_message(admin_id, note_text)
-            except Exception as e:
-                logging.error(f"Не удалось отправить уведомление админу {admin_id}: {e}")
+    # Уведомление мастеру: в его чат, а если он не указан — администраторам
+    note_text = (f"🔔 Новая запись: @{callback.from_user.username}\n"
+                 f"{data['service']} - {data['date']} {data['time']}\nМастер: {master_name}")
+    logging.info("master notification: %s", note_text)
+    recipients = [master[2]] if master and master[2] else ADMIN_ID
+    if recipients:
+        # отправка идёт в фоне с лимитами и повторами (см. notifier.py), клиент не ждёт
+        for chat_id in recipients:
+            notifier.enqueue(chat_id, note_text)
     else:
-        logging.warning("ADMIN_ID не задан, уведомление не отправлено")
+        logging.warning("Ни чат мастера, ни ADMIN_ID не заданы, уведомление не отправлено")
     
     await state.clear()
 
@@ -179,19 +266,23 @@ async def my_bookings(callback: CallbackQuery):
     
     text = "📅 Ваши записи:\n\n"
     kb = InlineKeyboardBuilder()
-    for booking_id, service, date, time, duration, status in bookings:
-        text += f"📍 {date} {time} — {service} ({duration} мин) | статус: {status}\n"
-        kb.button(text=f"❌ Отменить {date}", callback_data=f"del_{booking_id}")
+    for booking_id, service, date, time, duration, status, master in bookings:
+        text += f"📍 {date} {time} — {service} ({duration} мин), мастер: {master or '—'} | статус: {status}\n"
+        if status == 'active':
+            kb.button(text=f"❌ Отменить {date}", callback_data=CancelBookingCb(id=booking_id))
     
     kb.button(text="⬅️ В меню", callback_data="to_main")
     kb.adjust(1)
     await callback.message.edit_text(text, reply_markup=kb.as_markup())
 
 
-@router.callback_query(F.data.startswith("del_"))
-async def del_booking(callback: CallbackQuery):
+@router.callback_query(CancelBookingCb.filter(), flags={"idempotent": True})
+async def del_booking(callback: CallbackQuery, callback_data: CancelBookingCb):
     """Отмена записи"""
-    booking_id = int(callback.data.replace("del_", ""))
-    await delete_booking(booking_id)
+    # запись не удаляется, а получает статус canceled: история остаётся для отчётов
+    if not await cancel_user_booking(callback_data.id, callback.from_user.id):
+        await callback.answer("Запись уже отменена или не найдена.", show_alert=True)
+        await my_bookings(callback)
+        return
     await callback.answer("Запись отменена!")
     await my_bookings(callback)
@@ -25,6 +25,12 @@ async def handle_booking_messages(message: Message):
     await message.answer("Пожалуйста, выбирайте услугу через кнопки 👇")
 
 
+@router.message(BookingState.choosing_master)
+async def handle_booking_master_messages(message: Message):
+    """Обработчик сообщений при выборе мастера"""
+    await message.answer("Пожалуйста, выбирайте мастера через кнопки 👇")
+
+
 @router.message(BookingState.choosing_date)
 async def handle_booking_date_messages(message: Message):
     """Обработчик сообщений при выборе даты"""
@@ -48,10 +54,11 @@ async def echo(message: Message, state: FSMContext):
     """Обработчик для всех остальных текстовых сообщений.
     Игнорирует сообщения при активном FSM-состоянии."""
     current = await state.get_state()
-    logging.info(f"common: incoming message chat_id={message.chat.id} user_id={message.from_user.id} state={current}")
+    logging.debug("common: incoming message chat_id=%s user_id=%s state=%s",
+                  message.chat.id, message.from_user.id, current)
     if current:
         # есть активное состояние, ничего не делаем
-        logging.info("common: skipping echo because FSM state is active")
+        logging.debug("common: skipping echo because FSM state is active")
         return
 
     await message.answer(
@@ -1,33 +1,131 @@
+import calendar
+from datetime import date
+from functools import lru_cache
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from config import ADMIN_ID
+from callbacks import ServiceCb, MasterCb, DateCb, CalendarCb, StatsCb
+
+# Разметки неизменяемы после сборки, поэтому одинаковые клавиатуры строятся
+# один раз и переиспользуются во всех ответах.
 
 
 def main_menu_kb(user_id: int):
     """Главное меню"""
+    return _main_menu_markup(user_id in ADMIN_ID)
+
+
+@lru_cache(maxsize=2)
+def _main_menu_markup(is_admin: bool):
     kb = InlineKeyboardBuilder()
     kb.button(text="💅 Записаться", callback_data="book")
     kb.button(text="📅 Мои записи", callback_data="my_bookings")
     
-    if user_id in ADMIN_ID:
+    if is_admin:
         kb.button(text="🛠 Админка", callback_data="admin_panel")
     
     kb.adjust(1)
     return kb.as_markup()
 
 
+@lru_cache(maxsize=1)
 def admin_panel_kb():
     """Админ панель"""
     kb = InlineKeyboardBuilder()
     kb.button(text="➕ Добавить услугу", callback_data="add_svc")
     kb.button(text="📋 Список всех записей", callback_data="view_all_bookings")
-    kb.button(text="⏰ Часы работы", callback_data="set_hours")
+    kb.button(text="🔎 Поиск записей", callback_data="search")
+    kb.button(text="👩‍🎨 Мастера и часы работы", callback_data="masters")
+    kb.button(text="📤 Выгрузка записей", callback_data="export")
+    kb.button(text="📊 Статистика", callback_data=StatsCb().pack())
     kb.button(text="⬅️ Назад", callback_data="to_main")
     kb.adjust(1)
     return kb.as_markup()
 
 
+@lru_cache(maxsize=1)
 def back_to_admin_kb():
     """Кнопка назад в админ панель"""
     kb = InlineKeyboardBuilder()
     kb.button(text="⬅️ Назад", callback_data="admin_panel")
     return kb.as_markup()
+
+
+_services_kb = (None, None)  # (ключ каталога, разметка)
+
+
+def services_kb(services):
+    """Список услуг. Пересобирается только когда меняется каталог (другой ключ)"""
+    global _services_kb
+    key = tuple(services)
+    if _services_kb[0] != key:
+        kb = InlineKeyboardBuilder()
+        for service_id, name, price, duration in services:
+            dur = duration if duration else 0
+            kb.button(text=f"{name} — от {price}₽ — {dur} мин", callback_data=ServiceCb(id=service_id))
+        kb.adjust(1)
+        kb.button(text="⬅️ Назад", callback_data="to_main")
+        _services_kb = (key, kb.as_markup())
+    return _services_kb[1]
+
+
+def masters_kb(masters):
+    """Выбор мастера для услуги: каждый мастер и «любой свободный»"""
+    kb = InlineKeyboardBuilder()
+    kb.button(text="🎲 Любой свободный мастер", callback_data=MasterCb(id=0))
+    for master_id, name, *_ in masters:
+        kb.button(text=name, callback_data=MasterCb(id=master_id))
+    kb.button(text="⬅️ Назад", callback_data="book")
+    kb.adjust(1)
+    return kb.as_markup()
+
+
+MONTHS = ("Январь", "Февраль", "Март", "Апрель", "Май", "Июнь",
+          "Июль", "Август", "Сентябрь", "Октябрь", "Ноябрь", "Декабрь")
+WEEKDAYS = ("Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс")
+# статус дня в календаре -> метка перед числом
+DAY_MARKS = {"free": "🟢", "partial": "🟡", "full": "🔴", "closed": "✖"}
+CALENDAR_LEGEND = "🟢 свободно  🟡 есть время  🔴 занято  ✖ выходной"
+
+
+def _button(text: str, callback_data) -> InlineKeyboardButton:
+    if not isinstance(callback_data, str):
+        callback_data = callback_data.pack()
+    return InlineKeyboardButton(text=text, callback_data=callback_data)
+
+
+@lru_cache(maxsize=1)
+def _weekdays_row():
+    return [_button(name, "noop") for name in WEEKDAYS]
+
+
+def calendar_kb(month: date, days: dict, prev_month: str = None, next_month: str = None):
+    """Месяц сеткой по неделям. days — {дата ISO: free/partial/full/closed} для дней окна записи:
+    выбрать можно только free и partial, остальные дни отвечают подсказкой.
+    prev_month / next_month — соседние месяцы окна (YYYY-MM) для листания.
+
+    Строки собираются напрямую: InlineKeyboardBuilder копирует всю разметку на каждую
+    кнопку, и на сетке из ~50 кнопок это заметно нагружает цикл событий"""
+    rows = [[
+        _button("◀️", CalendarCb(month=prev_month)) if prev_month else _button("·", "noop"),
+        _button(f"{MONTHS[month.month - 1]} {month.year}", "noop"),
+        _button("▶️", CalendarCb(month=next_month)) if next_month else _button("·", "noop"),
+    ], _weekdays_row()]
+    for week in calendar.monthcalendar(month.year, month.month):
+        row = []
+        for day in week:
+            if not day:
+                row.append(_button("·", "noop"))
+                continue
+            iso = month.replace(day=day).isoformat()
+            status = days.get(iso)
+            if status in ("free", "partial"):
+                row.append(_button(f"{DAY_MARKS[status]}{day}", DateCb(day=iso)))
+            elif status is not None:
+                row.append(_button(f"{DAY_MARKS[status]}{day}", f"day_{status}"))
+            else:
+                row.append(_button(str(day), "day_none"))
+        rows.append(row)
+    rows.append([_button("⬅️ Назад", "book")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
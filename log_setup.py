@@ -0,0 +1,110 @@
+"""Настройка логирования без блокировки цикла событий.
+
+Все логгеры пишут в QueueHandler: вызов logging.info() в обработчике только
+кладёт запись в очередь, а форматирование и вывод выполняет отдельный поток
+QueueListener. Сообщения передаются %-шаблоном с аргументами и собираются
+уже в этом потоке (поэтому в аргументы не стоит передавать объекты, которые
+меняются сразу после вызова). Формат — текст или JSON по строке на запись;
+DEBUG и поапдейтные сообщения aiogram можно прореживать (LOG_SAMPLE_RATE).
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+# логгеры, пишущие INFO на каждый апдейт, — прореживаются вместе с DEBUG
+SAMPLED_LOGGERS = ("aiogram.event",)
+# шумные INFO сторонних библиотек (запуск каждого задания планировщика)
+QUIET_LOGGERS = ("apscheduler.executors.default",)
+
+# стандартные атрибуты LogRecord; всё остальное — поля из extra=...
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись: время, уровень, логгер, сообщение и поля из extra"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SampleFilter(logging.Filter):
+    """Пропускает долю rate записей DEBUG и поапдейтных логгеров, остальные — все"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG and record.name not in SAMPLED_LOGGERS:
+            return True
+        return self.rate >= 1 or random.random() < self.rate
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """QueueHandler без форматирования в вызывающем потоке: очередь внутрипроцессная,
+    запись можно передать как есть"""
+
+    def prepare(self, record):
+        return record
+
+
+_listener = None
+_fork_hook = None
+
+
+def _start_listener(handler: QueueHandler, output: logging.Handler):
+    global _listener
+    handler.queue = queue.SimpleQueue()
+    _listener = QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logging():
+    """Дописать очередь логов и остановить поток вывода"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def setup_logging(level: str = "INFO", fmt: str = "text", sample_rate: float = 1.0):
+    """Направить корневой логгер через очередь в поток вывода (stderr)"""
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+
+    handler = _DeferredQueueHandler(queue.SimpleQueue())
+    handler.addFilter(SampleFilter(sample_rate))
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+    for name in QUIET_LOGGERS:
+        logging.getLogger(name).setLevel(max(logging.WARNING, root.level))
+
+    global _fork_hook
+    stop_logging()
+    _start_listener(handler, output)
+    if _fork_hook is None:
+        atexit.register(stop_logging)
+        # поток вывода не переживает fork (webhook-воркеры) — в дочернем процессе поднимаем свой
+        os.register_at_fork(after_in_child=lambda: _fork_hook())
+    _fork_hook = lambda: _start_listener(handler, output)
@@ -3,28 +3,105 @@
 import asyncio
 import logging
 
-from database import init_db
+from config import (
+    BOT_MODE, SHARED_STATE, CACHE_SYNC_INTERVAL, REMINDER_CHECK_INTERVAL,
+    METRICS_HOST, METRICS_PORT, METRICS_LOG_INTERVAL, MAINTENANCE_HOUR,
+)
+from database import (
+    init_db, open_pool, close_pool, pool_stats, warm_availability, start_writer, stop_writer,
+    sync_shared_caches, cache_stats, writer_stats, availability_stats,
+)
 from handlers import common, booking, admin
-from bot import bot, dp, scheduler
+from bot import bot, dp, scheduler, notifier
+from reminders import run_reminders
+from maintenance import run_maintenance
+from middlewares import setup_middlewares, guard_stats
+import metrics
 
 # Подключение обработчиков: специфичные роутеры первыми, общий последний
 dp.include_router(booking.router)
 dp.include_router(admin.router)
 dp.include_router(common.router)
 # Подключение обработчиков
+setup_middlewares(dp)
 
+metrics.register_gauges("pool", pool_stats)
+metrics.register_gauges("cache", cache_stats)
+metrics.register_gauges("writer", writer_stats)
+metrics.register_gauges("availability", availability_stats)
+metrics.register_gauges("notifier", notifier.stats)
+metrics.register_gauges("fsm", dp.storage.stats)
+metrics.register_gauges("guard", guard_stats)
+_metrics_runner = None
 
-async def main():
-    """Главная функция"""
+
+async def startup(primary: bool = True, worker: int = 0):
+    """Открыть БД и запустить фоновые задачи.
+
+    primary — процесс, который выполняет общие для всех воркеров задания планировщика
+    (при нескольких webhook-воркерах он один); worker — номер воркера (сдвиг порта метрик)"""
+    global _metrics_runner
     logging.info("Инициализация БД...")
     await init_db()
-    
+    await open_pool()
+    await start_writer()
+    if SHARED_STATE:
+        await sync_shared_caches()
+    await warm_availability()
+
+    await dp.storage.start()
+    await notifier.start()
+    if METRICS_PORT:
+        _metrics_runner = await metrics.start_server(METRICS_HOST, METRICS_PORT + worker)
+
     logging.info("Запуск планировщика...")
+    # окно записи сдвигается каждые сутки — перегружаем индекс занятости после полуночи
+    scheduler.add_job(warm_availability, "cron", hour=0, minute=5)
+    if SHARED_STATE:
+        # другие процессы пишут в ту же БД — периодически сверяем поколения кэшей
+        scheduler.add_job(sync_shared_caches, "interval", seconds=CACHE_SYNC_INTERVAL)
+    if primary:
+        # напоминания и автозавершение — одно задание со сканированием диапазона индекса
+        scheduler.add_job(run_reminders, "interval", seconds=REMINDER_CHECK_INTERVAL,
+                          max_instances=1, coalesce=True)
+        # архив, ANALYZE и по расписанию VACUUM — в часы без нагрузки
+        scheduler.add_job(run_maintenance, "cron", hour=MAINTENANCE_HOUR, minute=30,
+                          max_instances=1, coalesce=True)
+    if METRICS_LOG_INTERVAL:
+        scheduler.add_job(metrics.log_summary, "interval", seconds=METRICS_LOG_INTERVAL)
     scheduler.start()
-    
-    logging.info("Запуск polling...")
-    await dp.start_polling(bot)
+
+
+async def shutdown():
+    """Остановить фоновые задачи, дописать очереди и закрыть БД"""
+    logging.info("Остановка: статистика пула БД %s", pool_stats())
+    global _metrics_runner
+    scheduler.shutdown(wait=False)
+    if _metrics_runner is not None:
+        await _metrics_runner.cleanup()
+        _metrics_runner = None
+    metrics.log_summary()
+    await notifier.stop()
+    # при polling уже закрыто в dp.shutdown; повторный вызов безопасен
+    await dp.storage.close()
+    await stop_writer()
+    await close_pool()
+    await bot.session.close()
+
+
+async def main():
+    """Главная функция (режим polling)"""
+    await startup()
+    try:
+        logging.info("Запуск polling...")
+        await dp.start_polling(bot)
+    finally:
+        await shutdown()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if BOT_MODE == "webhook":
+        from webhook import run_webhook
+        run_webhook(startup, shutdown)
+    else:
+        asyncio.run(main())
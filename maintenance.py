@@ -0,0 +1,29 @@
+"""Ночное обслуживание БД: архивирование старых записей, ANALYZE и VACUUM.
+
+Горячая таблица bookings держит только актуальные записи: завершённые и
+отменённые старше ARCHIVE_AFTER_DAYS дней переносятся в bookings_archive.
+Пути клиента и админки читают только bookings, отчёты — представление
+bookings_all (обе таблицы). Заодно удаляются устаревшие ключи идемпотентности
+кнопок. Задание выполняет основной процесс раз в сутки в MAINTENANCE_HOUR,
+когда нагрузки почти нет.
+"""
+import logging
+import time
+from datetime import datetime, timedelta
+
+from availability import datetime_epoch_minutes
+from config import ARCHIVE_AFTER_DAYS, VACUUM_WEEKDAY, IDEMPOTENCY_TTL
+from database import archive_bookings, optimize_db, delete_expired_idempotency_keys
+
+
+async def run_maintenance():
+    """Перенести старые записи в архив и обновить статистику; в день VACUUM_WEEKDAY — VACUUM"""
+    now = datetime.now()
+    if ARCHIVE_AFTER_DAYS > 0:
+        moved = await archive_bookings(datetime_epoch_minutes(now - timedelta(days=ARCHIVE_AFTER_DAYS)))
+        logging.info("В архив перенесено записей: %s", moved)
+    expired = await delete_expired_idempotency_keys(int(time.time()) - IDEMPOTENCY_TTL)
+    logging.info("Удалено устаревших ключей идемпотентности: %s", expired)
+    vacuum = now.weekday() == VACUUM_WEEKDAY
+    await optimize_db(vacuum)
+    logging.info("Обслуживание БД завершено (VACUUM: %s)", "да" if vacuum else "нет")
@@ -0,0 +1,178 @@
+"""Метрики: время обработчиков и запросов к БД.
+
+Гистограммы с фиксированными корзинами и счётчики в памяти процесса.
+Экспорт — текстовый формат Prometheus на локальном HTTP-адресе
+(METRICS_HOST:METRICS_PORT/metrics) и периодическая сводка в лог за
+прошедший интервал. Замер — два вызова perf_counter и пара сложений,
+без блокировок: всё обновляется из одного цикла событий.
+"""
+import bisect
+import logging
+import time
+from functools import wraps
+
+from aiohttp import web
+
+# верхние границы корзин, секунды
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Распределение длительностей по значению метки (обработчик, запрос)"""
+
+    def __init__(self, name: str, help_text: str, label: str, buckets=BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.buckets = buckets
+        self._series = {}  # значение метки -> [счётчики корзин..., +Inf, сумма]
+
+    def observe(self, label_value: str, seconds: float):
+        series = self._series.get(label_value)
+        if series is None:
+            series = self._series[label_value] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, seconds)] += 1
+        series[-1] += seconds
+
+    def snapshot(self) -> dict:
+        return {label: list(series) for label, series in self._series.items()}
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for value, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{self.label}="{value}",le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{self.label}="{value}"}} {series[-1]:.6f}')
+            lines.append(f'{self.name}_count{{{self.label}="{value}"}} {cumulative}')
+        return lines
+
+
+class Counter:
+    """Счётчик по значению метки"""
+
+    def __init__(self, name: str, help_text: str, label: str):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self._values = {}
+
+    def inc(self, label_value: str, amount: int = 1):
+        self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def value(self, label_value: str) -> int:
+        return self._values.get(label_value, 0)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for value, count in sorted(self._values.items()):
+            lines.append(f'{self.name}{{{self.label}="{value}"}} {count}')
+        return lines
+
+
+handler_seconds = Histogram("bot_handler_seconds", "Время обработки апдейта обработчиком", "handler")
+handler_errors = Counter("bot_handler_errors_total", "Исключения в обработчиках", "handler")
+db_query_seconds = Histogram("bot_db_query_seconds", "Время функций database.py", "query")
+
+_histograms = (handler_seconds, db_query_seconds)
+_counters = (handler_errors,)
+_gauges = {}  # префикс -> функция, возвращающая словарь чисел (pool_stats, writer_stats...)
+
+
+def register_gauges(prefix: str, stats):
+    """Экспортировать числовые поля stats() как bot_<prefix>_<поле>"""
+    _gauges[prefix] = stats
+
+
+def timed(histogram: Histogram, label_value: str = None):
+    """Декоратор корутины: время каждого вызова в histogram (метка — имя функции)"""
+    def decorator(func):
+        name = label_value or func.__name__
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(name, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def render() -> str:
+    """Все метрики в текстовом формате Prometheus"""
+    lines = []
+    for metric in _histograms + _counters:
+        lines.extend(metric.render())
+    for prefix, stats in _gauges.items():
+        try:
+            values = stats()
+        except Exception as e:
+            logging.warning("Метрики %s недоступны: %s", prefix, e)
+            continue
+        for key, value in values.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f"# TYPE bot_{prefix}_{key} gauge")
+                lines.append(f"bot_{prefix}_{key} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def _quantile(buckets, counts, q):
+    """Оценка квантиля по корзинам (верхняя граница корзины)"""
+    total = sum(counts)
+    if not total:
+        return 0.0
+    rank, cumulative = q * total, 0
+    for bound, count in zip(buckets + (float("inf"),), counts):
+        cumulative += count
+        if cumulative >= rank:
+            return bound
+    return float("inf")
+
+
+_last = {}  # имя гистограммы -> снимок на момент прошлой сводки
+
+
+def summary() -> list:
+    """Строки сводки за интервал с прошлого вызова: число, среднее и p95 по меткам, самые тяжёлые первыми"""
+    lines = []
+    for histogram in _histograms:
+        current = histogram.snapshot()
+        previous = _last.get(histogram.name, {})
+        _last[histogram.name] = current
+        rows = []
+        for value, series in current.items():
+            before = previous.get(value, [0] * len(series))
+            counts = [a - b for a, b in zip(series[:-1], before[:-1])]
+            count = sum(counts)
+            if count:
+                total = series[-1] - before[-1]
+                rows.append((total, value, count, _quantile(histogram.buckets, counts, 0.95)))
+        for total, value, count, p95 in sorted(rows, reverse=True):
+            lines.append(f"{histogram.label}={value} n={count} avg={total / count * 1000:.1f}мс "
+                         f"p95<={p95 * 1000:g}мс всего={total:.2f}с")
+    return lines
+
+
+def log_summary():
+    """Записать сводку за интервал в лог (задание планировщика)"""
+    lines = summary()
+    if lines:
+        logging.info("Метрики за интервал:\n  %s", "\n  ".join(lines))
+
+
+async def _handle_metrics(request):
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_server(host: str, port: int):
+    """Поднять HTTP-эндпоинт /metrics, вернуть runner для остановки"""
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info("Метрики: http://%s:%s/metrics", host, port)
+    return runner
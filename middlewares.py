@@ -0,0 +1,163 @@
+"""Middleware диспетчера: метрики и защита от повторных нажатий.
+
+Нажатия кнопок проходят три фильтра:
+- ThrottleMiddleware — не больше THROTTLE_RATE нажатий в секунду на пользователя
+  (всплеск до THROTTLE_BURST), лишние сразу получают ответ и до обработчиков не доходят;
+- InFlightMiddleware — пока нажатие на сообщении обрабатывается, повторные нажатия
+  того же пользователя на нём отбрасываются (двойной тап, нетерпеливые клики);
+- IdempotencyMiddleware — обработчики с флагом idempotent (подтверждение записи,
+  отмена, смена статуса) выполняются один раз на ключ: по умолчанию ключ — id
+  callback-запроса, и повторно доставленный Telegram тот же callback (ретрай
+  webhook, в том числе в другой воркер) не выполняется второй раз. Ключ занимается
+  в общей БД на IDEMPOTENCY_TTL. Двойной тап — это два разных callback, и
+  InFlightMiddleware ловит его только в пределах одного процесса; где повтор
+  между воркерами опасен (подтверждение записи), флаг задаёт функцию ключа
+  по самому действию — см. handlers/booking.py:finish_key.
+Первые два — внешние (до фильтров и FSM), третий — внутренний: ему нужны флаги
+выбранного обработчика. Новое нажатие — новый callback: ✅, ❌ и снова ✅ на одной
+записи выполняются все три; последовательные повторы безопасны сами по себе
+(смена статуса на тот же ничего не меняет, оформленная запись очищает FSM).
+"""
+import time
+from contextlib import suppress
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.exceptions import TelegramBadRequest
+
+from config import THROTTLE_RATE, THROTTLE_BURST, IDEMPOTENCY_TTL
+from database import claim_idempotency_key, release_idempotency_key
+from metrics import handler_seconds, handler_errors
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Время каждого апдейта по имени обработчика (внутренний middleware: вызывается
+    после фильтров, когда обработчик уже выбран)"""
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object is not None else "unknown"
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_seconds.observe(name, time.perf_counter() - started)
+
+
+async def _answer(callback, text: str):
+    """Мгновенный ответ на нажатие (убирает «часики» на кнопке); устаревший запрос не ошибка"""
+    with suppress(TelegramBadRequest):
+        await callback.answer(text)
+
+
+class ThrottleMiddleware(BaseMiddleware):
+    """Token bucket на пользователя: rate нажатий в секунду, запас burst. rate <= 0 — без ограничения"""
+
+    MAX_TRACKED = 10_000  # сверх этого забываем пользователей с полным запасом
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._buckets = {}  # user_id -> (запас, время последнего нажатия)
+        self.throttled = 0
+
+    async def __call__(self, handler, event, data):
+        if self.rate <= 0:
+            return await handler(event, data)
+        now = time.monotonic()
+        user_id = event.from_user.id
+        tokens, last = self._buckets.get(user_id, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens < 1:
+            self._buckets[user_id] = (tokens, now)
+            self.throttled += 1
+            await _answer(event, "Слишком часто, подождите секунду ⏳")
+            return None
+        self._buckets[user_id] = (tokens - 1, now)
+        if len(self._buckets) > self.MAX_TRACKED:
+            self._prune(now)
+        return await handler(event, data)
+
+    def _prune(self, now: float):
+        full = [user_id for user_id, (tokens, last) in self._buckets.items()
+                if tokens + (now - last) * self.rate >= self.burst]
+        for user_id in full:
+            del self._buckets[user_id]
+
+
+class InFlightMiddleware(BaseMiddleware):
+    """Одно обрабатываемое нажатие на (пользователь, сообщение), остальные отбрасываются"""
+
+    def __init__(self):
+        self._active = set()
+        self.dropped = 0
+
+    async def __call__(self, handler, event, data):
+        message_id = event.message.message_id if event.message else event.inline_message_id
+        key = (event.from_user.id, message_id)
+        if key in self._active:
+            self.dropped += 1
+            await _answer(event, "⏳ Уже обрабатываю…")
+            return None
+        self._active.add(key)
+        try:
+            return await handler(event, data)
+        finally:
+            self._active.discard(key)
+
+
+class IdempotencyMiddleware(BaseMiddleware):
+    """Обработчики с флагом idempotent выполняются один раз на ключ.
+
+    Флаг True — ключ id callback-запроса: его повторяет только повторная доставка того же нажатия,
+    а не следующее нажатие той же кнопки (и не второе нажатие двойного тапа). Флаг-функция
+    `async (event, data) -> str | None` строит ключ по действию; None — ключ по id нажатия.
+    Если обработчик упал, ключ освобождается для повтора"""
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self.repeated = 0
+
+    async def __call__(self, handler, event, data):
+        flag = get_flag(data, "idempotent")
+        if not flag:
+            return await handler(event, data)
+        key = (await flag(event, data) if callable(flag) else None) or f"cb:{event.id}"
+
+        if not await claim_idempotency_key(key, int(time.time()), self.ttl):
+            self.repeated += 1
+            await _answer(event, "Уже выполнено ✅")
+            return None
+        try:
+            return await handler(event, data)
+        except Exception:
+            await release_idempotency_key(key)
+            raise
+
+
+_throttle = ThrottleMiddleware(THROTTLE_RATE, THROTTLE_BURST)
+_in_flight = InFlightMiddleware()
+_idempotency = IdempotencyMiddleware(IDEMPOTENCY_TTL)
+
+
+def guard_stats() -> dict:
+    """Счётчики отброшенных нажатий (для метрик)"""
+    return {
+        "throttled": _throttle.throttled,
+        "in_flight": len(_in_flight._active),
+        "duplicates": _in_flight.dropped,
+        "repeated": _idempotency.repeated,
+    }
+
+
+def setup_middlewares(dp):
+    """Подключить middleware ко всем роутерам диспетчера"""
+    metrics = MetricsMiddleware()
+    dp.message.middleware(metrics)
+    dp.callback_query.middleware(metrics)
+    dp.callback_query.outer_middleware(_throttle)
+    dp.callback_query.outer_middleware(_in_flight)
+    dp.callback_query.middleware(_idempotency)
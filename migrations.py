@@ -0,0 +1,357 @@
+"""Версионированные миграции схемы БД.
+
+Текущая версия схемы хранится в таблице settings под ключом schema_version.
+При старте применяются только те шаги, номер которых больше сохранённого,
+каждый шаг — в своей транзакции вместе с обновлением версии.
+"""
+import logging
+
+import aiosqlite
+
+from availability import epoch_minutes
+import rollups
+
+
+VERSION_KEY = "schema_version"
+# токенизатор trigram для полнотекстового поиска появился в SQLite 3.34.0
+FTS_MIN_SQLITE = (3, 34, 0)
+
+
+async def _columns(db, table: str) -> set:
+    async with db.execute(f"PRAGMA table_info({table})") as cursor:
+        return {row[1] for row in await cursor.fetchall()}
+
+
+async def _add_missing_columns(db, table: str, columns: dict):
+    """ALTER TABLE только для реально отсутствующих колонок (для старых баз)"""
+    existing = await _columns(db, table)
+    for name, ddl in columns.items():
+        if name not in existing:
+            await db.execute(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}")
+
+
+async def _v1_base_schema(db):
+    """Базовые таблицы и колонки, которые раньше добавлялись через try/except ALTER"""
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS services(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT,
+        price TEXT,
+        duration INTEGER    -- примерное время выполнения в минутах
+    )""")
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS bookings(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        username TEXT,
+        service TEXT,
+        date TEXT,
+        time TEXT,
+        duration INTEGER,
+        status TEXT DEFAULT 'active'  -- active, done, canceled
+    )""")
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS reviews(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        text TEXT
+    )""")
+    await _add_missing_columns(db, "services", {"price": "TEXT", "duration": "INTEGER"})
+    await _add_missing_columns(db, "bookings", {"duration": "INTEGER", "status": "TEXT DEFAULT 'active'"})
+
+
+async def _v2_indexes(db):
+    """Индексы под горячие запросы: занятость дня, записи клиента, услуга по имени"""
+    # перед уникальным индексом убираем дубликаты услуг, оставляя первую запись
+    await db.execute("DELETE FROM services WHERE id NOT IN (SELECT MIN(id) FROM services GROUP BY name)")
+    await db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_services_name ON services(name)")
+    # покрывающий индекс занятости дня: WHERE date=? AND status=? -> time, duration
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_bookings_date_status ON bookings(date, status, time, duration)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_bookings_user_date ON bookings(user_id, date)")
+
+
+async def _v3_booking_order_indexes(db):
+    """Индексы под постраничный просмотр записей в порядке (date, time, id)"""
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_bookings_date_time ON bookings(date, time)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_bookings_status_date_time ON bookings(status, date, time)")
+
+
+async def _v4_fsm_storage(db):
+    """Таблица FSM-состояний (storage.SQLiteStorage), переживающих перезапуск"""
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS fsm_storage(
+        key TEXT PRIMARY KEY,
+        state TEXT,
+        data TEXT,          -- JSON
+        updated_at INTEGER  -- unix time последнего изменения
+    )""")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_fsm_storage_updated ON fsm_storage(updated_at)")
+
+
+async def _v5_reminder_markers(db):
+    """Отметки отправленных напоминаний, чтобы после перезапуска не слать их повторно"""
+    await _add_missing_columns(db, "bookings", {
+        "reminded_24h": "INTEGER NOT NULL DEFAULT 0",
+        "reminded_2h": "INTEGER NOT NULL DEFAULT 0",
+    })
+
+
+async def _v6_epoch_minutes(db):
+    """Начало и конец записи целыми эпоха-минутами: пересечения и диапазоны — сравнения по индексу"""
+    await _add_missing_columns(db, "bookings", {"start_min": "INTEGER", "end_min": "INTEGER"})
+    async with db.execute("SELECT id, date, time, duration FROM bookings WHERE start_min IS NULL") as cursor:
+        rows = await cursor.fetchall()
+    updates = []
+    for bid, date, time, duration in rows:
+        try:
+            start = epoch_minutes(date, time)
+        except (TypeError, ValueError, AttributeError):
+            logging.warning("Запись #%s: не удалось разобрать дату/время %r %r", bid, date, time)
+            continue
+        updates.append((start, start + (duration or 0), bid))
+    await db.executemany("UPDATE bookings SET start_min=?, end_min=? WHERE id=?", updates)
+    # активные записи, пересекающие диапазон: status=? AND start_min в [a - длина, b) AND end_min > a
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_bookings_status_span ON bookings(status, start_min, end_min)")
+
+
+# колонки bookings, общие с архивом, на момент версии 7
+_V7_BOOKING_COLUMNS = (
+    "id", "user_id", "username", "service", "date", "time", "duration", "status",
+    "reminded_24h", "reminded_2h", "start_min", "end_min",
+)
+_V8_BOOKING_COLUMNS = _V7_BOOKING_COLUMNS + ("price",)
+_V9_BOOKING_COLUMNS = _V8_BOOKING_COLUMNS + ("master_id",)
+# текущий набор (новые колонки bookings добавлять и сюда, и в архив, и пересоздавать bookings_all;
+# уже выпущенные шаги используют свой замороженный набор)
+BOOKING_COLUMNS = _V9_BOOKING_COLUMNS
+
+
+async def _create_bookings_all(db, columns):
+    await db.execute("DROP VIEW IF EXISTS bookings_all")
+    columns = ", ".join(columns)
+    await db.execute(
+        f"CREATE VIEW bookings_all AS SELECT {columns} FROM bookings "
+        f"UNION ALL SELECT {columns} FROM bookings_archive"
+    )
+
+
+async def _v7_bookings_archive(db):
+    """Архив старых завершённых/отменённых записей и представление bookings_all для отчётов"""
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS bookings_archive(
+        id INTEGER PRIMARY KEY,     -- тот же id, что был в bookings
+        user_id INTEGER,
+        username TEXT,
+        service TEXT,
+        date TEXT,
+        time TEXT,
+        duration INTEGER,
+        status TEXT,
+        reminded_24h INTEGER NOT NULL DEFAULT 0,
+        reminded_2h INTEGER NOT NULL DEFAULT 0,
+        start_min INTEGER,
+        end_min INTEGER,
+        archived_at INTEGER         -- unix time переноса
+    )""")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_bookings_archive_start ON bookings_archive(start_min)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_bookings_archive_user ON bookings_archive(user_id, date)")
+    await _create_bookings_all(db, _V7_BOOKING_COLUMNS)
+
+
+async def _v8_daily_rollup(db):
+    """Цена записи целым числом и дневные сводки для статистики, заполненные по истории"""
+    await _add_missing_columns(db, "bookings", {"price": "INTEGER NOT NULL DEFAULT 0"})
+    await _add_missing_columns(db, "bookings_archive", {"price": "INTEGER NOT NULL DEFAULT 0"})
+    async with db.execute("SELECT name, price FROM services") as cursor:
+        prices = [(rollups.parse_price(price), name) for name, price in await cursor.fetchall()]
+    # для старых записей берём текущую цену услуги — истории цен раньше не было
+    await db.executemany("UPDATE bookings SET price=? WHERE service=?", prices)
+    await db.executemany("UPDATE bookings_archive SET price=? WHERE service=?", prices)
+    await _create_bookings_all(db, _V8_BOOKING_COLUMNS)
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS daily_rollup(
+        date TEXT NOT NULL,
+        service TEXT NOT NULL,
+        status TEXT NOT NULL,
+        bookings INTEGER NOT NULL DEFAULT 0,
+        minutes INTEGER NOT NULL DEFAULT 0,   -- сумма длительностей
+        revenue INTEGER NOT NULL DEFAULT 0,   -- сумма цен
+        PRIMARY KEY (date, service, status)
+    ) WITHOUT ROWID""")
+    await rollups.rebuild(db)
+
+
+async def _v9_masters(db):
+    """Мастера со своими часами работы и списком услуг; записи привязываются к мастеру.
+    Существующие записи и услуги достаются мастеру по умолчанию с прежними общими часами"""
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS masters(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        chat_id INTEGER,                      -- куда слать уведомления о записях (NULL — администраторам)
+        work_start TEXT NOT NULL DEFAULT '10:00',
+        work_end TEXT NOT NULL DEFAULT '21:00',
+        active INTEGER NOT NULL DEFAULT 1     -- 0 — скрыт из записи, история остаётся
+    )""")
+    await db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_masters_name ON masters(name)")
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS master_services(
+        master_id INTEGER NOT NULL,
+        service_id INTEGER NOT NULL,
+        PRIMARY KEY (master_id, service_id)
+    ) WITHOUT ROWID""")
+
+    async with db.execute("SELECT value FROM settings WHERE key='work_hours'") as cursor:
+        row = await cursor.fetchone()
+    hours = row[0].split("-") if row and "-" in row[0] else ("10:00", "21:00")
+    cursor = await db.execute(
+        "INSERT INTO masters (name, work_start, work_end) VALUES ('Мастер', ?, ?)", (hours[0], hours[1])
+    )
+    master_id = cursor.lastrowid
+    await db.execute("INSERT INTO master_services (master_id, service_id) SELECT ?, id FROM services", (master_id,))
+
+    await _add_missing_columns(db, "bookings", {"master_id": "INTEGER"})
+    await _add_missing_columns(db, "bookings_archive", {"master_id": "INTEGER"})
+    await db.execute("UPDATE bookings SET master_id=? WHERE master_id IS NULL", (master_id,))
+    await db.execute("UPDATE bookings_archive SET master_id=? WHERE master_id IS NULL", (master_id,))
+    await _create_bookings_all(db, _V9_BOOKING_COLUMNS)
+    # пересечения в календаре одного мастера: master_id=? AND status=? AND start_min в [a - длина, b)
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_bookings_master_span ON bookings(master_id, status, start_min, end_min)"
+    )
+
+
+async def _v10_idempotency_keys(db):
+    """Ключи выполненных нажатий кнопок (id callback-запроса): повторная доставка того же
+    нажатия (в том числе в другой webhook-воркер) не выполняет действие второй раз"""
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS idempotency_keys(
+        key TEXT PRIMARY KEY,
+        created_at INTEGER NOT NULL   -- unix time; ключ старше IDEMPOTENCY_TTL можно занять снова
+    ) WITHOUT ROWID""")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_idempotency_created ON idempotency_keys(created_at)")
+
+
+async def _v11_bookings_search(db):
+    """Полнотекстовый индекс FTS5 по username, услуге и дате записей для поиска в админке.
+    External content: текст не дублируется, индекс читает строки bookings по rowid; триггеры
+    поддерживают его при вставке, удалении (в том числе переносе в архив) и смене этих колонок.
+    Токенизатор trigram ищет по любому фрагменту от трёх символов без учёта регистра.
+    На SQLite старше FTS_MIN_SQLITE (или без FTS5) индекс не создаётся — поиск идёт через LIKE"""
+    async with db.execute("SELECT sqlite_version()") as cursor:
+        version = (await cursor.fetchone())[0]
+    if tuple(int(part) for part in version.split(".")) < FTS_MIN_SQLITE:
+        logging.warning("SQLite %s без токенизатора trigram: поиск записей без индекса (LIKE)", version)
+        return
+    try:
+        await db.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS bookings_fts USING fts5(
+            username, service, date,
+            content='bookings', content_rowid='id', tokenize='trigram'
+        )""")
+    except aiosqlite.OperationalError as e:
+        # сборка SQLite без модуля fts5
+        logging.warning("Полнотекстовый индекс не создан (%s): поиск записей без индекса (LIKE)", e)
+        return
+    await db.execute("""
+    CREATE TRIGGER IF NOT EXISTS bookings_fts_insert AFTER INSERT ON bookings BEGIN
+        INSERT INTO bookings_fts (rowid, username, service, date) VALUES (new.id, new.username, new.service, new.date);
+    END""")
+    await db.execute("""
+    CREATE TRIGGER IF NOT EXISTS bookings_fts_delete AFTER DELETE ON bookings BEGIN
+        INSERT INTO bookings_fts (bookings_fts, rowid, username, service, date)
+        VALUES ('delete', old.id, old.username, old.service, old.date);
+    END""")
+    # смена статуса и отметки напоминаний индекс не трогают
+    await db.execute("""
+    CREATE TRIGGER IF NOT EXISTS bookings_fts_update AFTER UPDATE OF username, service, date ON bookings BEGIN
+        INSERT INTO bookings_fts (bookings_fts, rowid, username, service, date)
+        VALUES ('delete', old.id, old.username, old.service, old.date);
+        INSERT INTO bookings_fts (rowid, username, service, date) VALUES (new.id, new.username, new.service, new.date);
+    END""")
+    await db.execute("INSERT INTO bookings_fts (bookings_fts) VALUES ('rebuild')")
+
+
+async def _v12_booking_order_nulls(db):
+    """Пустые строки вместо NULL в bookings.date/time у старых записей: сравнение закладки
+    (date, time, id) > (...) с NULL даёт NULL, и такие строки пропадали со всех страниц списка,
+    кроме первой. Сводки пересчитываются — эти записи теперь учтены под датой ''"""
+    cursor = await db.execute(
+        "UPDATE bookings SET date=COALESCE(date, ''), time=COALESCE(time, '') WHERE date IS NULL OR time IS NULL"
+    )
+    await db.execute(
+        "UPDATE bookings_archive SET date=COALESCE(date, ''), time=COALESCE(time, '') "
+        "WHERE date IS NULL OR time IS NULL"
+    )
+    if cursor.rowcount:
+        logging.warning("Записей без даты или времени: %s (date/time заменены на '')", cursor.rowcount)
+    await rollups.rebuild(db)
+
+
+async def _v13_bookings_start_index(db):
+    """Индекс bookings(start_min, id), как у архива: выгрузка читает период диапазоном по индексу
+    уже в нужном порядке, без сканирования таблицы и сортировки во временном B-дереве"""
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_bookings_start ON bookings(start_min, id)")
+
+
+# (версия, описание, шаг) — только добавлять в конец, уже выпущенные шаги не менять
+MIGRATIONS = [
+    (1, "базовая схема", _v1_base_schema),
+    (2, "индексы bookings/services", _v2_indexes),
+    (3, "индексы для постраничного просмотра записей", _v3_booking_order_indexes),
+    (4, "хранилище FSM", _v4_fsm_storage),
+    (5, "отметки напоминаний", _v5_reminder_markers),
+    (6, "начало и конец записи в эпоха-минутах", _v6_epoch_minutes),
+    (7, "архив записей и представление bookings_all", _v7_bookings_archive),
+    (8, "цена записи и дневные сводки", _v8_daily_rollup),
+    (9, "мастера, их услуги и часы работы", _v9_masters),
+    (10, "ключи идемпотентности кнопок", _v10_idempotency_keys),
+    (11, "полнотекстовый поиск по записям", _v11_bookings_search),
+    (12, "пустые date/time вместо NULL для закладок списка записей", _v12_booking_order_nulls),
+    (13, "индекс bookings(start_min, id) для выгрузки", _v13_bookings_start_index),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+async def get_schema_version(db) -> int:
+    """Текущая версия схемы (0 для пустой базы)"""
+    try:
+        async with db.execute("SELECT value FROM settings WHERE key=?", (VERSION_KEY,)) as cursor:
+            row = await cursor.fetchone()
+    except aiosqlite.OperationalError:
+        # таблицы settings ещё нет — совсем новая база
+        return 0
+    return int(row[0]) if row else 0
+
+
+async def migrate(db) -> int:
+    """Применить недостающие миграции, вернуть итоговую версию схемы"""
+    version = await get_schema_version(db)
+    if version >= LATEST_VERSION:
+        return version
+
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS settings(
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )""")
+    await db.commit()
+    for step_version, description, step in MIGRATIONS:
+        if step_version <= version:
+            continue
+        logging.info("Миграция БД до версии %s: %s", step_version, description)
+        await db.execute("BEGIN")
+        try:
+            await step(db)
+            await db.execute(
+                "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                (VERSION_KEY, str(step_version))
+            )
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            logging.exception("Миграция %s не применена", step_version)
+            raise
+        version = step_version
+    return version
@@ -0,0 +1,169 @@
+"""Фоновая отправка уведомлений с ограничением частоты.
+
+Обработчики только ставят сообщение в очередь через enqueue() и сразу
+возвращаются; отправкой занимается фоновая задача. Соблюдаются лимиты
+Telegram: не чаще одного сообщения в чат за NOTIFY_PER_CHAT_INTERVAL секунд
+и не больше NOTIFY_GLOBAL_RATE сообщений в секунду всего. Накопившиеся
+для одного чата сообщения уходят одним дайджестом; на 429 (flood control)
+чат откладывается на указанное Telegram время, на сетевые ошибки — повтор
+с экспоненциальной задержкой.
+"""
+import asyncio
+import heapq
+import logging
+from collections import deque
+
+from aiogram.exceptions import TelegramRetryAfter, TelegramNetworkError, TelegramServerError
+
+from config import (
+    NOTIFY_PER_CHAT_INTERVAL, NOTIFY_GLOBAL_RATE, NOTIFY_DIGEST_WINDOW,
+    NOTIFY_CONCURRENCY, NOTIFY_MAX_RETRIES,
+)
+
+MAX_MESSAGE_LENGTH = 4096
+
+
+class Notifier:
+    """Очередь исходящих сообщений с лимитами на чат и глобально"""
+
+    def __init__(self, bot, per_chat_interval: float = NOTIFY_PER_CHAT_INTERVAL,
+                 global_rate: float = NOTIFY_GLOBAL_RATE, digest_window: float = NOTIFY_DIGEST_WINDOW,
+                 concurrency: int = NOTIFY_CONCURRENCY, max_retries: int = NOTIFY_MAX_RETRIES):
+        self.bot = bot
+        self.per_chat_interval = per_chat_interval
+        self.global_interval = 1 / global_rate if global_rate > 0 else 0
+        self.digest_window = digest_window
+        self.max_retries = max_retries
+        self._pending = {}       # chat_id -> deque[(text, attempts)]
+        self._next_allowed = {}  # chat_id -> loop time, раньше которого в чат не пишем
+        self._scheduled = set()  # чаты, уже стоящие в _heap или отправляемые сейчас
+        self._heap = []          # (время готовности, chat_id)
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(max(1, concurrency))
+        self._global_next = 0.0
+        self._task = None
+        self._inflight = set()
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+    def enqueue(self, chat_id: int, text: str):
+        """Поставить сообщение в очередь (не ждёт отправки)"""
+        self._pending.setdefault(chat_id, deque()).append((text, 0))
+        if self._task is None:
+            logging.warning("Notifier не запущен, сообщение для %s ждёт в очереди", chat_id)
+        self._schedule(chat_id, self.digest_window)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="notifier")
+
+    async def stop(self, timeout: float = 10):
+        """Дождаться отправки накопленного (не дольше timeout) и остановиться"""
+        if self._task is None:
+            return
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while (self._heap or self._inflight) and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        left = sum(len(q) for q in self._pending.values())
+        if left:
+            logging.warning("Notifier остановлен, не отправлено сообщений: %s", left)
+
+    def stats(self) -> dict:
+        return {
+            "pending": sum(len(q) for q in self._pending.values()),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+        }
+
+    def _schedule(self, chat_id: int, delay: float = 0):
+        if chat_id in self._scheduled:
+            return
+        loop = asyncio.get_running_loop()
+        ready = max(loop.time() + delay, self._next_allowed.get(chat_id, 0))
+        heapq.heappush(self._heap, (ready, chat_id))
+        self._scheduled.add(chat_id)
+        self._wakeup.set()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            ready, chat_id = self._heap[0]
+            now = loop.time()
+            if ready > now:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), ready - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._heap)
+            # глобальный лимит: равномерно, не чаще global_interval
+            if self._global_next > now:
+                await asyncio.sleep(self._global_next - now)
+            self._global_next = max(self._global_next, loop.time()) + self.global_interval
+            await self._slots.acquire()
+            task = asyncio.create_task(self._send(chat_id))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    def _take_digest(self, chat_id: int):
+        """Забрать из очереди чата столько сообщений, сколько влезает в одно"""
+        queue = self._pending.get(chat_id)
+        batch = [queue.popleft()]
+        length = len(batch[0][0])
+        while queue and length + 2 + len(queue[0][0]) <= MAX_MESSAGE_LENGTH:
+            item = queue.popleft()
+            length += 2 + len(item[0])
+            batch.append(item)
+        return batch
+
+    async def _send(self, chat_id: int):
+        loop = asyncio.get_running_loop()
+        batch = self._take_digest(chat_id)
+        delay = 0
+        try:
+            await self.bot.send_message(chat_id, "\n\n".join(text for text, _ in batch))
+            self.sent += len(batch)
+        except TelegramRetryAfter as e:
+            # flood control: Telegram сам говорит, сколько ждать
+            logging.warning("Flood control для чата %s, ждём %s с", chat_id, e.retry_after)
+            self._requeue(chat_id, batch, count_attempt=False)
+            delay = e.retry_after
+        except (TelegramNetworkError, TelegramServerError) as e:
+            attempts = max(a for _, a in batch) + 1
+            if attempts > self.max_retries:
+                logging.error("Не удалось отправить уведомление в %s после %s попыток: %s", chat_id, attempts, e)
+                self.failed += len(batch)
+            else:
+                self._requeue(chat_id, batch)
+                delay = min(2 ** attempts, 60)
+        except Exception as e:
+            logging.error("Не удалось отправить уведомление в %s: %s", chat_id, e)
+            self.failed += len(batch)
+        finally:
+            self._next_allowed[chat_id] = loop.time() + max(self.per_chat_interval, delay)
+            self._scheduled.discard(chat_id)
+            if self._pending.get(chat_id):
+                self._schedule(chat_id)
+            else:
+                self._pending.pop(chat_id, None)
+            self._slots.release()
+
+    def _requeue(self, chat_id, batch, count_attempt: bool = True):
+        self.retried += len(batch)
+        queue = self._pending.setdefault(chat_id, deque())
+        for text, attempts in reversed(batch):
+            queue.appendleft((text, attempts + 1 if count_attempt else attempts))
@@ -0,0 +1,47 @@
+"""Напоминания клиентам и автозавершение прошедших записей.
+
+Одно периодическое задание (run_reminders) раз в REMINDER_CHECK_INTERVAL
+секунд читает по индексу активные записи на ближайшие сутки, у которых ещё
+не отправлены напоминания, и ставит сообщения в очередь notifier. Отметка
+об отправке сохраняется в БД до постановки в очередь, поэтому после
+перезапуска напоминание не дублируется. Закончившиеся активные записи
+переводятся в статус done.
+"""
+import logging
+from datetime import datetime
+
+from availability import datetime_epoch_minutes
+from bot import notifier
+from database import get_reminder_candidates, mark_reminders_sent, complete_past_bookings
+
+# пороги в минутах до начала записи
+REMIND_24H = 24 * 60
+REMIND_2H = 2 * 60
+
+
+async def run_reminders():
+    """Разослать подошедшие напоминания и завершить прошедшие записи"""
+    now = datetime.now()
+    now_min = datetime_epoch_minutes(now)
+    # записи, начинающиеся в ближайшие сутки: (now, now + 24ч]
+    rows = await get_reminder_candidates(now_min + 1, now_min + REMIND_24H + 1)
+
+    due = {"24h": [], "2h": []}
+    for bid, user_id, service, date, time, start_min, reminded_24h, reminded_2h in rows:
+        left = start_min - now_min
+        if left <= REMIND_2H and not reminded_2h:
+            due["2h"].append((bid, user_id, f"⏰ Через 2 часа ваша запись: {service}, {date} {time}"))
+        elif left <= REMIND_24H and not reminded_24h and left > REMIND_2H:
+            due["24h"].append((bid, user_id, f"🔔 Напоминаем о записи: {service}, {date} {time}"))
+
+    for kind, items in due.items():
+        if not items:
+            continue
+        await mark_reminders_sent([bid for bid, _, _ in items], kind)
+        for _, user_id, text in items:
+            notifier.enqueue(user_id, text)
+        logging.info("Напоминания %s поставлены в очередь: %s", kind, len(items))
+
+    completed = await complete_past_bookings(now)
+    if completed:
+        logging.info("Автоматически завершено записей: %s", len(completed))
@@ -0,0 +1,55 @@
+"""Дневные сводки (daily_rollup) для экрана статистики.
+
+На каждый день, услугу и статус хранится число записей, занятые минуты и
+выручка. Сводку обновляют сами функции записи в database.py в той же
+транзакции (bump), поэтому экран статистики читает несколько строк за
+период вместо сканирования всех записей. Перенос в архив сводки не меняет.
+Цена записи фиксируется при создании в bookings.price целым числом
+(parse_price), чтобы не приводить TEXT-цену услуги на каждой строке.
+rebuild() пересчитывает сводку по всей истории (bookings_all), diff()
+показывает расхождения с ней.
+"""
+import re
+
+_PRICE = re.compile(r"\d+(?:[ \u00a0]\d{3})*")
+
+_AGGREGATE = (
+    "SELECT date, COALESCE(service, ''), COALESCE(status, 'active'), COUNT(*), "
+    "COALESCE(SUM(duration), 0), COALESCE(SUM(price), 0) "
+    "FROM bookings_all WHERE date IS NOT NULL GROUP BY 1, 2, 3"
+)
+
+
+def parse_price(text) -> int:
+    """Цена услуги из свободного текста ('1500', 'от 1 500₽') -> целое; 0, если числа нет"""
+    if text is None:
+        return 0
+    match = _PRICE.search(str(text))
+    return int(re.sub(r"\D", "", match.group())) if match else 0
+
+
+async def bump(db, date: str, service: str, status: str, count: int, minutes: int, revenue: int):
+    """Прибавить к сводке дня (отрицательные значения — убавить)"""
+    await db.execute(
+        "INSERT INTO daily_rollup (date, service, status, bookings, minutes, revenue) VALUES (?,?,?,?,?,?) "
+        "ON CONFLICT(date, service, status) DO UPDATE SET bookings = bookings + excluded.bookings, "
+        "minutes = minutes + excluded.minutes, revenue = revenue + excluded.revenue",
+        (date, service, status, count, minutes, revenue)
+    )
+
+
+async def rebuild(db):
+    """Пересчитать сводку по всей истории"""
+    await db.execute("DELETE FROM daily_rollup")
+    await db.execute(f"INSERT INTO daily_rollup (date, service, status, bookings, minutes, revenue) {_AGGREGATE}")
+
+
+async def diff(db) -> list:
+    """Ключи (date, service, status), где сохранённая сводка расходится с пересчётом по истории"""
+    async with db.execute(_AGGREGATE) as cursor:
+        expected = {row[:3]: row[3:] for row in await cursor.fetchall()}
+    async with db.execute(
+        "SELECT date, service, status, bookings, minutes, revenue FROM daily_rollup"
+    ) as cursor:
+        stored = {row[:3]: row[3:] for row in await cursor.fetchall() if any(row[3:])}
+    return sorted(key for key in expected.keys() | stored.keys() if expected.get(key) != stored.get(key))
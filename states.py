@@ -4,6 +4,7 @@ from aiogram.fsm.state import StatesGroup, State
 class BookingState(StatesGroup):
     """Состояния для процесса бронирования"""
     choosing_service = State()
+    choosing_master = State()
     choosing_date = State()
     choosing_time = State()
     confirming = State()
@@ -14,4 +15,8 @@ class AdminState(StatesGroup):
     adding_service_name = State()
     adding_service_price = State()
     adding_service_duration = State()
-    setting_hours = State()  # ввод часов работы
\ No newline at end of file
+    setting_hours = State()  # ввод часов работы мастера (master_id в данных состояния)
+    adding_master_name = State()
+    adding_master_chat = State()
+    export_range = State()  # ввод периода выгрузки
+    searching = State()  # ввод текста поиска записей
\ No newline at end of file
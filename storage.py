@@ -0,0 +1,150 @@
+"""FSM-хранилище aiogram поверх SQLite (таблица fsm_storage в основной БД).
+
+Состояния и данные диалогов держатся в горячем кэше в памяти, а изменения
+сбрасываются в БД пачками раз в FSM_FLUSH_INTERVAL секунд (write-behind),
+поэтому обработчик не ждёт диска. При остановке всё несохранённое
+дописывается, так что диалоги переживают перезапуск. Диалоги, не менявшиеся
+дольше FSM_STATE_TTL, удаляются, а давно не использованные записи
+вытесняются из кэша — память не растёт вместе с числом пользователей.
+
+Когда с БД работают несколько процессов (webhook-воркеры), соседние апдейты
+одного пользователя могут попасть в разные процессы, поэтому кэш и
+отложенная запись отключаются: каждое чтение идёт в БД, запись — сразу.
+"""
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+
+import database
+from config import FSM_FLUSH_INTERVAL, FSM_STATE_TTL, FSM_CACHE_IDLE, FSM_WRITE_BEHIND, SHARED_STATE
+
+
+class _Record:
+    __slots__ = ("state", "data", "touched")
+
+    def __init__(self, state: Optional[str] = None, data: Optional[dict] = None):
+        self.state = state
+        self.data = data or {}
+        self.touched = time.time()
+
+
+class SQLiteStorage(BaseStorage):
+    """Постоянное FSM-хранилище с кэшем и отложенной записью"""
+
+    def __init__(self, flush_interval: float = FSM_FLUSH_INTERVAL, ttl: float = FSM_STATE_TTL,
+                 cache_idle: float = FSM_CACHE_IDLE, write_behind: bool = FSM_WRITE_BEHIND and not SHARED_STATE,
+                 use_cache: bool = not SHARED_STATE):
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self.cache_idle = cache_idle
+        self.write_behind = write_behind
+        self.use_cache = use_cache
+        self._cache: Dict[str, _Record] = {}
+        self._dirty = set()
+        self._task = None
+        self._last_expire = 0.0
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ":".join(str(part) if part is not None else "" for part in (
+            key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny
+        ))
+
+    async def _record(self, key: StorageKey) -> _Record:
+        k = self._key(key)
+        record = self._cache.get(k) if self.use_cache else None
+        if record is None:
+            row = await database.fsm_load(k)
+            # пока читали, запись могла появиться из параллельного обработчика
+            record = self._cache.get(k) if self.use_cache else None
+            if record is None:
+                record = _Record(row[0], json.loads(row[1] or "{}")) if row else _Record()
+                self._cache[k] = record
+        record.touched = time.time()
+        return record
+
+    async def _changed(self, key: StorageKey):
+        k = self._key(key)
+        self._dirty.add(k)
+        if not self.write_behind:
+            await self.flush()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._record(key)
+        record.state = state.state if isinstance(state, State) else state
+        await self._changed(key)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._record(key)).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = await self._record(key)
+        record.data = data.copy()
+        await self._changed(key)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._record(key)).data.copy()
+
+    async def flush(self):
+        """Сбросить изменённые записи в БД одной пачкой"""
+        if not self._dirty:
+            return
+        keys, self._dirty = self._dirty, set()
+        rows = []
+        for k in keys:
+            record = self._cache.get(k)
+            if record is not None:
+                rows.append((k, record.state, json.dumps(record.data, ensure_ascii=False), int(record.touched)))
+        try:
+            await database.fsm_save(rows)
+        except Exception:
+            # вернём ключи, чтобы попробовать в следующий раз
+            self._dirty |= keys
+            logging.exception("FSM: не удалось сохранить %s записей", len(rows))
+
+    async def expire(self):
+        """Удалить брошенные диалоги и вытеснить из кэша давно не использованные записи"""
+        now = time.time()
+        for k in [k for k, r in self._cache.items() if k not in self._dirty and now - r.touched > self.cache_idle]:
+            del self._cache[k]
+        for k in [k for k, r in self._cache.items() if now - r.touched > self.ttl]:
+            self._cache.pop(k, None)
+            self._dirty.discard(k)
+        removed = await database.fsm_delete_expired(int(now - self.ttl))
+        if removed:
+            logging.info("FSM: удалено брошенных диалогов: %s", removed)
+
+    async def start(self):
+        """Запустить фоновый сброс (после открытия пула БД)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="fsm-flush")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            if time.time() - self._last_expire > 60:
+                self._last_expire = time.time()
+                try:
+                    await self.expire()
+                except Exception:
+                    logging.exception("FSM: ошибка очистки устаревших диалогов")
+
+    def stats(self) -> dict:
+        return {"cached": len(self._cache), "dirty": len(self._dirty)}
+
+    async def close(self) -> None:
+        """Остановить фоновый сброс и дописать несохранённое"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
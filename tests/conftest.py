@@ -0,0 +1,42 @@
+"""Общая настройка тестов: окружение задаётся до первого импорта config."""
+import asyncio
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_tmp = tempfile.mkdtemp(prefix="nails_tests_")
+os.environ["DB_NAME"] = os.path.join(_tmp, "test.db")
+os.environ.setdefault("ADMIN_ID", "1")
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
+
+
+@pytest.fixture
+def run_db():
+    """Выполнить async-сценарий на чистой БД с открытым пулом и писателем:
+    run_db(scenario) -> результат scenario()"""
+    import database
+
+    def run(scenario):
+        async def main():
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(database.DB_NAME + suffix):
+                    os.remove(database.DB_NAME + suffix)
+            database._cache.invalidate()
+            database._availability.clear()
+            await database.open_pool()
+            await database.start_writer()
+            try:
+                await database.init_db()
+                return await scenario()
+            finally:
+                await database.stop_writer()
+                await database.close_pool()
+
+        return asyncio.run(main())
+
+    return run
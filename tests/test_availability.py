@@ -0,0 +1,59 @@
+"""free_slots против перебора: каждый кандидат сетки проверяется на пересечение со всеми записями."""
+import random
+
+import pytest
+
+from availability import free_slots, merge_intervals
+
+
+def brute_force(day_start, day_end, busy, duration, step, buffer):
+    duration = max(duration or 0, 0)
+    slots = []
+    current = day_start
+    while current + duration <= day_end:
+        # [current, current + duration) пересекает [start - buffer, end + buffer)
+        if all(not (current < end + buffer and start - buffer < current + duration) for start, end in busy):
+            slots.append(current)
+        current += step
+    return slots
+
+
+def test_empty_day():
+    assert free_slots(600, 720, [], 60, step=30, buffer=0) == [600, 630, 660]
+
+
+def test_zero_duration_fits_at_booking_start_and_end():
+    # нулевая длительность занимает точку: свободны начало и конец записи, но не середина
+    assert free_slots(600, 720, [(630, 690)], 0, step=30, buffer=0) == [600, 630, 690, 720]
+
+
+def test_buffer_pushes_next_slot():
+    assert free_slots(600, 780, [(600, 660)], 30, step=15, buffer=15) == [675, 690, 705, 720, 735, 750]
+
+
+def test_bookings_across_day_edges():
+    busy = [(540, 630), (750, 900)]   # началась до открытия, закончится после закрытия
+    assert free_slots(600, 780, busy, 60, step=30, buffer=0) == [630, 660, 690]
+
+
+def test_merge_overlapping():
+    # пересекающиеся сливаются, стыкующиеся остаются отдельно — на слоты это не влияет
+    assert merge_intervals([(10, 20), (15, 30), (30, 40), (50, 60)]) == [[10, 30], [30, 40], [50, 60]]
+    assert merge_intervals([(10, 20), (30, 40)], buffer=10) == [[0, 50]]
+
+
+@pytest.mark.parametrize("seed", range(300))
+def test_matches_brute_force(seed):
+    rng = random.Random(seed)
+    step = rng.choice([5, 10, 15, 30, 60])
+    buffer = rng.choice([0, 0, 5, 10, 15, 30])
+    duration = rng.choice([0, 15, 30, 45, 60, 90, 120, 240])
+    day_start = rng.randrange(0, 12 * 60, 5)
+    day_end = day_start + rng.randrange(0, 12 * 60, 5)
+    busy = []
+    for _ in range(rng.randint(0, 12)):
+        # записи в том числе до открытия, после закрытия, пересекающиеся и нулевой длины
+        start = rng.randrange(day_start - 180, day_end + 180)
+        busy.append((start, start + rng.choice([0, 15, 30, 60, 90, 180])))
+    assert free_slots(day_start, day_end, busy, duration, step, buffer) == \
+        brute_force(day_start, day_end, busy, duration, step, buffer)
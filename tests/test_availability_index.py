@@ -0,0 +1,66 @@
+"""Индекс занятости после случайных записей, отмен и смен статуса совпадает с чистой загрузкой из БД."""
+import random
+
+import database
+from availability import AvailabilityIndex, free_slots, format_minutes, to_minutes
+
+DATES = ["2030-01-07", "2030-01-08", "2030-01-09"]
+DURATIONS = [30, 60, 90, 120]
+
+
+async def _fresh_index(keys) -> AvailabilityIndex:
+    index = AvailabilityIndex()
+    for master_id, date in keys:
+        index.load_day(master_id, date, await database._day_intervals(master_id, date))
+    return index
+
+
+async def _assert_consistent(masters):
+    keys = database._availability.loaded_days()
+    fresh = await _fresh_index(keys)
+    for master_id, date in keys:
+        assert database._availability.snapshot(master_id, date) == fresh.snapshot(master_id, date), (master_id, date)
+    assert await database.check_availability_index() == []
+    # и слоты из кэша индекса совпадают с посчитанными заново по БД
+    for master_id, date in keys:
+        master = masters[master_id]
+        day_start, day_end = to_minutes(master[3]), to_minutes(master[4])
+        for duration in DURATIONS:
+            expected = free_slots(day_start, day_end, fresh.snapshot(master_id, date), duration)
+            assert await database.get_free_slots(date, duration, [master_id]) == [format_minutes(m) for m in expected]
+
+
+def test_index_matches_db_after_random_changes(run_db):
+    async def scenario():
+        await database.add_service("Маникюр", "1500", 60)
+        await database.add_master("Вторая", None)
+        masters = {m[0]: m for m in await database.get_masters()}
+        rng = random.Random(7)
+        booked = []  # (booking_id, user_id)
+        for step in range(400):
+            action = rng.random()
+            date = rng.choice(DATES)
+            if action < 0.45:
+                user_id = rng.randint(1, 50)
+                time = format_minutes(rng.randrange(10 * 60, 20 * 60, 30))
+                master_ids = rng.choice([[m] for m in masters] + [list(masters)])
+                reserved = await database.reserve_booking(
+                    user_id, f"user{user_id}", "Маникюр", date, time, rng.choice(DURATIONS), master_ids
+                )
+                if reserved:
+                    booked.append((reserved[0], user_id))
+            elif action < 0.6 and booked:
+                booking_id, user_id = rng.choice(booked)
+                await database.cancel_user_booking(booking_id, user_id)
+            elif action < 0.8 and booked:
+                booking_id, _ = rng.choice(booked)
+                await database.update_booking_status(booking_id, rng.choice(["active", "done", "canceled"]))
+            else:
+                # подгружаем дни в индекс (как показ слотов), чтобы дальше они патчились точечно
+                await database.get_free_slots(date, rng.choice(DURATIONS), list(masters))
+            if step % 50 == 49:
+                await _assert_consistent(masters)
+        await _assert_consistent(masters)
+        assert database._availability.loaded_days()
+
+    run_db(scenario)
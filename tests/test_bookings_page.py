@@ -0,0 +1,50 @@
+"""Keyset-страницы списка записей обходят все строки, в том числе старые записи без даты/времени."""
+import database
+import rollups
+from migrations import migrate, VERSION_KEY
+
+PER_PAGE = 5
+
+
+async def _walk(**filters) -> list:
+    """Все id, пройденные кнопкой «Далее» от первой страницы"""
+    seen = []
+    rows = await database.get_bookings_page(PER_PAGE, **filters)
+    while True:
+        seen += [row[0] for row in rows[:PER_PAGE]]
+        if len(rows) <= PER_PAGE:
+            return seen
+        rows = await database.get_bookings_page(PER_PAGE, seen[-1], "next", **filters)
+
+
+def test_pages_cover_legacy_rows_without_date(run_db):
+    async def scenario():
+        await database.add_service("Маникюр", "1500", 60)
+        for i in range(12):
+            await database.add_booking(100 + i, f"user{i}", "Маникюр", f"2030-01-{10 + i % 4:02d}", f"1{i % 8}:00", 60)
+        # записи из старых версий бота: без даты или времени, цены и эпоха-минут
+        async with database.connect() as db:
+            await db.executemany(
+                "INSERT INTO bookings (user_id, username, service, date, time, duration, status) VALUES (?,?,?,?,?,?,?)",
+                [(1, "old1", "Маникюр", None, "12:00", 60, "done"),
+                 (2, "old2", "Маникюр", "2030-01-11", None, 60, "active"),
+                 (3, "old3", "Маникюр", None, None, 60, "canceled")]
+            )
+            await db.execute("UPDATE settings SET value='11' WHERE key=?", (VERSION_KEY,))
+            await db.commit()
+            await migrate(db)
+            async with db.execute("SELECT COUNT(*) FROM bookings WHERE date IS NULL OR time IS NULL") as cursor:
+                assert (await cursor.fetchone())[0] == 0
+            assert await rollups.diff(db) == []
+            async with db.execute("SELECT id FROM bookings ORDER BY date, time, id") as cursor:
+                expected = [row[0] for row in await cursor.fetchall()]
+
+        assert await _walk() == expected
+        # назад с каждой страницы — ровно предыдущая страница
+        first = await database.get_bookings_page(PER_PAGE)
+        second = await database.get_bookings_page(PER_PAGE, first[PER_PAGE - 1][0], "next")
+        assert await database.get_bookings_page(PER_PAGE, second[0][0], "prev") == first[:PER_PAGE]
+        walked_done = await _walk(status="done")
+        assert len(walked_done) == 1
+
+    run_db(scenario)
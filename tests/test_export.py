@@ -0,0 +1,60 @@
+"""Выгрузка: диапазоны по индексам без сортировки и общий порядок архива и горячей таблицы."""
+import csv
+import os
+
+import database
+import export
+
+DATES = ["2030-01-07", "2030-01-08", "2030-01-09", "2030-01-10"]
+
+
+def test_export_queries_use_start_index(run_db):
+    async def scenario():
+        async with database.connect() as db:
+            plans = []
+            for query in export.QUERIES:
+                async with db.execute(f"EXPLAIN QUERY PLAN {query}", (0, 1)) as cursor:
+                    plans.append(" | ".join(row[3] for row in await cursor.fetchall()))
+        return plans
+
+    archive_plan, hot_plan = run_db(scenario)
+    assert "USING INDEX idx_bookings_archive_start (start_min>? AND start_min<?)" in archive_plan
+    assert "USING INDEX idx_bookings_start (start_min>? AND start_min<?)" in hot_plan
+    for plan in (archive_plan, hot_plan):
+        assert "TEMP B-TREE" not in plan and "SCAN b" not in plan, plan
+
+
+def test_export_merges_archive_and_hot_rows_in_order(run_db, monkeypatch):
+    # маленькие порции: слияние проходит через границы fetchmany
+    monkeypatch.setattr(export, "EXPORT_CHUNK_ROWS", 3)
+
+    async def scenario():
+        await database.add_service("Маникюр", "1500", 60)
+        ids = []
+        for i in range(20):
+            ids.append(await database.add_booking(
+                i, f"user{i}", "Маникюр", DATES[i % len(DATES)], f"{10 + i % 7}:00", 60
+            ))
+        # половина завершённых уходит в архив, остальные остаются в горячей таблице
+        for booking_id in ids[::2]:
+            await database.update_booking_status(booking_id, "done")
+        assert await database.archive_bookings(10 ** 9) == 10
+
+        async with database.connect() as db:
+            async with db.execute(
+                "SELECT id FROM bookings_all WHERE date BETWEEN ? AND ? ORDER BY start_min, id",
+                (DATES[1], DATES[2])
+            ) as cursor:
+                expected = [str(row[0]) for row in await cursor.fetchall()]
+
+        path, count = await export.export_bookings(DATES[1], DATES[2])
+        try:
+            with open(path, encoding="utf-8-sig", newline="") as f:
+                rows = list(csv.reader(f, delimiter=";"))
+        finally:
+            os.remove(path)
+        assert rows[0] == list(export.HEADER)
+        assert [row[0] for row in rows[1:]] == expected
+        assert count == len(expected) == 10
+
+    run_db(scenario)
@@ -0,0 +1,139 @@
+"""Идемпотентность нажатий: настоящие роутеры и middleware на Dispatcher, Bot API — заглушка."""
+import asyncio
+import itertools
+import time
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.base import BaseSession
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.methods import AnswerCallbackQuery
+from aiogram.types import Update
+
+import database
+from callbacks import BookingActionCb
+from config import IDEMPOTENCY_TTL
+from handlers import admin, booking
+from middlewares import setup_middlewares, InFlightMiddleware, IdempotencyMiddleware
+from states import BookingState
+from storage import SQLiteStorage
+
+ADMIN = 1
+_ids = itertools.count(1)
+
+
+class StubSession(BaseSession):
+    """Запоминает ответы на нажатия, остальные методы Bot API — успешные заглушки"""
+
+    def __init__(self):
+        super().__init__()
+        self.answers = []
+
+    async def make_request(self, bot, method, timeout=None):
+        if isinstance(method, AnswerCallbackQuery):
+            self.answers.append(method.text)
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+def _dispatcher():
+    dp = Dispatcher()
+    setup_middlewares(dp)
+    dp.include_router(admin.router)
+    return dp
+
+
+def _worker(storage):
+    """Отдельный webhook-воркер: свой диспетчер и свои in-memory middleware, общая только БД"""
+    dp = Dispatcher(storage=storage)
+    dp.callback_query.outer_middleware(InFlightMiddleware())
+    dp.callback_query.middleware(IdempotencyMiddleware(IDEMPOTENCY_TTL))
+    # в бою у каждого процесса свой экземпляр роутера, в тесте модуль один на оба диспетчера
+    booking.router._parent_router = None
+    dp.include_router(booking.router)
+    return dp
+
+
+def _press(bot, data: str, callback_id: str = None, user_id: int = ADMIN) -> Update:
+    """Нажатие пользователя на кнопку одного и того же сообщения"""
+    chat = {"id": user_id, "type": "private"}
+    return Update.model_validate({
+        "update_id": next(_ids),
+        "callback_query": {
+            "id": callback_id or f"cq{next(_ids)}", "from": {"id": user_id, "is_bot": False, "first_name": "user"},
+            "chat_instance": "1", "data": data,
+            "message": {"message_id": 10, "date": int(time.time()), "chat": chat,
+                        "from": {"id": 42, "is_bot": True, "first_name": "bot"}, "text": "..."},
+        },
+    }, context={"bot": bot})
+
+
+async def _status(booking_id: int) -> str:
+    async with database.connect() as db:
+        async with db.execute("SELECT status FROM bookings WHERE id=?", (booking_id,)) as cursor:
+            return (await cursor.fetchone())[0]
+
+
+def test_done_cancel_done_on_same_message(run_db):
+    """✅ -> ❌ -> ✅ на одной записи: каждое новое нажатие выполняется, итог — done"""
+    async def scenario():
+        session = StubSession()
+        bot = Bot("123456:TEST", session=session)
+        dp = _dispatcher()
+        await database.add_service("Маникюр", "1500", 60)
+        booking_id = await database.add_booking(7, "client", "Маникюр", "2030-01-08", "12:00", 60)
+        done = BookingActionCb(action="done", id=booking_id).pack()
+        cancel = BookingActionCb(action="cancel", id=booking_id).pack()
+
+        await dp.feed_update(bot, _press(bot, done))
+        assert await _status(booking_id) == "done"
+        await dp.feed_update(bot, _press(bot, cancel, "cancel-1"))
+        assert await _status(booking_id) == "canceled"
+        await dp.feed_update(bot, _press(bot, done))
+        assert await _status(booking_id) == "done"
+        assert "Уже выполнено ✅" not in session.answers
+
+        # повторная доставка того же нажатия (ретрай webhook) не выполняется второй раз
+        await dp.feed_update(bot, _press(bot, cancel, "cancel-1"))
+        assert await _status(booking_id) == "done"
+        assert session.answers[-1] == "Уже выполнено ✅"
+
+    run_db(scenario)
+
+
+def test_double_tap_finish_across_workers(run_db):
+    """Двойной тап «Подтвердить» попадает в два воркера с общим FSM в БД: запись одна"""
+    client = 7
+
+    async def scenario():
+        session = StubSession()
+        bot = Bot("123456:TEST", session=session)
+        # «любой мастер»: у второго воркера оставался бы свободный мастер
+        await database.add_service("Маникюр", "1500", 60)
+        await database.add_master("Ира")
+        service_id = (await database.get_services())[0][0]
+        assert len(await database.get_service_masters(service_id)) == 2
+        # общий режим хранилища: без кэша и отложенной записи, как у нескольких воркеров
+        storages = [SQLiteStorage(use_cache=False, write_behind=False) for _ in range(2)]
+        key = StorageKey(bot_id=bot.id, chat_id=client, user_id=client)
+        await storages[0].set_state(key, BookingState.confirming)
+        await storages[0].set_data(key, {
+            "service_id": service_id, "service": "Маникюр", "price": "1500", "duration": 60,
+            "master_id": 0, "date": "2030-01-08", "time": "12:00", "confirm_id": "c1",
+        })
+        workers = [_worker(storage) for storage in storages]
+
+        await asyncio.gather(*(
+            dp.feed_update(bot, _press(bot, "finish", f"tap-{i}", client)) for i, dp in enumerate(workers)
+        ))
+        async with database.connect() as db:
+            async with db.execute("SELECT COUNT(*) FROM bookings WHERE user_id=? AND status='active'",
+                                  (client,)) as cursor:
+                assert (await cursor.fetchone())[0] == 1
+        assert "Уже выполнено ✅" in session.answers or "Запись уже оформлена или устарела." in session.answers
+
+    run_db(scenario)
@@ -0,0 +1,57 @@
+"""Гонка за один слот: из одновременных reserve_booking выигрывает ровно столько, сколько мастеров."""
+import asyncio
+
+import pytest
+
+import database
+
+DATE = "2030-01-08"
+CLIENTS = 50
+
+
+async def _race(master_ids, time="12:00", duration=60):
+    return await asyncio.gather(*(
+        database.reserve_booking(user_id, f"user{user_id}", "Маникюр", DATE, time, duration, master_ids)
+        for user_id in range(1, CLIENTS + 1)
+    ))
+
+
+async def _active_count() -> int:
+    async with database.connect() as db:
+        async with db.execute("SELECT COUNT(*) FROM bookings WHERE status='active'") as cursor:
+            return (await cursor.fetchone())[0]
+
+
+@pytest.mark.parametrize("writer", [True, False], ids=["group-commit", "own-transactions"])
+def test_one_winner_per_slot(run_db, writer):
+    async def scenario():
+        if not writer:
+            # каждая попытка в своей транзакции BEGIN IMMEDIATE на соединениях пула
+            await database.stop_writer()
+        await database.add_service("Маникюр", "1500", 60)
+        master_id = (await database.get_masters())[0][0]
+
+        results = await _race([master_id])
+        assert sum(r is not None for r in results) == 1
+        # пересекающееся время тоже занято
+        assert [r for r in await _race([master_id], time="12:30") if r] == []
+        assert await _active_count() == 1
+        assert "12:00" not in await database.get_free_slots(DATE, 60, [master_id])
+
+    run_db(scenario)
+
+
+def test_any_master_books_each_master_once(run_db):
+    async def scenario():
+        await database.add_service("Маникюр", "1500", 60)
+        await database.add_master("Вторая", None)
+        await database.add_master("Третья", None)
+        master_ids = [m[0] for m in await database.get_masters()]
+
+        winners = [r for r in await _race(master_ids) if r is not None]
+        assert sorted(master_id for _, master_id in winners) == sorted(master_ids)
+        assert await _active_count() == len(master_ids)
+        assert await database.get_free_slots(DATE, 60, master_ids) and \
+            "12:00" not in await database.get_free_slots(DATE, 60, master_ids)
+
+    run_db(scenario)
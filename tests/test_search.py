@@ -0,0 +1,42 @@
+"""Поиск записей: страницы по индексу bookings_fts и без него (SQLite без trigram) совпадают."""
+import pytest
+
+import database
+import migrations
+
+PER_PAGE = 3
+
+
+@pytest.mark.parametrize("fts", [True, False], ids=["fts5", "like"])
+def test_search_pages(run_db, monkeypatch, fts):
+    if not fts:
+        # миграция 11 видит «старый» SQLite и индекс не создаёт
+        monkeypatch.setattr(migrations, "FTS_MIN_SQLITE", (99, 0, 0))
+
+    async def scenario():
+        async with database.connect() as db:
+            async with db.execute("SELECT 1 FROM sqlite_master WHERE name='bookings_fts'") as cursor:
+                assert (await cursor.fetchone() is not None) == fts
+        await database.add_service("Маникюр", "1500", 60)
+        await database.add_service("Педикюр", "2000", 90)
+        ids = []
+        for i in range(10):
+            service = "Маникюр" if i % 2 else "Педикюр"
+            ids.append(await database.add_booking(i, f"anna_{i}", service, f"2030-01-{10 + i:02d}", "12:00", 60))
+        ids.append(await database.add_booking(50, "100%_sure", "Маникюр", "2030-02-01", "12:00", 60))
+
+        # без индекса регистр не учитывается только у латиницы (LIKE в SQLite)
+        match = database.search_match("@ANNA Маникюр")
+        expected = sorted(ids[1:10:2], reverse=True)
+        first = await database.search_bookings(match, PER_PAGE)
+        assert [row[0] for row in first] == expected[:PER_PAGE + 1]
+        second = await database.search_bookings(match, PER_PAGE, first[PER_PAGE - 1][0], "next")
+        assert [row[0] for row in second] == expected[PER_PAGE:]
+        assert await database.search_bookings(match, PER_PAGE, second[0][0], "prev") == first[:PER_PAGE]
+        # дата ДД.ММ и спецсимволы LIKE внутри фрагмента
+        assert [row[0] for row in await database.search_bookings(database.search_match("15.01"), PER_PAGE)] == [ids[5]]
+        assert [row[0] for row in await database.search_bookings(database.search_match("0%_"), PER_PAGE)] == [ids[10]]
+        assert await database.search_bookings(database.search_match("anna_1%"), PER_PAGE) == []
+        await database.optimize_db(vacuum=True)
+
+    run_db(scenario)
@@ -0,0 +1,144 @@
+"""Режим webhook: aiohttp-сервер, несколько воркер-процессов и плавная остановка.
+
+Запуск: BOT_MODE=webhook python main.py
+
+При WEBHOOK_WORKERS > 1 главный процесс применяет миграции, регистрирует
+webhook и запускает воркеры через fork; все они слушают один порт
+(SO_REUSEPORT, только Linux), ядро распределяет соединения между ними.
+Снаружи ставится обратный прокси (nginx и т.п.), терминирующий TLS и
+проксирующий WEBHOOK_PATH на WEBHOOK_HOST:WEBHOOK_PORT. Общее состояние —
+nails.db: FSM пишется сразу, кэши сверяются по счётчикам поколений.
+
+По SIGTERM/SIGINT воркер перестаёт принимать соединения, дожидается
+обрабатываемых апдейтов (не дольше WEBHOOK_DRAIN_TIMEOUT), затем дописывает
+очереди и закрывает БД.
+
+Проверка без Telegram — отправить записанные апдейты (по одному JSON Update
+в строке, например из getUpdates) на локальный сервер:
+    python webhook.py replay updates.jsonl --concurrency 10
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+
+from aiohttp import web, ClientSession
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+
+from config import (
+    WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET,
+    WEBHOOK_WORKERS, WEBHOOK_DRAIN_TIMEOUT,
+)
+
+
+async def _set_webhook():
+    from bot import bot
+    from database import init_db
+
+    await init_db()
+    if WEBHOOK_BASE_URL:
+        await bot.set_webhook(f"{WEBHOOK_BASE_URL}{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET or None)
+        logging.info("Webhook установлен: %s%s", WEBHOOK_BASE_URL, WEBHOOK_PATH)
+    else:
+        logging.warning("WEBHOOK_BASE_URL не задан, webhook в Telegram не регистрируется")
+    await bot.session.close()
+
+
+async def _serve(startup, shutdown, worker: int = 0):
+    from bot import bot, dp
+
+    await startup(worker == 0, worker)
+    app = web.Application()
+    # handle_in_background=False: ответ уходит после обработки, поэтому при остановке
+    # runner.cleanup() дожидается всех апдейтов, уже принятых в работу
+    SimpleRequestHandler(
+        dispatcher=dp, bot=bot, handle_in_background=False, secret_token=WEBHOOK_SECRET or None
+    ).register(app, path=WEBHOOK_PATH)
+    runner = web.AppRunner(app, shutdown_timeout=WEBHOOK_DRAIN_TIMEOUT)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT, reuse_port=WEBHOOK_WORKERS > 1)
+    await site.start()
+    logging.info("Воркер %s слушает http://%s:%s%s", os.getpid(), WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+    logging.info("Воркер %s: остановка, дожидаемся обрабатываемых апдейтов", os.getpid())
+    try:
+        await runner.cleanup()
+    finally:
+        await shutdown()
+
+
+def _worker(startup, shutdown, worker: int):
+    from log_setup import stop_logging
+
+    try:
+        asyncio.run(_serve(startup, shutdown, worker))
+    finally:
+        # дочерний процесс multiprocessing завершается без atexit — дописываем логи сами
+        stop_logging()
+
+
+def run_webhook(startup, shutdown):
+    """Запустить webhook-сервер: в этом процессе или в WEBHOOK_WORKERS воркерах"""
+    asyncio.run(_set_webhook())
+    if WEBHOOK_WORKERS <= 1:
+        asyncio.run(_serve(startup, shutdown))
+        return
+
+    # fork: воркеры наследуют уже подключённые роутеры; до этого момента
+    # в главном процессе не должно быть открытых соединений и запущенного цикла
+    ctx = multiprocessing.get_context("fork")
+    workers = [
+        ctx.Process(target=_worker, args=(startup, shutdown, i), name=f"webhook-worker-{i}")
+        for i in range(WEBHOOK_WORKERS)
+    ]
+    for process in workers:
+        process.start()
+
+    def forward(signum, frame):
+        for process in workers:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    for process in workers:
+        process.join()
+    logging.info("Все webhook-воркеры остановлены")
+
+
+async def replay(path: str, url: str, concurrency: int):
+    """Отправить записанные апдейты на локальный webhook"""
+    with open(path, encoding="utf-8") as f:
+        updates = [json.loads(line) for line in f if line.strip()]
+    headers = {"X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET} if WEBHOOK_SECRET else {}
+    semaphore = asyncio.Semaphore(concurrency)
+    statuses = {}
+
+    async with ClientSession() as session:
+        async def post(update):
+            async with semaphore:
+                async with session.post(url, json=update, headers=headers) as response:
+                    statuses[response.status] = statuses.get(response.status, 0) + 1
+
+        await asyncio.gather(*(post(update) for update in updates))
+    print(f"Отправлено апдейтов: {len(updates)}, ответы: {statuses}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Инструменты webhook-режима")
+    sub = parser.add_subparsers(dest="command", required=True)
+    replay_parser = sub.add_parser("replay", help="отправить записанные апдейты на локальный webhook")
+    replay_parser.add_argument("file")
+    replay_parser.add_argument("--url", default=f"http://{WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    replay_parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(replay(args.file, args.url, args.concurrency))
@@ -0,0 +1,111 @@
+"""Фоновый писатель с групповыми коммитами.
+
+Операции записи ставятся в asyncio-очередь и выполняются одной задачей:
+всё, что накопилось за короткое окно, уходит в БД одной транзакцией
+(один fsync и одна блокировка писателя на пачку вместо одной на запрос).
+Каждая операция выполняется в своей точке сохранения, поэтому ошибка одной
+не откатывает остальные; результат или исключение возвращается вызывающему
+через future уже после коммита.
+"""
+import asyncio
+import logging
+
+from config import WRITE_BATCH_WINDOW_MS, WRITE_BATCH_MAX
+
+
+class WriteQueue:
+    """Очередь операций записи. op — корутинная функция op(db) -> результат"""
+
+    def __init__(self, acquire, window_ms: float = WRITE_BATCH_WINDOW_MS, max_batch: int = WRITE_BATCH_MAX):
+        self._acquire = acquire  # фабрика контекстного менеджера соединения
+        self.window = window_ms / 1000
+        self.max_batch = max(1, max_batch)
+        self._queue = None
+        self._task = None
+        self.batches = 0
+        self.ops = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if not self.running:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run(), name="db-writer")
+
+    async def stop(self):
+        """Дописать всё, что уже в очереди, и остановить задачу"""
+        if self.running:
+            self._queue.put_nowait(None)
+            await self._task
+        self._task = None
+
+    async def submit(self, op):
+        """Поставить операцию в очередь и дождаться её результата после коммита"""
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((op, future))
+        return await future
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "ops": self.ops,
+            "avg_batch": round(self.ops / self.batches, 2) if self.batches else 0,
+            "queued": self._queue.qsize() if self._queue else 0,
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._commit(batch)
+
+    async def _commit(self, batch):
+        results = []
+        try:
+            async with self._acquire() as db:
+                await db.execute("BEGIN IMMEDIATE")
+                for op, future in batch:
+                    await db.execute("SAVEPOINT write_op")
+                    try:
+                        result = await op(db)
+                    except Exception as e:
+                        await db.execute("ROLLBACK TO write_op")
+                        results.append((future, None, e))
+                    else:
+                        results.append((future, result, None))
+                    await db.execute("RELEASE write_op")
+                await db.commit()
+        except Exception as e:
+            logging.exception("Пачка записи из %s операций не сохранена", len(batch))
+            results = [(future, None, e) for _, future in batch]
+        self.batches += 1
+        self.ops += len(batch)
+        for future, result, error in results:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)